@@ -0,0 +1,55 @@
+'''
+Array job mode for the batch container.
+One Batch array job covers many inputs listed in a manifest. Each child runs the slice of the
+manifest for its AWS_BATCH_JOB_ARRAY_INDEX, see shared/batch_jobs.py.
+'''
+import argparse
+import json
+import os
+from urllib.parse import urlparse
+
+from batch_jobs import ARRAY_INDEX_ENV, child_jobs
+
+from app.model_registry import DEFAULT_MEMORY_BUDGET_MB
+
+
+def read_manifest(location: str, s3_client=None) -> dict:
+    '''
+    Reads a manifest from an s3://bucket/key URL or a local file path.
+    '''
+    if location.startswith("s3://"):
+        parsed = urlparse(location)
+        response = s3_client.get_object(Bucket=parsed.netloc, Key=parsed.path.lstrip("/"))
+        return json.loads(response["Body"].read())
+    with open(location) as f:
+        return json.load(f)
+
+
+def array_commands(manifest: dict, index: int) -> list:
+    '''
+    The job_runner command lines for the child with the given index.
+    '''
+    return [job["command"] for job in child_jobs(manifest, index)]
+
+
+def parse_array_args(args: list):
+    '''
+    Read in arguments for array job mode
+    '''
+
+    parser = argparse.ArgumentParser(usage='job_runner.py --manifest manifest [optional arguments]',
+                                     description='Runs the slice of a manifest of jobs that belongs to this array job child.',
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('manifest',
+                        type=str,
+                        help='s3://bucket/key URL or local path of the job manifest')
+    parser.add_argument('--array_index',
+                        type=int,
+                        default=int(os.environ.get(ARRAY_INDEX_ENV, 0)),
+                        help=f'Which slice of the manifest to run. Defaults to ${ARRAY_INDEX_ENV}, which Batch sets for array job children')
+    parser.add_argument('--model_cache_mb',
+                        type=int,
+                        default=DEFAULT_MEMORY_BUDGET_MB,
+                        help='Memory budget in MB for keeping loaded models resident between the slice\'s jobs')
+
+    return parser.parse_args(args)
@@ -0,0 +1,53 @@
+'''
+Helpers for running predictions on every protein in a multi-record FASTA.
+'''
+
+# Rough upper bound on the number of residues to put in one batch
+DEFAULT_MAX_BATCH_RESIDUES = 4096
+
+
+def dedupe_sequences(seq_dict: dict) -> dict:
+    '''
+    Maps each unique sequence to the names of every record that contains it.
+    Records keep the order they had in the FASTA.
+    '''
+    names_by_seq = {}
+    for name, seq in seq_dict.items():
+        names_by_seq.setdefault(seq, []).append(name)
+    return names_by_seq
+
+
+def length_batches(sequences: list, max_batch_residues: int = DEFAULT_MAX_BATCH_RESIDUES) -> list:
+    '''
+    Groups sequences of similar length together.
+    Sequences are sorted by length and then packed greedily until a batch would exceed max_batch_residues.
+    A sequence longer than max_batch_residues gets a batch to itself.
+    '''
+    batches = []
+    batch = []
+    batch_residues = 0
+    for seq in sorted(sequences, key=len):
+        if batch and batch_residues + len(seq) > max_batch_residues:
+            batches.append(batch)
+            batch = []
+            batch_residues = 0
+        batch.append(seq)
+        batch_residues += len(seq)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def label_predictions(seq_dict: dict, predictions: dict) -> dict:
+    '''
+    Combines per-protein predictions into one dict suitable for to_fasta.
+
+    predictions maps each unique input sequence to its seq_scores_to_seq_dict output.
+    Every header is prefixed with the name of the protein it was generated from.
+    Duplicate proteins share the same predictions, but each is labeled under its own name.
+    '''
+    labeled = {}
+    for name, seq in seq_dict.items():
+        for header, predicted_seq in predictions[seq].items():
+            labeled[f"{name}|{header}"] = predicted_seq
+    return labeled
@@ -0,0 +1,160 @@
+'''
+Checkpoints for multi-protein jobs, so a job interrupted part way (e.g. a Spot instance being
+reclaimed) can be restarted without predicting the same proteins again.
+
+Finished per-protein predictions are written in chunks under <output key>.partial/. A restarted
+job loads them and only predicts what's missing. The final output is still written with a single
+upload, so readers never see a partial result, and the chunks are deleted after it.
+
+On SIGTERM, which Batch sends before stopping a job, whatever hasn't been written yet is flushed
+and the job exits.
+'''
+import hashlib
+import json
+import signal
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+PARTIAL_SUFFIX = ".partial/"
+# Buffered predictions are written once there are this many, or once the oldest is this old
+DEFAULT_FLUSH_EVERY = 16
+DEFAULT_FLUSH_SECONDS = 30
+# Part of the fingerprint, so chunks written in an older layout are ignored rather than misread
+CHUNK_FORMAT = 3
+# Exit status for a job stopped by SIGTERM, as the shell would report it
+SIGTERM_EXIT_CODE = 128 + signal.SIGTERM
+
+# Checkpoints of the jobs currently predicting, flushed on SIGTERM
+_active = set()
+_active_lock = threading.Lock()
+
+
+class Checkpoint:
+    '''
+    Saved predictions of one job, {protein sequence: {predicted sequence: negLL}}, and in beams
+    {protein sequence: beam size} for those predicted with a smaller beam than the job's.
+    fingerprint identifies everything besides the sequence that affects a prediction (model, beam size).
+    Chunks saved with a different fingerprint are ignored.
+    '''
+
+    def __init__(self, s3_client, bucket: str, output_key: str, fingerprint: str,
+                 flush_every: int = DEFAULT_FLUSH_EVERY, flush_seconds: float = DEFAULT_FLUSH_SECONDS):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = output_key + PARTIAL_SUFFIX
+        self.fingerprint = fingerprint
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.saved = {}
+        self.beams = {}
+        self._pending = {}
+        self._pending_beams = {}
+        self._pending_since = None
+        # Reentrant, since the SIGTERM handler may flush while the main thread is already flushing
+        self._lock = threading.RLock()
+
+    def _keys(self) -> list:
+        keys = []
+        kwargs = {"Bucket": self.bucket, "Prefix": self.prefix}
+        while True:
+            response = self.s3_client.list_objects_v2(**kwargs)
+            keys.extend(obj["Key"] for obj in response.get("Contents", []))
+            if not response.get("IsTruncated"):
+                return keys
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def load(self) -> dict:
+        '''
+        Reads every chunk saved by earlier attempts. Returns {sequence: prediction}.
+        '''
+        for key in self._keys():
+            chunk = json.loads(self.s3_client.get_object(Bucket=self.bucket, Key=key)["Body"].read())
+            if chunk["fingerprint"] == self.fingerprint:
+                self.saved.update(chunk["predictions"])
+                self.beams.update(chunk["beams"])
+        return dict(self.saved)
+
+    def add(self, sequence: str, prediction: dict, reduced_beam: int = None):
+        '''
+        Records a finished prediction, writing a chunk if enough have built up.
+        reduced_beam is the beam it was predicted with, if smaller than the job's.
+        '''
+        with self._lock:
+            self._pending[sequence] = prediction
+            if reduced_beam is not None:
+                self._pending_beams[sequence] = reduced_beam
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            if len(self._pending) >= self.flush_every or time.monotonic() - self._pending_since >= self.flush_seconds:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            pending, pending_beams = self._pending, self._pending_beams
+            chunk = {"fingerprint": self.fingerprint, "predictions": pending, "beams": pending_beams}
+            # Unique names, so a chunk from an attempt that was presumed dead can't overwrite a newer one
+            key = f"{self.prefix}{time.time_ns()}-{uuid.uuid4().hex[:8]}.json"
+            # default=float for scores that are numpy or torch scalars
+            self.s3_client.put_object(Body=json.dumps(chunk, default=float).encode(), Bucket=self.bucket, Key=key)
+            self.saved.update(pending)
+            self.beams.update(pending_beams)
+            self._pending = {}
+            self._pending_beams = {}
+            self._pending_since = None
+
+    def clear(self):
+        '''
+        Deletes the saved chunks, once the final output has been written.
+        '''
+        for key in self._keys():
+            self.s3_client.delete_object(Bucket=self.bucket, Key=key)
+
+    @contextmanager
+    def active(self):
+        '''
+        Flushes this checkpoint if SIGTERM arrives inside the block, and once more at the end of it.
+        '''
+        with _active_lock:
+            _active.add(self)
+        try:
+            yield self
+        finally:
+            with _active_lock:
+                _active.discard(self)
+            self.flush()
+
+
+def job_fingerprint(model_version: str, beam_size: int) -> str:
+    '''
+    model_version identifies the weights rather than where they are, see prediction_store.model_version.
+    '''
+    return hashlib.sha256(f"{model_version}\n{beam_size}\n{CHUNK_FORMAT}".encode()).hexdigest()[:16]
+
+
+def flush_active():
+    with _active_lock:
+        checkpoints = list(_active)
+    for checkpoint in checkpoints:
+        checkpoint.flush()
+
+
+def _handle_sigterm(signum, frame):
+    print("Got SIGTERM, saving checkpoints and exiting")
+    flush_active()
+    raise SystemExit(SIGTERM_EXIT_CODE)
+
+
+@contextmanager
+def handle_sigterm():
+    '''
+    Installs the SIGTERM handler for the duration of the block. Only works on the main thread.
+    '''
+    previous = signal.signal(signal.SIGTERM, _handle_sigterm)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGTERM, previous)
@@ -0,0 +1,146 @@
+'''
+Multi-process CPU inference for --use_cpu jobs.
+
+A single beam search only keeps a few cores busy, so proteins are spread across a pool of
+worker processes instead. Workers are spawned rather than forked: by the time a job predicts, the
+pipeline's other threads may be uploading to S3 or loading the next job's model, and a child
+forked while one of them holds a lock (e.g. in torch or OpenMP) can deadlock. Each worker loads
+the model itself when it starts, with its weights memory-mapped when they can be (see
+model_artifacts.py), so the workers share the weights' pages through the page cache rather than
+each reading a copy. Each worker gets a fixed number of torch intra-op threads so that
+workers x threads matches the cores available.
+'''
+import multiprocessing
+import os
+import signal
+import sys
+from functools import partial
+
+# Memory a worker needs on top of the shared model, mostly beam search activations
+DEFAULT_WORKER_MEMORY_MB = 1024
+# Fewer threads than this per worker and torch's intra-op parallelism stops paying off
+MIN_THREADS_PER_WORKER = 2
+
+def available_cores() -> int:
+    '''
+    Cores this process may use, taking CPU affinity and any cgroup CPU quota (e.g. a container limit) into account.
+    '''
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def available_memory_bytes():
+    '''
+    Memory still free for this process to use, from the cgroup limit if there is one, or None if unknown.
+    '''
+    try:
+        with open("/sys/fs/cgroup/memory.max") as f:
+            limit = f.read().strip()
+        with open("/sys/fs/cgroup/memory.current") as f:
+            current = int(f.read())
+        if limit != "max":
+            return int(limit) - current
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def plan_workers(num_tasks: int, cores: int = None, memory_bytes: int = None,
+                 worker_memory_bytes: int = DEFAULT_WORKER_MEMORY_MB * 2**20) -> tuple:
+    '''
+    Returns (workers, threads_per_worker) for num_tasks independent tasks.
+    Workers are limited by the number of tasks, by cores / MIN_THREADS_PER_WORKER and by how many
+    workers fit in the free memory. Spare cores are spread across the workers as extra threads.
+    '''
+    cores = cores or available_cores()
+    workers = min(num_tasks, max(1, cores // MIN_THREADS_PER_WORKER))
+    if memory_bytes is not None:
+        workers = min(workers, max(1, memory_bytes // worker_memory_bytes))
+    workers = max(1, workers)
+    return workers, max(1, cores // workers)
+
+
+def resolve_workers(requested: int, num_tasks: int, worker_memory_bytes: int = None) -> tuple:
+    '''
+    (workers, threads_per_worker) for a --cpu_workers value, where 0 means pick automatically.
+    worker_memory_bytes replaces the default estimate of the memory each worker needs.
+    '''
+    if requested == 0:
+        return plan_workers(num_tasks, memory_bytes=available_memory_bytes(),
+                            worker_memory_bytes=worker_memory_bytes or DEFAULT_WORKER_MEMORY_MB * 2**20)
+    workers = max(1, min(requested, num_tasks))
+    return workers, max(1, available_cores() // workers)
+
+
+def set_torch_threads(threads: int):
+    # Only if torch is already loaded, e.g. by the model. Importing it just for this would be slow.
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+
+
+def _init_worker(threads: int, initializer, initargs: tuple):
+    # The pool stops its workers with SIGTERM, which shouldn't run the parent's handler (see checkpoint.py)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if initializer:
+        initializer(*initargs)
+    # After the initializer, which may be what imports torch
+    set_torch_threads(threads)
+
+
+def _run(task, indexed_item: tuple):
+    index, item = indexed_item
+    return index, task(item)
+
+
+def parallel_map(task, items: list, workers: int, threads_per_worker: int, cost=len, on_result=None,
+                 initializer=None, initargs: tuple = ()) -> list:
+    '''
+    Returns [task(item) for item in items], computed by workers spawned processes.
+
+    task, items, initializer and initargs are pickled to the workers, so they must be module level
+    functions and plain data, and so must the results sent back. initializer(*initargs) runs once in
+    each worker before any task, e.g. to load the model the tasks use. Items are handed out most
+    expensive first by cost(item), which keeps one long protein from finishing last, and the results
+    are put back in the order of items no matter which worker finishes first.
+    on_result(item, result) is called in this process as each result arrives, e.g. to checkpoint it.
+    With one worker or item everything runs in this process instead, initializer included.
+    '''
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        if initializer:
+            initializer(*initargs)
+        set_torch_threads(workers * threads_per_worker)
+        results = []
+        for item in items:
+            results.append(task(item))
+            if on_result:
+                on_result(item, results[-1])
+        return results
+
+    order = sorted(range(len(items)), key=lambda i: cost(items[i]), reverse=True)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(workers, initializer=_init_worker, initargs=(threads_per_worker, initializer, initargs)) as pool:
+        results = {}
+        for index, result in pool.imap_unordered(partial(_run, task), ((i, items[i]) for i in order), chunksize=1):
+            results[index] = result
+            if on_result:
+                on_result(items[index], result)
+    return [results[i] for i in range(len(items))]
@@ -0,0 +1,142 @@
+'''
+Queues of job descriptors for the long-lived worker mode.
+
+A job descriptor is a JSON object of the form {"command": [...]}, where the command is the same
+argument list the Batch job definition would pass to job_runner.py.
+'''
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager, nullcontext
+
+CLAIMED_SUFFIX = ".claimed"
+FAILED_DIR = "failed"
+# How long a received SQS message stays hidden from other workers. keep_alive extends it while the job runs.
+DEFAULT_VISIBILITY_TIMEOUT = 5 * 60
+# Visibility is extended this many times per timeout, so one slow or failed request doesn't let the job reappear
+HEARTBEATS_PER_TIMEOUT = 3
+
+
+class DirectoryJobQueue:
+    '''
+    Uses a local directory as a queue. Each *.json file in the directory is one job descriptor.
+    Jobs are claimed by renaming, so several workers can safely share one directory.
+    Jobs that fail are moved to the failed/ subdirectory.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.join(path, FAILED_DIR), exist_ok=True)
+
+    def put(self, descriptor: dict) -> str:
+        '''
+        Adds a job to the queue. Written under a temporary name first so a worker never sees a partial file.
+        '''
+        name = f"{uuid.uuid4().hex}.json"
+        tmp_path = os.path.join(self.path, f".{name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(descriptor, f)
+        os.rename(tmp_path, os.path.join(self.path, name))
+        return name
+
+    def receive(self):
+        '''
+        Claims the oldest job in the queue.
+        Returns a (descriptor, handle) tuple, or None if the queue is empty.
+        '''
+        entries = [entry for entry in os.scandir(self.path) if entry.is_file() and entry.name.endswith(".json")]
+        for entry in sorted(entries, key=lambda e: e.stat().st_mtime):
+            claimed_path = entry.path + CLAIMED_SUFFIX
+            try:
+                os.rename(entry.path, claimed_path)
+            except FileNotFoundError:
+                # Another worker claimed it first
+                continue
+            with open(claimed_path) as f:
+                return json.load(f), claimed_path
+        return None
+
+    def ack(self, handle: str):
+        os.remove(handle)
+
+    def keep_alive(self, handle: str):
+        # A claimed file stays claimed however long its job runs
+        return nullcontext()
+
+    def fail(self, handle: str):
+        name = os.path.basename(handle)[:-len(CLAIMED_SUFFIX)]
+        os.rename(handle, os.path.join(self.path, FAILED_DIR, name))
+
+
+class SQSJobQueue:
+    '''
+    Uses an SQS queue, where each message body is one job descriptor.
+    Failed jobs are left on the queue so SQS's redrive policy decides whether they are retried.
+    '''
+
+    def __init__(self, queue_url: str, wait_seconds: int = 20, visibility_timeout: int = DEFAULT_VISIBILITY_TIMEOUT,
+                 sqs_client=None):
+        self.queue_url = queue_url
+        self.wait_seconds = wait_seconds
+        self.visibility_timeout = visibility_timeout
+        self.heartbeat_seconds = visibility_timeout / HEARTBEATS_PER_TIMEOUT
+        if sqs_client is None:
+            # Imported here so that starting the container doesn't wait on boto3 unless it's needed
+            import boto3
+            sqs_client = boto3.client('sqs')
+        self.sqs_client = sqs_client
+
+    def receive(self):
+        resp = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=1,
+            WaitTimeSeconds=self.wait_seconds,
+            VisibilityTimeout=self.visibility_timeout,
+        )
+        messages = resp.get("Messages", [])
+        if not messages:
+            return None
+        message = messages[0]
+        return json.loads(message["Body"]), message["ReceiptHandle"]
+
+    def ack(self, handle: str):
+        self.sqs_client.delete_message(QueueUrl=self.queue_url, ReceiptHandle=handle)
+
+    @contextmanager
+    def keep_alive(self, handle: str):
+        '''
+        Keeps the message hidden while the block runs, so a beam search longer than the visibility timeout
+        isn't delivered to another worker and run twice. SQS stops extending a message 12 hours after it was received.
+        '''
+        stop = threading.Event()
+
+        def heartbeat():
+            while not stop.wait(self.heartbeat_seconds):
+                try:
+                    self.sqs_client.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=handle,
+                                                              VisibilityTimeout=self.visibility_timeout)
+                except Exception as e:
+                    # The next heartbeat tries again before the message reappears
+                    print(f"Could not extend the job's visibility: {e!r}")
+
+        thread = threading.Thread(target=heartbeat, name="sqs-heartbeat", daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def fail(self, handle: str):
+        # Make the message visible again right away instead of waiting out the visibility timeout
+        self.sqs_client.change_message_visibility(QueueUrl=self.queue_url, ReceiptHandle=handle, VisibilityTimeout=0)
+
+
+def open_queue(location: str):
+    '''
+    Opens an SQS queue if given an SQS queue URL, otherwise treats location as a local directory.
+    '''
+    if location.startswith("https://sqs."):
+        return SQSJobQueue(location)
+    return DirectoryJobQueue(location)
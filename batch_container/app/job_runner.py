@@ -1,45 +1,368 @@
 import argparse
 import io
+import json
 import sys
+from functools import partial
 
-import boto3
+from content_encoding import ENCODINGS, IDENTITY, compress, object_headers, open_decompressed
+from instrumentation import JobMetrics
 
-from collage.fasta import parse_fasta, to_fasta
-from collage.generator import beam_generator, seq_scores_to_seq_dict
-from collage.model import initialize_collage_model
+from app.batching import DEFAULT_MAX_BATCH_RESIDUES, dedupe_sequences, label_predictions, length_batches
+from app.array_job import array_commands, parse_array_args, read_manifest
+from app.checkpoint import Checkpoint, handle_sigterm, job_fingerprint
+from app.cpu_engine import available_cores, parallel_map, resolve_workers, set_torch_threads
+from app.lazy_imports import LazyModule, lazy_function
+from app.memory_model import AdaptiveMemory, LoadTracker, MemoryProbe, load_memory_model, save_memory_model
+from app.model_artifacts import load_model
+from app.model_registry import ModelRegistry
+from app.pipeline import run_pipeline, upload_bytes
+from app.prediction_store import (DEFAULT_CACHE_DIR, S3, STORE_MODES, ModelPredictions, PredictionStore,
+                                  model_version)
+from app.prediction_store import NONE as NO_STORE
+from app.progress import DEFAULT_MIN_INTERVAL_SECONDS, ProgressReporter
+from app.scores_output import NONE, SCORES_FORMATS, resolve_format, serialize_scores
+from app.worker import parse_worker_args, run_worker
 
+# Imported on first use, so --help and argument errors don't wait on boto3, collage and torch. See lazy_imports.py
+boto3 = LazyModule("boto3")
+parse_fasta = lazy_function("collage.fasta", "parse_fasta")
+to_fasta = lazy_function("collage.fasta", "to_fasta")
+beam_generator = lazy_function("collage.generator", "beam_generator")
+seq_scores_to_seq_dict = lazy_function("collage.generator", "seq_scores_to_seq_dict")
+initialize_collage_model = lazy_function("collage.model", "initialize_collage_model")
 
-def download_predict_upload(bucket, object_name, input_prefix, output_prefix, model_path, beam_size, use_cpu):
-    print(f"{bucket=} {object_name=} {input_prefix=} {output_prefix=}")
-    s3_client = boto3.client('s3')
-    input_key = input_prefix + object_name
+OUTPUT_CONTENT_TYPE = "text/plain; charset=utf-8"
+# Written next to the output when memory_mode adaptive reduced the beam for any protein, see upload in run_jobs
+REDUCED_BEAMS_SUFFIX = ".reduced_beams.json"
+FIXED = "fixed"
+ADAPTIVE = "adaptive"
+MEMORY_MODES = (FIXED, ADAPTIVE)
+
+# The model and settings of a --cpu_workers process, see init_cpu_worker
+_cpu_worker = {}
+
+
+def predict_protein(model, protein: str, beam_size: int, memory: AdaptiveMemory = None) -> tuple:
+    '''
+    Returns (beam search scores, beam size used). With memory the beam may be reduced, see memory_model.py.
+    '''
+    if memory:
+        return memory.predict(lambda protein, beam: beam_generator(model, protein, max_seqs=beam), protein, beam_size)
+    return beam_generator(model, protein, max_seqs=beam_size), beam_size
+
+
+def init_cpu_worker(load_worker_model, beam_size: int, memory: AdaptiveMemory):
+    '''
+    Runs in each process of a --cpu_workers pool, loading the model its predictions use.
+    '''
+    _cpu_worker.update(model=load_worker_model(), beam_size=beam_size, memory=memory)
+
+
+def predict_in_cpu_worker(protein: str) -> tuple:
+    return predict_protein(_cpu_worker["model"], protein, _cpu_worker["beam_size"], _cpu_worker["memory"])
+
+
+def predict_scores(model, proteins: list, beam_size: int, max_batch_residues: int, cpu_workers: int = 1,
+                   checkpoint: Checkpoint = None, on_result=None, memory: AdaptiveMemory = None,
+                   store: ModelPredictions = None, load_worker_model=None, on_predicted=None) -> dict:
+    '''
+    Runs a prediction for every protein in a list of unique sequences.
+    Returns each protein's beam search scores, {predicted sequence: negLL}.
+    With cpu_workers other than 1 and load_worker_model, a picklable function that loads the model on the CPU,
+    proteins are spread across that many processes (0 picks automatically), each loading the model with it.
+    See cpu_engine.py.
+    With a checkpoint, proteins it already has are skipped and new predictions are added to it, along with the
+    beams of those that memory reduced.
+    on_result(protein, negLLs) is also called as each new prediction finishes, and on_predicted(protein) only for
+    those the model made rather than the checkpoint or store.
+    With memory, beam sizes are fitted to the memory free, see memory_model.py.
+    With a store, proteins it has are taken from it, and new predictions made with the full beam are saved to it.
+    '''
+    scores = {seq: checkpoint.saved[seq] for seq in proteins if seq in checkpoint.saved} if checkpoint else {}
+    todo = [seq for seq in proteins if seq not in scores]
+    print(f"{len(proteins)} unique proteins, {len(scores)} already done")
+    if checkpoint and memory:
+        # So that proteins predicted with a smaller beam before the job was interrupted are still reported
+        for seq in scores:
+            if seq in checkpoint.beams:
+                memory.record_beam(seq, checkpoint.beams[seq], beam_size)
+
+    def report(protein, negLLs, beam=beam_size):
+        scores[protein] = negLLs
+        if checkpoint:
+            checkpoint.add(protein, negLLs, beam if beam < beam_size else None)
+        if on_result:
+            on_result(protein, negLLs)
+
+    if store and todo:
+        stored = store.get_many(todo)
+        print(f"{len(stored)} found in the prediction store")
+        for protein, negLLs in stored.items():
+            report(protein, negLLs)
+        todo = [seq for seq in todo if seq not in stored]
+
+    def predict(protein):
+        return predict_protein(model, protein, beam_size, memory)
+
+    def finished(protein, result):
+        negLLs, beam = result
+        if memory:
+            memory.record_beam(protein, beam, beam_size)
+        if store and beam == beam_size:
+            store.put(protein, negLLs)
+        if on_predicted:
+            on_predicted(protein)
+        report(protein, negLLs, beam)
+
+    if cpu_workers != 1 and load_worker_model and len(todo) > 1:
+        # Workers get a copy of memory, so what they learn isn't kept, but how many fit is planned from it
+        workers, threads = resolve_workers(cpu_workers, len(todo),
+                                           memory.worker_memory_bytes(todo, beam_size) if memory else None)
+        if workers > 1:
+            print(f"Predicting {len(todo)} proteins with {workers} CPU workers, {threads} threads each")
+            parallel_map(predict_in_cpu_worker, todo, workers, threads, on_result=finished,
+                         initializer=init_cpu_worker, initargs=(load_worker_model, beam_size, memory))
+            return scores
+        set_torch_threads(threads)
+
+    for batch in length_batches(todo, max_batch_residues):
+        print(f"Predicting batch of {len(batch)} proteins, lengths {len(batch[0])}-{len(batch[-1])}")
+        for protein in batch:
+            finished(protein, predict(protein))
+    return scores
+
+
+def scores_by_protein(seq_dict: dict, scores: dict) -> dict:
+    '''
+    {protein name: {predicted sequence: negLL}} for every protein in seq_dict, from predict_scores' results.
+    '''
+    return {name: scores[seq] for name, seq in seq_dict.items()}
+
+
+def load_collage_model(model_path: str, use_gpu: bool):
+    '''
+    initialize_collage_model, mapping the model's weights if the image has an artifact for it (see model_artifacts.py).
+    '''
+    return load_model(model_path, use_gpu, initialize_collage_model)
+
+
+def fetch_input(s3_client, bucket: str, input_key: str, metrics: JobMetrics) -> dict:
     print(f"{input_key=}")
-    resp = s3_client.get_object(
-        Bucket=bucket,
-        Key=input_key,
-    )
-
-    input_stream = resp["Body"]
-    with io.TextIOWrapper(input_stream, encoding="utf-8") as input_fasta:
-        seq_dict = parse_fasta(input_fasta, True)
-
-    print(seq_dict)
-    # Currently only makes predictions for first protein in FASTA
-    # TODO(auberon): Allow multi-protein predictions?
-    first_protein = list(seq_dict.values())[0]
-    model = initialize_collage_model(model_path, not use_cpu)
-    negLLs = beam_generator(model, first_protein, max_seqs=beam_size)
-
-    seq_dict = seq_scores_to_seq_dict(negLLs)
-    output_fasta = to_fasta(seq_dict)
-    output_key = output_prefix + object_name
-    print(f"{output_key=}")
-    s3_client.put_object(
-        Body=output_fasta,
-        Bucket=bucket,
-        Key=output_key,
-    )
-    print("Predictions uploaded")
+    with metrics.stage("s3_get"):
+        resp = s3_client.get_object(
+            Bucket=bucket,
+            Key=input_key,
+        )
+        input_bytes = resp["Body"].read()
+    metrics.put_metric("input_bytes", len(input_bytes), "Bytes")
+
+    with metrics.stage("fasta_parse"):
+        # gzip and zstd inputs are decompressed as they're parsed, see shared/content_encoding.py
+        reader, encoding = open_decompressed(io.BytesIO(input_bytes))
+        metrics.set_property("input_encoding", encoding)
+        with io.TextIOWrapper(reader, encoding="utf-8") as input_fasta:
+            seq_dict = parse_fasta(input_fasta, True)
+    metrics.record_sequence_lengths(len(seq) for seq in seq_dict.values())
+    return seq_dict
+
+
+def predict_output(model, seq_dict: dict, beam_size: int, multi_protein: bool, max_batch_residues: int,
+                   metrics: JobMetrics, cpu_workers: int = 1, checkpoint: Checkpoint = None,
+                   progress: ProgressReporter = None, memory: AdaptiveMemory = None,
+                   store: ModelPredictions = None, load_worker_model=None) -> tuple:
+    '''
+    Returns (output FASTA, {protein name: {predicted sequence: negLL}}, {protein name: beam size used}) for the
+    proteins that were predicted, the last only holding those whose beam memory reduced.
+    With progress, the proteins to predict and each one finished are reported to it.
+    See predict_scores for memory, store and load_worker_model.
+    '''
+    metrics.set_property("beam_size", beam_size)
+    # Proteins the model predicted, not those from the checkpoint or store
+    predicted = []
+    try:
+        with metrics.stage("beam_search"):
+            if multi_protein:
+                proteins = list(dedupe_sequences(seq_dict))
+                if progress:
+                    progress.set_total(len(proteins),
+                                       sum(seq in checkpoint.saved for seq in proteins) if checkpoint else 0)
+                scores = predict_scores(model, proteins, beam_size, max_batch_residues, cpu_workers, checkpoint,
+                                        progress.protein_done if progress else None, memory, store, load_worker_model,
+                                        predicted.append)
+                protein_scores = scores_by_protein(seq_dict, scores)
+            else:
+                if cpu_workers != 1:
+                    # One beam search can't be split across processes, so give it every core instead
+                    set_torch_threads(available_cores())
+                # Without --multi_protein only the first protein in the FASTA is predicted
+                first_name, first_protein = next(iter(seq_dict.items()))
+                if progress:
+                    progress.set_total(1)
+                stored = store.get_many([first_protein]) if store else {}
+                if first_protein in stored:
+                    negLLs = stored[first_protein]
+                else:
+                    negLLs, beam = predict_protein(model, first_protein, beam_size, memory)
+                    predicted.append(first_protein)
+                    if store and beam == beam_size:
+                        store.put(first_protein, negLLs)
+                protein_scores = {first_name: negLLs}
+                if progress:
+                    progress.protein_done()
+    finally:
+        # The work actually done, which is what request_job's CPU/GPU routing is calibrated against.
+        # Proteins taken from elsewhere are counted by the resumed_proteins and store_hits metrics.
+        metrics.put_metric("predicted_sequences", len(predicted), "Count")
+        metrics.put_metric("predicted_residues", sum(len(seq) for seq in predicted), "Count")
+    reduced_beams = {name: memory.reduced_beams[seq] for name, seq in seq_dict.items()
+                     if name in protein_scores and seq in memory.reduced_beams} if memory else {}
+
+    with metrics.stage("serialize"):
+        if multi_protein:
+            labeled = {seq: seq_scores_to_seq_dict(negLLs) for seq, negLLs in scores.items()}
+            return to_fasta(label_predictions(seq_dict, labeled)), protein_scores, reduced_beams
+        return to_fasta(seq_scores_to_seq_dict(negLLs)), protein_scores, reduced_beams
+
+
+def run_jobs(jobs: list, s3_client=None, model_loader=None):
+    '''
+    Runs jobs through the download/predict/upload pipeline.
+    Each job is a dict of download_predict_upload's arguments, e.g. vars(parse_args(...)).
+    s3_client and model_loader may be passed in to reuse them across calls, as the worker mode does.
+    Emits one structured metrics line per job, including for jobs that fail.
+    Jobs with a progress_interval write their progress to S3 at most that often, see progress.py.
+    Jobs with memory_mode adaptive retry proteins that run out of memory with smaller beams, see memory_model.py.
+    The beam sizes used for those proteins are written to <output>.reduced_beams.json, before the output itself.
+    Jobs with a prediction_store reuse predictions of the same proteins by earlier jobs, see prediction_store.py.
+    '''
+    s3_client = s3_client or boto3.client('s3')
+    model_loader = model_loader or load_collage_model
+    jobs = [dict(job) for job in jobs]
+    # (bucket, device) -> MemoryModel, shared by the adaptive jobs using that device
+    memory_models = {}
+    # Model loads, which run alongside other jobs' predictions and mustn't be learned from as if part of them
+    loads = LoadTracker()
+    # (store mode, bucket, cache dir) -> PredictionStore
+    stores = {}
+    for job in jobs:
+        on_stage = None
+        if job.get("progress_interval"):
+            job["progress"] = ProgressReporter(s3_client, job["bucket"], job["object_name"], job["progress_interval"])
+            on_stage = job["progress"].on_stage
+        job["metrics"] = JobMetrics("job_runner", job_id=job["object_name"], on_stage=on_stage)
+        if job.get("memory_mode") == ADAPTIVE:
+            device = "cpu" if job["use_cpu"] else "gpu"
+            if (job["bucket"], device) not in memory_models:
+                memory_models[job["bucket"], device] = load_memory_model(s3_client, job["bucket"], device)
+            job["memory"] = AdaptiveMemory(memory_models[job["bucket"], device], MemoryProbe(not job["use_cpu"]),
+                                           loads)
+        store_mode = job.get("prediction_store", NO_STORE)
+        if store_mode != NO_STORE:
+            store_key = (store_mode, job["bucket"], job.get("prediction_cache_dir", DEFAULT_CACHE_DIR))
+            if store_key not in stores:
+                stores[store_key] = PredictionStore(s3_client if store_mode == S3 else None, job["bucket"],
+                                                    store_key[2])
+            job["store"] = stores[store_key].for_model(model_version(job["model_path"]), job["beam_size"])
+        job["metrics"].set_property("succeeded", False)
+        job["metrics"].set_property("device", "cpu" if job["use_cpu"] else "gpu")
+
+    def fetch(job):
+        seq_dict = fetch_input(s3_client, job["bucket"], job["input_prefix"] + job["object_name"], job["metrics"])
+        if job["multi_protein"]:
+            # Only multi-protein jobs have intermediate results worth saving
+            job["checkpoint"] = Checkpoint(s3_client, job["bucket"], job["output_prefix"] + job["object_name"],
+                                           job_fingerprint(model_version(job["model_path"]), job["beam_size"]))
+            resumed = len(job["checkpoint"].load())
+            job["metrics"].put_metric("resumed_proteins", resumed, "Count")
+        return seq_dict
+
+    def load_model(job):
+        with job["metrics"].stage("model_init"), loads.loading():
+            return model_loader(job["model_path"], not job["use_cpu"])
+
+    def predict(model, job, seq_dict):
+        cpu_workers = job["cpu_workers"] if job["use_cpu"] else 1
+        checkpoint = job.get("checkpoint")
+        # CPU workers load the model themselves, with the loader behind a ModelRegistry rather than the registry
+        load_worker_model = partial(getattr(model_loader, "load_model", model_loader), job["model_path"], False)
+        options = dict(cpu_workers=cpu_workers, progress=job.get("progress"), memory=job.get("memory"),
+                       store=job.get("store"), load_worker_model=load_worker_model)
+        # Jobs run one after another in this process, so each one's peak GPU memory is its own
+        with job["metrics"].peak_memory():
+            if checkpoint is None:
+                return predict_output(model, seq_dict, job["beam_size"], job["multi_protein"],
+                                      job["max_batch_residues"], job["metrics"], **options)
+            with checkpoint.active():
+                return predict_output(model, seq_dict, job["beam_size"], job["multi_protein"],
+                                      job["max_batch_residues"], job["metrics"], checkpoint=checkpoint, **options)
+
+    def upload(job, output):
+        output_fasta, protein_scores, reduced_beams = output
+        output_key = job["output_prefix"] + job["object_name"]
+        if reduced_beams:
+            # Written before the FASTA, so that whoever reads the output can tell it's missing sequences
+            upload_bytes(s3_client, job["bucket"], output_key + REDUCED_BEAMS_SUFFIX,
+                         json.dumps({"beamSize": job["beam_size"], "reducedBeams": reduced_beams}).encode(),
+                         ContentType="application/json")
+        scores_format = resolve_format(job["scores_format"])
+        if scores_format != NONE:
+            with job["metrics"].stage("scores_serialize"):
+                scores_body, suffix, content_type = serialize_scores(protein_scores, scores_format)
+            # Written before the FASTA, so that once the FASTA exists the scores do too
+            with job["metrics"].stage("scores_put"):
+                upload_bytes(s3_client, job["bucket"], output_key + suffix, scores_body, ContentType=content_type)
+            job["metrics"].put_metric("scores_bytes", len(scores_body), "Bytes")
+        print(f"{output_key=}")
+        encoding = job["output_encoding"]
+        body = output_fasta
+        if encoding != IDENTITY:
+            with job["metrics"].stage("compress"):
+                body = compress(output_fasta.encode("utf-8"), encoding)
+            job["metrics"].put_metric("output_uncompressed_bytes", len(output_fasta), "Bytes")
+        with job["metrics"].stage("s3_put"):
+            upload_bytes(s3_client, job["bucket"], output_key, body, **object_headers(encoding, OUTPUT_CONTENT_TYPE))
+        job["metrics"].put_metric("output_bytes", len(body), "Bytes")
+        job["metrics"].set_property("succeeded", True)
+        print("Predictions uploaded")
+        if job.get("checkpoint"):
+            job["checkpoint"].clear()
+
+    try:
+        run_pipeline(jobs, fetch, load_model, predict, upload)
+    finally:
+        for job in jobs:
+            if job.get("progress"):
+                # Whatever was left waiting out the rate limit, so the last record shows where the job ended
+                job["progress"].flush()
+                job["metrics"].put_metric("progress_writes", job["progress"].writes, "Count")
+            if job.get("memory"):
+                job["metrics"].put_metric("reduced_beam_proteins", job["memory"].reduced_proteins, "Count")
+                job["metrics"].put_metric("out_of_memory_retries", job["memory"].out_of_memory_retries, "Count")
+            if job.get("store"):
+                job["metrics"].put_metric("store_hits", job["store"].hits, "Count")
+                job["metrics"].put_metric("store_local_hits", job["store"].local_hits, "Count")
+                job["metrics"].put_metric("store_misses", job["store"].misses, "Count")
+            job["metrics"].emit()
+        for (bucket, device), memory_model in memory_models.items():
+            if memory_model.observations:
+                save_memory_model(s3_client, bucket, device, memory_model)
+
+
+def download_predict_upload(bucket, object_name, input_prefix, output_prefix, model_path, beam_size, use_cpu,
+                            multi_protein=False, max_batch_residues=DEFAULT_MAX_BATCH_RESIDUES, cpu_workers=1,
+                            output_encoding=IDENTITY, scores_format=NONE, progress_interval=0, memory_mode=FIXED,
+                            prediction_store=NO_STORE, prediction_cache_dir=DEFAULT_CACHE_DIR, s3_client=None,
+                            model_loader=None):
+    '''
+    Runs a single job. The input download overlaps with the model load.
+    '''
+    print(f"{bucket=} {object_name=} {input_prefix=} {output_prefix=}")
+    job = dict(bucket=bucket, object_name=object_name, input_prefix=input_prefix, output_prefix=output_prefix,
+               model_path=model_path, beam_size=beam_size, use_cpu=use_cpu, multi_protein=multi_protein,
+               max_batch_residues=max_batch_residues, cpu_workers=cpu_workers, output_encoding=output_encoding,
+               scores_format=scores_format, progress_interval=progress_interval, memory_mode=memory_mode,
+               prediction_store=prediction_store, prediction_cache_dir=prediction_cache_dir)
+    run_jobs([job], s3_client, model_loader)
 
 
 def parse_args(args: list):
@@ -47,7 +370,7 @@ def parse_args(args: list):
     Read in arguments
     '''
 
-    parser = argparse.ArgumentParser(usage='job_runner.py [optional arguments] bucket_name object_name input_prefix output_prefix',
+    parser = argparse.ArgumentParser(usage='job_runner.py [optional arguments] bucket_name object_name input_prefix output_prefix\n       job_runner.py --worker [optional arguments] queue\n       job_runner.py --manifest manifest [optional arguments]',
                                      description='Downloads an input FASTA from s3, runs a collage prediction on it, and uploads the result.',
                                      formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('bucket',
@@ -73,13 +396,104 @@ def parse_args(args: list):
     parser.add_argument('--use_cpu',
                         action='store_true',
                         help='Use CPU for CoLLAGE training instead of GPU')
+    parser.add_argument('--multi_protein',
+                        action='store_true',
+                        help='Make predictions for every protein in the FASTA instead of only the first')
+    parser.add_argument('--max_batch_residues',
+                        type=int,
+                        default=DEFAULT_MAX_BATCH_RESIDUES,
+                        help='Maximum total residues per length-sorted batch when using --multi_protein')
+    parser.add_argument('--output_encoding',
+                        choices=ENCODINGS,
+                        default=IDENTITY,
+                        help='Compression for the output FASTA. It is stored with a matching ContentEncoding, so browsers decompress it on download.\nOther clients, e.g. boto3 or curl without --compressed, get the compressed bytes')
+    parser.add_argument('--cpu_workers',
+                        type=int,
+                        default=0,
+                        help='With --use_cpu, processes to spread proteins across. 0 picks from the cores and memory available, 1 uses a single process')
+    parser.add_argument('--scores_format',
+                        choices=SCORES_FORMATS,
+                        default=NONE,
+                        help='Also write the scores as a columnar file next to the output, <output>.scores.parquet or <output>.scores.bin.\nauto writes Parquet if pyarrow is installed, and the binary format described in scores_output.py otherwise')
+
+    parser.add_argument('--progress_interval',
+                        type=float,
+                        default=DEFAULT_MIN_INTERVAL_SECONDS,
+                        help='Minimum seconds between writes of the job\'s progress to progress/<object_name>.json. 0 turns progress off')
+    parser.add_argument('--memory_mode',
+                        choices=MEMORY_MODES,
+                        default=FIXED,
+                        help='adaptive halves the beam size and retries a protein that runs out of memory, and records the beam sizes used in <output>.reduced_beams.json, see memory_model.py.\nfixed always uses --beam_size')
+
+    parser.add_argument('--prediction_store',
+                        choices=STORE_MODES,
+                        default=NO_STORE,
+                        help='Reuse predictions of proteins that earlier jobs predicted with the same model and beam size, see prediction_store.py.\ns3 shares them between jobs through the bucket, with a local cache on disk. local only uses the disk cache')
+    parser.add_argument('--prediction_cache_dir',
+                        type=str,
+                        default=DEFAULT_CACHE_DIR,
+                        help='Directory for the local cache of the prediction store')
 
     return parser.parse_args(args)
 
 
+def run_worker_mode(args: list):
+    '''
+    Runs jobs from a queue, sharing one S3 client and a cache of loaded models between jobs.
+    '''
+    worker_args = parse_worker_args(args)
+    s3_client = boto3.client('s3')
+    model_registry = ModelRegistry(load_collage_model, worker_args.model_cache_mb * 2**20)
+    model_registry.preload(worker_args.preload_species, not worker_args.use_cpu)
+
+    def run_job(descriptor: dict):
+        job_args = parse_args(descriptor["command"])
+        download_predict_upload(**vars(job_args), s3_client=s3_client, model_loader=model_registry)
+        print(f"Model cache stats: {model_registry.stats()}")
+
+    run_worker(worker_args.queue, run_job, worker_args.idle_timeout, worker_args.poll_interval)
+
+
+def object_exists(s3_client, bucket: str, key: str) -> bool:
+    from botocore.exceptions import ClientError
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        # The job role may only list output/, and without ListBucket S3 answers 403 rather than 404 for a missing key
+        if e.response["Error"]["Code"] in ("403", "404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+
+def run_array_mode(args: list):
+    '''
+    Runs this array job child's slice of a manifest through one pipeline, sharing loaded models between its jobs.
+    '''
+    array_args = parse_array_args(args)
+    s3_client = boto3.client('s3')
+    commands = array_commands(read_manifest(array_args.manifest, s3_client), array_args.array_index)
+    print(f"Array index {array_args.array_index} has {len(commands)} jobs")
+    jobs = [vars(parse_args(command)) for command in commands]
+    # A job that fails doesn't stop the rest of the slice, but fails the child. When Batch retries it, only the
+    # jobs without an output are run again.
+    jobs = [job for job in jobs
+            if not object_exists(s3_client, job["bucket"], job["output_prefix"] + job["object_name"])]
+    print(f"{len(commands) - len(jobs)} already have outputs")
+    model_registry = ModelRegistry(load_collage_model, array_args.model_cache_mb * 2**20)
+    run_jobs(jobs, s3_client, model_registry)
+
+
 def main(args):
     print(f"The arguments I got were: {args}")
-    download_predict_upload(**vars(parse_args(args)))
+    # Batch sends SIGTERM before stopping a job, e.g. when a Spot instance is reclaimed
+    with handle_sigterm():
+        if args and args[0] == "--worker":
+            run_worker_mode(args[1:])
+        elif args and args[0] == "--manifest":
+            run_array_mode(args[1:])
+        else:
+            download_predict_upload(**vars(parse_args(args)))
 
 
 if __name__ == "__main__":
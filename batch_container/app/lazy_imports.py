@@ -0,0 +1,31 @@
+'''
+Stand-ins for heavy modules that import them on first use.
+
+boto3 and collage (which brings in torch) take seconds to import. Deferring them means
+--help and argument errors return straight away, and the model starts loading sooner since
+nothing else waits on them.
+'''
+import importlib
+
+
+class LazyModule:
+    '''
+    Stands in for a module and imports it on first attribute access.
+    '''
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+def lazy_function(module_name: str, name: str):
+    '''
+    A stand-in for module_name.name that imports the module on first call.
+    '''
+    def call(*args, **kwargs):
+        return getattr(importlib.import_module(module_name), name)(*args, **kwargs)
+    call.__name__ = call.__qualname__ = name
+    call.__doc__ = f"Calls {module_name}.{name}, importing it on first use."
+    return call
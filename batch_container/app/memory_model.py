@@ -0,0 +1,277 @@
+'''
+Out of memory retries for --memory_mode adaptive, so a long protein with a large beam doesn't
+fail the whole job by running out of GPU or host memory.
+
+A beam search keeps every beam's activations at once, so the beam is the batch whose size is
+adapted here. Every protein is first run with the full beam size. Only if it actually runs out of
+memory is the beam halved and the protein retried, down to a single beam before the error is let
+through. A reduced beam returns fewer predicted sequences for that protein, which is logged,
+counted and recorded next to the job's output (see job_runner.py), rather than no output for the
+job at all.
+
+The memory a protein needs on top of the loaded model is estimated as bytes_per_beam_residue x
+length x beam size, for planning how many CPU workers fit in memory. bytes_per_beam_residue is
+learned from the peak memory of each beam search, and from the memory that was free when one ran
+out. The learned model is stored in S3 under MEMORY_MODEL_PREFIX, one per device, so later jobs
+start from it instead of the default. Jobs running at the same time each write their own, and the
+last one to finish wins. Peak memory is measured for the whole process (and the whole device, on
+the GPU), so nothing is learned from a beam search that overlapped a model load, e.g. the next
+job's on the pipeline's model thread. See LoadTracker.
+'''
+import gc
+import json
+import resource
+import sys
+import threading
+from contextlib import contextmanager
+
+from instrumentation import hold_peak_gpu_bytes
+
+from app.cpu_engine import available_memory_bytes
+
+MEMORY_MODEL_PREFIX = "memory-models/"
+# Roughly what a 300 residue protein with a beam of 100 needs on the CPU, used until something is learned
+DEFAULT_BYTES_PER_BEAM_RESIDUE = 32 * 2**10
+# Estimates are scaled up by this, since the next protein may need a little more than any seen so far
+HEADROOM = 1.2
+# Each observation lets the learned value drop by this much, so one unusual peak doesn't inflate estimates forever
+DECAY = 0.99
+MIN_BEAM_SIZE = 1
+
+
+def memory_model_key(device: str) -> str:
+    return f"{MEMORY_MODEL_PREFIX}{device}.json"
+
+
+def is_out_of_memory(error: BaseException) -> bool:
+    # torch.cuda.OutOfMemoryError is a RuntimeError, as were CUDA and CPU allocation failures in older torch
+    return isinstance(error, MemoryError) or (isinstance(error, RuntimeError) and "out of memory" in str(error))
+
+
+class MemoryModel:
+    '''
+    Estimated bytes a beam search needs on top of the loaded model, for a protein length and beam size.
+    '''
+
+    def __init__(self, bytes_per_beam_residue: float = DEFAULT_BYTES_PER_BEAM_RESIDUE, observations: int = 0):
+        self.bytes_per_beam_residue = bytes_per_beam_residue
+        self.observations = observations
+
+    def estimate(self, length: int, beam_size: int) -> int:
+        return int(HEADROOM * self.bytes_per_beam_residue * max(1, length) * beam_size)
+
+    def observe(self, length: int, beam_size: int, peak_bytes: int):
+        '''
+        Learns from a beam search that needed peak_bytes. The first observation replaces the default.
+        '''
+        ratio = peak_bytes / (max(1, length) * beam_size)
+        if self.observations == 0:
+            self.bytes_per_beam_residue = ratio
+        else:
+            self.bytes_per_beam_residue = max(ratio, self.bytes_per_beam_residue * DECAY)
+        self.observations += 1
+
+    def observe_out_of_memory(self, length: int, beam_size: int, free_bytes: int):
+        '''
+        Learns from a beam search that ran out of memory with free_bytes free, so needed more than that.
+        '''
+        self.bytes_per_beam_residue = max(self.bytes_per_beam_residue, free_bytes / (max(1, length) * beam_size))
+        self.observations += 1
+
+    def to_dict(self) -> dict:
+        return {"bytesPerBeamResidue": self.bytes_per_beam_residue, "observations": self.observations}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(data["bytesPerBeamResidue"], data["observations"])
+
+
+def load_memory_model(s3_client, bucket: str, device: str) -> MemoryModel:
+    '''
+    The model learned by earlier jobs on device, or the default if there isn't one or it can't be read.
+    '''
+    try:
+        body = s3_client.get_object(Bucket=bucket, Key=memory_model_key(device))["Body"].read()
+        return MemoryModel.from_dict(json.loads(body))
+    except Exception as e:
+        # Only the starting estimates depend on it, so a job runs without it
+        print(f"Using the default memory model: {e!r}")
+        return MemoryModel()
+
+
+def save_memory_model(s3_client, bucket: str, device: str, memory_model: MemoryModel):
+    try:
+        s3_client.put_object(Body=json.dumps(memory_model.to_dict()).encode(), Bucket=bucket,
+                             Key=memory_model_key(device), ContentType="application/json")
+    except Exception as e:
+        print(f"Could not save the memory model: {e!r}")
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def _max_rss_bytes() -> int:
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryProbe:
+    '''
+    Free and peak memory of the GPU, or of this process on the CPU.
+    '''
+
+    def __init__(self, use_gpu: bool):
+        self.use_gpu = use_gpu
+
+    def _cuda(self):
+        # torch is already loaded by a model on the GPU. Without one, e.g. in tests, the CPU is measured instead.
+        torch = sys.modules.get("torch")
+        if self.use_gpu and torch is not None and torch.cuda.is_available():
+            return torch.cuda
+        return None
+
+    def free_bytes(self):
+        '''
+        Memory a beam search could still use, or None if unknown.
+        '''
+        cuda = self._cuda()
+        if cuda:
+            free, _ = cuda.mem_get_info()
+            # Memory torch's allocator holds but isn't using is free to this process too
+            return free + cuda.memory_reserved() - cuda.memory_allocated()
+        return available_memory_bytes()
+
+    @contextmanager
+    def measure(self):
+        '''
+        Yields a dict whose "peak_bytes" is set to the peak memory used in the block, on top of what was
+        in use before it. On the CPU the peak is only known when it's the highest the process has reached,
+        otherwise it's None.
+        '''
+        result = {"peak_bytes": None}
+        cuda = self._cuda()
+        if cuda:
+            # So that the job's own peak, see instrumentation.py, isn't lost
+            hold_peak_gpu_bytes(cuda.max_memory_allocated())
+            cuda.reset_peak_memory_stats()
+            before = cuda.memory_allocated()
+            yield result
+            result["peak_bytes"] = cuda.max_memory_allocated() - before
+            return
+        try:
+            before, max_before = _rss_bytes(), _max_rss_bytes()
+        except OSError:
+            yield result
+            return
+        yield result
+        max_after = _max_rss_bytes()
+        if max_after > max_before:
+            result["peak_bytes"] = max_after - before
+
+    def release(self):
+        '''
+        Frees what a failed beam search left behind before it's retried.
+        '''
+        gc.collect()
+        cuda = self._cuda()
+        if cuda:
+            cuda.empty_cache()
+
+
+class LoadTracker:
+    '''
+    Tracks model loads, whose allocations would be measured along with any beam search running
+    at the same time.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = 0
+        self._started = 0
+
+    def __reduce__(self):
+        # CPU workers get a fresh one, since they load their model before predicting anything
+        return LoadTracker, ()
+
+    @contextmanager
+    def loading(self):
+        with self._lock:
+            self._active += 1
+            self._started += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return self._active, self._started
+
+    def quiet_since(self, snapshot: tuple) -> bool:
+        '''
+        Whether no load was running when snapshot was taken, and none has started since.
+        '''
+        return snapshot[0] == 0 and self.snapshot()[1] == snapshot[1]
+
+
+class AdaptiveMemory:
+    '''
+    Runs beam searches, retrying those that run out of memory with smaller beams and learning from
+    each one. See the module docstring.
+    '''
+
+    def __init__(self, memory_model: MemoryModel, probe: MemoryProbe, loads: LoadTracker = None):
+        self.memory_model = memory_model
+        self.probe = probe
+        self.loads = loads or LoadTracker()
+        # {protein sequence: beam size used} for the proteins predicted with less than the beam size asked for
+        self.reduced_beams = {}
+        self.out_of_memory_retries = 0
+
+    @property
+    def reduced_proteins(self) -> int:
+        return len(self.reduced_beams)
+
+    def record_beam(self, protein: str, beam: int, beam_size: int):
+        '''
+        Notes the beam a protein was predicted with, for predictions made in a CPU worker's copy of this.
+        '''
+        if beam < beam_size:
+            self.reduced_beams[protein] = beam
+
+    def worker_memory_bytes(self, proteins: list, beam_size: int) -> int:
+        '''
+        Memory for a CPU worker to predict any of proteins, for planning how many workers fit.
+        '''
+        return self.memory_model.estimate(max(map(len, proteins), default=1), beam_size)
+
+    def predict(self, generate, protein: str, beam_size: int) -> tuple:
+        '''
+        Returns (generate(protein, beam), beam), with beam beam_size unless that ran out of memory.
+        '''
+        beam = beam_size
+        while True:
+            free = self.probe.free_bytes()
+            loads = self.loads.snapshot()
+            try:
+                with self.probe.measure() as measured:
+                    result = generate(protein, beam)
+            except Exception as e:
+                if not is_out_of_memory(e) or beam <= MIN_BEAM_SIZE:
+                    raise
+                if free is not None and self.loads.quiet_since(loads):
+                    self.memory_model.observe_out_of_memory(len(protein), beam, free)
+                self.out_of_memory_retries += 1
+                self.probe.release()
+                beam = max(MIN_BEAM_SIZE, beam // 2)
+                print(f"Out of memory on a protein of length {len(protein)}, retrying with a beam of {beam}")
+                continue
+            if measured["peak_bytes"] and self.loads.quiet_since(loads):
+                self.memory_model.observe(len(protein), beam, measured["peak_bytes"])
+            self.record_beam(protein, beam, beam_size)
+            if beam < beam_size:
+                print(f"Predicted a protein of length {len(protein)} with a beam of {beam} instead of {beam_size}")
+            return result, beam
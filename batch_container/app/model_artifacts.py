@@ -0,0 +1,175 @@
+'''
+Memory-mapped loading of the species models, so that loading a model maps its weights rather than
+reading and unpickling the whole file.
+
+torch.load can map checkpoints saved in its zip format, the default since torch 1.6, so those are
+mapped where they are. Only a /models/<species>.pt in the older format needs a mappable copy, which
+the image build writes to /models/<species>.mmap.pt: the same checkpoint re-saved by the installed
+torch with contiguous tensors. The copy is as big as the model, and the original can't be dropped
+since it's in the base image's layers, so the build only makes one when it has to. At runtime
+load_model uses the copy when there is one, maps the original if it can be mapped, and loads it
+as before otherwise. Mapped pages come from the page cache, so processes loading the same model
+(e.g. the workers of a --cpu_workers pool) share them.
+
+The build also writes /models/<species>.sha256, a digest of the model's weights, so that telling
+models apart (see prediction_store.model_version) doesn't mean hashing gigabytes on every job.
+
+Run during the image build, from /:
+    python -m app.model_artifacts /models
+'''
+import argparse
+import functools
+import glob
+import hashlib
+import inspect
+import os
+import sys
+import threading
+import zipfile
+from contextlib import contextmanager
+
+ARTIFACT_SUFFIX = ".mmap.pt"
+DIGEST_SUFFIX = ".sha256"
+HASH_CHUNK_BYTES = 2**20
+# Set on the thread running a loader inside _mapped_loads
+_mapping = threading.local()
+
+
+def artifact_path(model_path: str) -> str:
+    return model_path.removesuffix(".pt") + ARTIFACT_SUFFIX
+
+
+def _contiguous(obj):
+    # Tensors that are views into a bigger storage would otherwise save (and map) the whole storage
+    import torch
+    if isinstance(obj, torch.Tensor):
+        return obj.contiguous().clone() if not obj.is_contiguous() or obj.storage_offset() else obj
+    if isinstance(obj, dict):
+        return type(obj)((key, _contiguous(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_contiguous(value) for value in obj)
+    return obj
+
+
+def build_artifact(model_path: str) -> str:
+    '''
+    Writes the mappable artifact for model_path and returns its path.
+    '''
+    import torch
+    checkpoint = torch.load(model_path, map_location="cpu", weights_only=False)
+    path = artifact_path(model_path)
+    # Written under another name first, so a failed build never leaves a truncated artifact
+    partial = path + ".tmp"
+    torch.save(_contiguous(checkpoint), partial)
+    os.replace(partial, path)
+    return path
+
+
+def digest_path(model_path: str) -> str:
+    return model_path.removesuffix(".pt") + DIGEST_SUFFIX
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_digest(model_path: str) -> str:
+    '''
+    Writes the digest of model_path's weights next to it and returns its path.
+    '''
+    path = digest_path(model_path)
+    partial = path + ".tmp"
+    with open(partial, "w") as f:
+        f.write(_hash_file(model_path))
+    os.replace(partial, path)
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def weights_digest(model_path: str) -> str:
+    '''
+    The digest of model_path's weights written by the image build, or, for a model that wasn't built into
+    an image, hashed here once per process. Raises OSError if there's no model at model_path.
+    '''
+    try:
+        with open(digest_path(model_path)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return _hash_file(model_path)
+
+
+def is_mappable(model_path: str) -> bool:
+    # torch's zip format. The older format is a bare pickle stream.
+    return zipfile.is_zipfile(model_path)
+
+
+def build_all(models_dir: str) -> list:
+    '''
+    Writes the digest of every model in models_dir, and an artifact for each that can't be mapped where it is.
+    Returns the artifacts' paths.
+    '''
+    model_paths = [path for path in sorted(glob.glob(os.path.join(models_dir, "*.pt")))
+                   if not path.endswith(ARTIFACT_SUFFIX)]
+    for path in model_paths:
+        print(f"Wrote {write_digest(path)}")
+    return [build_artifact(path) for path in model_paths if not is_mappable(path)]
+
+
+def _mapped_load(load):
+    def mapped_load(*args, **kwargs):
+        if getattr(_mapping, "active", False):
+            kwargs.setdefault("mmap", True)
+        return load(*args, **kwargs)
+
+    mapped_load.unmapped = load
+    return mapped_load
+
+
+@contextmanager
+def _mapped_loads():
+    '''
+    Makes torch.load map files by default for calls made by this thread inside the block, for loaders
+    that call it without mmap. Calls from other threads, e.g. a job's io thread, load as they asked.
+    Does nothing on torch versions without mmap support (before 2.1).
+    '''
+    import torch
+    if "mmap" not in inspect.signature(getattr(torch.load, "unmapped", torch.load)).parameters:
+        yield
+        return
+    if not hasattr(torch.load, "unmapped"):
+        # Installed once and left in place, so threads never see torch.load swapped under them
+        torch.load = _mapped_load(torch.load)
+    _mapping.active = True
+    try:
+        yield
+    finally:
+        _mapping.active = False
+
+
+def load_model(model_path: str, use_gpu: bool, initialize):
+    '''
+    Loads a model with initialize(path, use_gpu), e.g. initialize_collage_model,
+    mapping its weights from the artifact built for it or from the original file if either can be.
+    '''
+    artifact = artifact_path(model_path)
+    if os.path.exists(artifact):
+        model_path = artifact
+    elif not os.path.exists(model_path) or not is_mappable(model_path):
+        return initialize(model_path, use_gpu)
+    with _mapped_loads():
+        return initialize(model_path, use_gpu)
+
+
+def main(args: list):
+    parser = argparse.ArgumentParser(description="Builds weight digests and memory-mappable artifacts for every model in a directory")
+    parser.add_argument("models_dir", type=str, help="Directory of <species>.pt model files")
+    for path in build_all(parser.parse_args(args).models_dir):
+        print(f"Built {path}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
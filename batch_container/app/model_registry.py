@@ -0,0 +1,119 @@
+'''
+In-memory cache of loaded CoLLAGE models for containers that run more than one job.
+'''
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from batch_jobs import MODEL_PATTERN
+
+DEFAULT_MEMORY_BUDGET_MB = 8192
+
+
+def model_path_for_species(species: str) -> str:
+    return MODEL_PATTERN.format(species=species)
+
+
+def estimate_model_bytes(model) -> int:
+    '''
+    Counts the bytes held by a torch model's parameters and buffers.
+    Returns 0 for objects that don't look like torch models.
+    '''
+    tensors = []
+    for attr in ("parameters", "buffers"):
+        if hasattr(model, attr):
+            tensors.extend(getattr(model, attr)())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _release_gpu_memory():
+    # Only bother if torch is already loaded, importing it here would be slow
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+class ModelRegistry:
+    '''
+    Caches loaded models keyed by (model_path, use_gpu).
+    When loading a model would exceed memory_budget_bytes, the least recently used models are evicted first.
+    A model that is bigger than the whole budget is still loaded, but only ever on its own.
+
+    Instances are callable with the same arguments as initialize_collage_model,
+    so they can be used anywhere a model loader is expected.
+    '''
+
+    def __init__(self, load_model, memory_budget_bytes: int = DEFAULT_MEMORY_BUDGET_MB * 2**20,
+                 size_of=estimate_model_bytes):
+        self.load_model = load_model
+        self.memory_budget_bytes = memory_budget_bytes
+        self.size_of = size_of
+        # key -> (model, size in bytes). Ordered from least to most recently used.
+        self._models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = {}
+
+    def __call__(self, model_path: str, use_gpu: bool):
+        return self.get(model_path, use_gpu)
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(size for _, size in self._models.values())
+
+    def get(self, model_path: str, use_gpu: bool):
+        key = (model_path, use_gpu)
+        if key in self._models:
+            self.hits += 1
+            self._models.move_to_end(key)
+            return self._models[key][0]
+
+        self.misses += 1
+        # The file size is a good enough estimate of the loaded size to make room before loading
+        expected_size = os.path.getsize(model_path) if os.path.exists(model_path) else 0
+        self._evict_until_fits(expected_size)
+
+        start = time.perf_counter()
+        model = self.load_model(model_path, use_gpu)
+        load_time = time.perf_counter() - start
+        self.load_seconds.setdefault(model_path, []).append(load_time)
+        print(f"Loaded {model_path} in {load_time:.2f}s")
+
+        size = self.size_of(model) or expected_size
+        self._evict_until_fits(size)
+        self._models[key] = (model, size)
+        return model
+
+    def get_species(self, species: str, use_gpu: bool):
+        return self.get(model_path_for_species(species), use_gpu)
+
+    def preload(self, species_list: list, use_gpu: bool):
+        '''
+        Loads the models for the given species ahead of the first job.
+        Models are loaded in order, so if they don't all fit the last ones listed win.
+        '''
+        for species in species_list:
+            self.get_species(species, use_gpu)
+
+    def _evict_until_fits(self, size: int):
+        evicted = False
+        while self._models and self.resident_bytes + size > self.memory_budget_bytes:
+            key, _ = self._models.popitem(last=False)
+            self.evictions += 1
+            evicted = True
+            print(f"Evicted model {key} from cache")
+        if evicted:
+            _release_gpu_memory()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "resident_models": [path for path, _ in self._models],
+            "resident_bytes": self.resident_bytes,
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "load_seconds": self.load_seconds,
+        }
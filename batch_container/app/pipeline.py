@@ -0,0 +1,86 @@
+'''
+Overlaps S3 transfers and model loading with inference.
+
+Jobs go through three stages: fetch (download and parse the input), predict (on the GPU)
+and upload. Fetches run ahead of prediction on a thread pool, the model for each job is
+loaded on its own thread while that job's input is fetched, and uploads run in the
+background while the next job is predicted.
+'''
+import io
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Outputs bigger than this are uploaded in parts, in parallel
+MULTIPART_THRESHOLD_BYTES = 16 * 2**20
+MULTIPART_CHUNK_BYTES = 8 * 2**20
+MULTIPART_CONCURRENCY = 8
+
+
+def upload_bytes(s3_client, bucket: str, key: str, body, **extra_args):
+    '''
+    Uploads with a single put_object for small bodies and a multipart upload for large ones.
+    extra_args are passed through as put_object arguments, e.g. ContentType.
+    '''
+    size = len(body.encode("utf-8") if isinstance(body, str) else body)
+    if size < MULTIPART_THRESHOLD_BYTES:
+        s3_client.put_object(Body=body, Bucket=bucket, Key=key, **extra_args)
+        return
+
+    # Imported here so that importing this module doesn't import boto3
+    from boto3.s3.transfer import TransferConfig
+    data = body.encode("utf-8") if isinstance(body, str) else body
+    config = TransferConfig(multipart_threshold=MULTIPART_THRESHOLD_BYTES,
+                            multipart_chunksize=MULTIPART_CHUNK_BYTES,
+                            max_concurrency=MULTIPART_CONCURRENCY)
+    s3_client.upload_fileobj(io.BytesIO(data), bucket, key, ExtraArgs=extra_args or None, Config=config)
+
+
+def run_pipeline(jobs: list, fetch, load_model, predict, upload, prefetch: int = 1) -> list:
+    '''
+    Runs every job through fetch -> predict -> upload, overlapping stages across jobs.
+
+    fetch(job) -> input, run on an I/O thread up to prefetch jobs ahead of prediction.
+    load_model(job) -> model, run on a single model loading thread so loads never race each other.
+    predict(model, job, input) -> output, run on the calling thread, one job at a time.
+    upload(job, output), run on an I/O thread.
+
+    Returns the jobs' outputs in order. A job whose fetch, model load or predict raises gets None as its
+    output and the other jobs still run. Once every job has finished, the first exception is raised.
+    '''
+    jobs = list(jobs)
+    outputs = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=prefetch + 1, thread_name_prefix="io") as io_pool, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="model") as model_pool:
+        pending = deque()
+
+        def start(job):
+            pending.append((io_pool.submit(fetch, job), model_pool.submit(load_model, job)))
+
+        for job in jobs[:prefetch + 1]:
+            start(job)
+
+        uploads = []
+        for i, job in enumerate(jobs):
+            fetched, loaded = pending.popleft()
+            if i + prefetch + 1 < len(jobs):
+                start(jobs[i + prefetch + 1])
+            try:
+                output = predict(loaded.result(), job, fetched.result())
+            except Exception as e:
+                print(f"Job {i} failed: {e!r}")
+                errors.append(e)
+                outputs.append(None)
+                continue
+            outputs.append(output)
+            uploads.append(io_pool.submit(upload, job, output))
+
+        for finished in uploads:
+            try:
+                finished.result()
+            except Exception as e:
+                print(f"Upload failed: {e!r}")
+                errors.append(e)
+    if errors:
+        raise errors[0]
+    return outputs
@@ -0,0 +1,246 @@
+'''
+Beam search results of single proteins, shared across jobs, so that a protein predicted by an
+earlier job (e.g. one of the same proteome submitted again with a gene added) isn't predicted again.
+
+A result is keyed by a digest of the protein sequence, the model's version (see model_version) and
+the beam size, and stored in two tiers:
+
+- S3, one object per result under STORE_PREFIX, spread across 256 shard prefixes by the first two
+  hex digits of the digest so that a proteome's worth of requests isn't all sent to one prefix.
+- A directory on the container's disk, kept under a size limit by dropping the least recently used
+  results. It saves the S3 requests for proteins seen again by the same container, e.g. across the
+  jobs of a worker or an array job child.
+
+Results predicted with a reduced beam (see memory_model.py) aren't stored, since they aren't what
+the beam size asked for.
+'''
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from importlib import metadata
+
+from app.model_artifacts import weights_digest
+
+NONE = "none"
+LOCAL = "local"
+S3 = "s3"
+STORE_MODES = (NONE, LOCAL, S3)
+STORE_PREFIX = "predictions/"
+DEFAULT_CACHE_DIR = "/tmp/collage-predictions"
+DEFAULT_CACHE_BYTES = 2 * 2**30
+# Part of every digest, so results stored in an older layout are never read
+STORE_FORMAT = 1
+# S3 lookups made at once. Each is a small GET, so these are mostly waiting on the network.
+LOOKUP_THREADS = 32
+
+
+def collage_version() -> str:
+    try:
+        return metadata.version("collage")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def model_version(model_path: str) -> str:
+    '''
+    The digest of the model's weights, written once when the image is built (see model_artifacts.py), and the
+    version of collage, whose code turns the weights into predictions. Either changing gives new results.
+    '''
+    try:
+        digest = weights_digest(model_path)
+    except OSError:
+        # No model file, e.g. in tests, so nothing better to go on than its path
+        digest = model_path
+    return f"{digest}:{collage_version()}"
+
+
+def prediction_digest(sequence: str, version: str, beam_size: int) -> str:
+    return hashlib.sha256(f"{sequence}\n{version}\n{beam_size}\n{STORE_FORMAT}".encode()).hexdigest()
+
+
+def _is_missing(error) -> bool:
+    # Without s3:ListBucket on the prefix, S3 answers 403 rather than 404 for a missing object
+    return error.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound", "403", "AccessDenied")
+
+
+class DiskLRU:
+    '''
+    Files in directory, at most max_bytes in total, dropping the least recently used first.
+    Files left by earlier runs are picked up, oldest first.
+    '''
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        # name -> size, least recently used first
+        self._sizes = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        entries = []
+        for name in os.listdir(directory):
+            if name.endswith(".tmp"):
+                # Left by a run that stopped part way through a write
+                continue
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._sizes[name] = size
+            self._total += size
+        with self._lock:
+            self._evict()
+
+    def get(self, name: str):
+        '''
+        The file's contents, or None if it isn't here.
+        '''
+        with self._lock:
+            if name not in self._sizes:
+                return None
+            self._sizes.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Keeps the order for the next run that picks the directory up
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._total -= self._sizes.pop(name, 0)
+            return None
+        return data
+
+    def put(self, name: str, data: bytes):
+        path = os.path.join(self.directory, name)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        # Written to the side and renamed, so a reader never sees part of a file
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock:
+            self._total += len(data) - self._sizes.pop(name, 0)
+            self._sizes[name] = len(data)
+            self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._sizes:
+            name, size = self._sizes.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class PredictionStore:
+    '''
+    The two tiers described in the module docstring. Without an s3_client only the local tier is used.
+    '''
+
+    def __init__(self, s3_client, bucket: str, cache_dir: str = DEFAULT_CACHE_DIR,
+                 cache_bytes: int = DEFAULT_CACHE_BYTES):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.local = DiskLRU(cache_dir, cache_bytes)
+
+    def for_model(self, version: str, beam_size: int):
+        return ModelPredictions(self, version, beam_size)
+
+    @staticmethod
+    def s3_key(digest: str) -> str:
+        return f"{STORE_PREFIX}{digest[:2]}/{digest}.json"
+
+    def _get_s3(self, digest: str):
+        from botocore.exceptions import ClientError
+        try:
+            return self.s3_client.get_object(Bucket=self.bucket, Key=self.s3_key(digest))["Body"].read()
+        except ClientError as e:
+            if _is_missing(e):
+                return None
+            raise
+
+    def get_many(self, digests: list) -> tuple:
+        '''
+        ({digest: stored bytes} for the digests found, how many of them came from the local tier).
+        '''
+        found = {}
+        for digest in digests:
+            data = self.local.get(digest)
+            if data is not None:
+                found[digest] = data
+        local_hits = len(found)
+        remote = [digest for digest in digests if digest not in found]
+        if self.s3_client and remote:
+            with ThreadPoolExecutor(min(LOOKUP_THREADS, len(remote))) as pool:
+                for digest, data in zip(remote, pool.map(self._get_s3, remote)):
+                    if data is not None:
+                        found[digest] = data
+                        self._put_local(digest, data)
+        return found, local_hits
+
+    def _put_local(self, digest: str, data: bytes):
+        try:
+            self.local.put(digest, data)
+        except OSError as e:
+            # e.g. a full disk, which only costs the local tier
+            print(f"Could not cache a prediction locally: {e!r}")
+
+    def put(self, digest: str, data: bytes):
+        self._put_local(digest, data)
+        if self.s3_client:
+            self.s3_client.put_object(Body=data, Bucket=self.bucket, Key=self.s3_key(digest),
+                                      ContentType="application/json")
+
+
+class ModelPredictions:
+    '''
+    The results in a PredictionStore for one model version and beam size, looked up by protein sequence.
+    Counts its hits and misses for the job's metrics.
+    '''
+
+    def __init__(self, store: PredictionStore, version: str, beam_size: int):
+        self.store = store
+        self.version = version
+        self.beam_size = beam_size
+        self.hits = 0
+        self.local_hits = 0
+        self.misses = 0
+
+    def _digest(self, sequence: str) -> str:
+        return prediction_digest(sequence, self.version, self.beam_size)
+
+    def get_many(self, sequences: list) -> dict:
+        '''
+        {sequence: {predicted sequence: negLL}} for the sequences that have a stored result.
+        '''
+        digests = {self._digest(sequence): sequence for sequence in sequences}
+        try:
+            found, local_hits = self.store.get_many(list(digests))
+        except Exception as e:
+            # The store only saves work, so a job goes on without it
+            print(f"Could not read the prediction store: {e!r}")
+            found, local_hits = {}, 0
+        results = {}
+        for digest, data in found.items():
+            record = json.loads(data)
+            # Guards against a digest collision, however unlikely
+            if record["sequence"] == digests[digest]:
+                results[digests[digest]] = record["negLLs"]
+        self.hits += len(results)
+        self.local_hits += local_hits
+        self.misses += len(sequences) - len(results)
+        return results
+
+    def put(self, sequence: str, negLLs: dict):
+        record = {"sequence": sequence, "modelVersion": self.version, "beamSize": self.beam_size, "negLLs": negLLs}
+        try:
+            # default=float for scores that are numpy or torch scalars
+            self.store.put(self._digest(sequence), json.dumps(record, default=float).encode())
+        except Exception as e:
+            print(f"Could not save a prediction to the store: {e!r}")
@@ -0,0 +1,97 @@
+'''
+Live progress of a running job, written to progress/<input id>.json for the job_status lambda to
+merge into the job's status.
+
+A progress record is
+    {"proteinsDone", "proteinsTotal", "stage", "stageSeconds": {stage: seconds}, "elapsedSeconds", "updatedAt"}
+where stage is the stage running now (None between stages) and stageSeconds holds the stages
+finished so far. updatedAt is the Unix time of the write, so a record that stops changing while
+the job is RUNNING points to a stuck job.
+
+Writes are rate limited. Changes within min_interval_seconds of the last write are coalesced into
+a single write at the end of the interval, so a job writes every few seconds at most however many
+proteins it predicts.
+'''
+import json
+import threading
+import time
+
+from batch_jobs import progress_key
+
+DEFAULT_MIN_INTERVAL_SECONDS = 5
+
+
+class ProgressReporter:
+    def __init__(self, s3_client, bucket: str, input_id: str,
+                 min_interval_seconds: float = DEFAULT_MIN_INTERVAL_SECONDS, clock=time.monotonic):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = progress_key(input_id)
+        self.min_interval_seconds = min_interval_seconds
+        self.clock = clock
+        self.writes = 0
+        self._started = clock()
+        self._state = {"proteinsDone": 0, "proteinsTotal": None, "stage": None, "stageSeconds": {}}
+        self._last_write = None
+        self._dirty = False
+        self._timer = None
+        # Reentrant, since a write due now happens inside the update that made it due
+        self._lock = threading.RLock()
+
+    def set_total(self, proteins_total: int, proteins_done: int = 0):
+        with self._lock:
+            self._state["proteinsTotal"] = proteins_total
+            self._state["proteinsDone"] = proteins_done
+            self._changed()
+
+    def protein_done(self, *args):
+        '''
+        Counts one more protein as predicted. Takes and ignores any arguments, so it can be an on_result callback.
+        '''
+        with self._lock:
+            self._state["proteinsDone"] += 1
+            self._changed()
+
+    def on_stage(self, name: str, seconds):
+        '''
+        For JobMetrics' on_stage: records a stage starting (seconds is None) or ending.
+        '''
+        with self._lock:
+            if seconds is None:
+                self._state["stage"] = name
+            else:
+                stage_seconds = self._state["stageSeconds"]
+                stage_seconds[name] = round(stage_seconds.get(name, 0) + seconds, 3)
+                if self._state["stage"] == name:
+                    self._state["stage"] = None
+            self._changed()
+
+    def _changed(self):
+        self._dirty = True
+        if self._last_write is None or self.clock() - self._last_write >= self.min_interval_seconds:
+            self.flush()
+        elif self._timer is None:
+            # Written once the interval is up, with whatever has changed by then
+            self._timer = threading.Timer(self.min_interval_seconds - (self.clock() - self._last_write), self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._dirty:
+                return
+            record = dict(self._state, stageSeconds=dict(self._state["stageSeconds"]),
+                          elapsedSeconds=round(self.clock() - self._started, 3), updatedAt=int(time.time()))
+            self._dirty = False
+            self._last_write = self.clock()
+            self.writes += 1
+            # Written under the lock, so a newer record is never overwritten by an older one
+            try:
+                self.s3_client.put_object(Body=json.dumps(record).encode(), Bucket=self.bucket, Key=self.key,
+                                          ContentType="application/json")
+            except Exception as e:
+                # Progress is only informational, it mustn't fail the job
+                print(f"Could not write progress: {e!r}")
@@ -0,0 +1,209 @@
+'''
+Columnar scores output, written next to the FASTA output so clients can pick out the best
+predictions or the score distribution without downloading and parsing the whole FASTA.
+
+Each row is one predicted sequence: the protein it was predicted from, its rank within that
+protein's beam (0 is the best), its negative log-likelihood and the sequence itself. Rows are
+ordered by protein and then rank, so the top N of a protein are always adjacent.
+
+The file is Parquet when pyarrow is installed. Otherwise it's a compact binary format:
+
+    header      magic, version, row and protein counts, then the offset of every section below
+    scores      float64 per row
+    ranks       uint32 per row
+    proteins    uint32 per row, an index into the protein table
+    seq_offsets uint64 per row + 1, into seq_data
+    seq_data    the sequences, UTF-8, back to back
+    row_starts  uint32 per protein + 1, the first row of each protein
+    name_offsets uint64 per protein + 1, into name_data
+    name_data   the protein names, UTF-8, back to back
+
+All little-endian. Every column is fixed width apart from the sequence and name data, which are
+found through their offsets, so any range of rows or a single column can be read with a few S3
+range reads, see ScoresReader.
+'''
+import importlib.util
+import io
+import struct
+
+NONE = "none"
+AUTO = "auto"
+PARQUET = "parquet"
+BINARY = "binary"
+SCORES_FORMATS = (NONE, AUTO, PARQUET, BINARY)
+
+SUFFIXES = {PARQUET: ".scores.parquet", BINARY: ".scores.bin"}
+CONTENT_TYPES = {PARQUET: "application/vnd.apache.parquet", BINARY: "application/octet-stream"}
+COLUMNS = ("protein", "rank", "neg_log_likelihood", "sequence")
+# Small enough that a reader after the top rows only fetches a little more than it needs
+PARQUET_ROW_GROUP_SIZE = 4096
+
+MAGIC = b"CLGSCOR1"
+VERSION = 1
+SECTIONS = ("scores", "ranks", "proteins", "seq_offsets", "seq_data",
+            "row_starts", "name_offsets", "name_data", "end")
+HEADER = struct.Struct("<8sIQI" + "Q" * len(SECTIONS))
+
+
+def pyarrow_available() -> bool:
+    # Checked without importing it, since importing pyarrow is slow and is only needed when writing
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def resolve_format(scores_format: str) -> str:
+    '''
+    The format a --scores_format value writes: AUTO picks Parquet if pyarrow is installed.
+    '''
+    if scores_format == AUTO:
+        return PARQUET if pyarrow_available() else BINARY
+    if scores_format == PARQUET and not pyarrow_available():
+        raise ValueError("Parquet scores output needs the pyarrow package")
+    return scores_format
+
+
+def score_rows(scores_by_protein: dict) -> list:
+    '''
+    (protein, rank, negLL, sequence) rows for {protein name: {predicted sequence: negLL}},
+    with the sequences of each protein ranked from the lowest negLL, the most likely, up.
+    Equal scores keep the order the beam search returned them in.
+    '''
+    return [(protein, rank, float(negLL), seq)
+            for protein, negLLs in scores_by_protein.items()
+            for rank, (seq, negLL) in enumerate(sorted(negLLs.items(), key=lambda item: item[1]))]
+
+
+def _pack(fmt: str, values: list) -> bytes:
+    return struct.pack(f"<{len(values)}{fmt}", *values)
+
+
+def _offsets(items: list) -> list:
+    offsets = [0]
+    for item in items:
+        offsets.append(offsets[-1] + len(item))
+    return offsets
+
+
+def write_binary(scores_by_protein: dict) -> bytes:
+    names = list(scores_by_protein)
+    rows = score_rows(scores_by_protein)
+    seqs = [seq.encode() for _, _, _, seq in rows]
+    encoded_names = [name.encode() for name in names]
+    protein_index = {name: i for i, name in enumerate(names)}
+    row_starts = _offsets(scores_by_protein.values())
+
+    sections = [
+        _pack("d", [negLL for _, _, negLL, _ in rows]),
+        _pack("I", [rank for _, rank, _, _ in rows]),
+        _pack("I", [protein_index[protein] for protein, _, _, _ in rows]),
+        _pack("Q", _offsets(seqs)),
+        b"".join(seqs),
+        _pack("I", row_starts),
+        _pack("Q", _offsets(encoded_names)),
+        b"".join(encoded_names),
+    ]
+    offsets = _offsets(sections)
+    header = HEADER.pack(MAGIC, VERSION, len(rows), len(names), *(HEADER.size + o for o in offsets))
+    return header + b"".join(sections)
+
+
+def write_parquet(scores_by_protein: dict) -> bytes:
+    import pyarrow
+    import pyarrow.parquet
+    rows = score_rows(scores_by_protein)
+    table = pyarrow.table({
+        "protein": pyarrow.array([r[0] for r in rows], pyarrow.string()),
+        "rank": pyarrow.array([r[1] for r in rows], pyarrow.uint32()),
+        "neg_log_likelihood": pyarrow.array([r[2] for r in rows], pyarrow.float64()),
+        "sequence": pyarrow.array([r[3] for r in rows], pyarrow.string()),
+    })
+    buffer = io.BytesIO()
+    pyarrow.parquet.write_table(table, buffer, row_group_size=PARQUET_ROW_GROUP_SIZE)
+    return buffer.getvalue()
+
+
+def serialize_scores(scores_by_protein: dict, scores_format: str) -> tuple:
+    '''
+    Returns (data, key suffix, content type) for the scores in the given format, PARQUET or BINARY.
+    '''
+    writer = write_parquet if scores_format == PARQUET else write_binary
+    return writer(scores_by_protein), SUFFIXES[scores_format], CONTENT_TYPES[scores_format]
+
+
+def s3_range_reader(s3_client, bucket: str, key: str):
+    '''
+    read_range for ScoresReader that fetches byte ranges of an S3 object.
+    '''
+    def read_range(start: int, end: int) -> bytes:
+        if start == end:
+            # bytes=N-(N-1) isn't a valid range, and S3 answers one with the whole object
+            return b""
+        # HTTP ranges include their last byte
+        return s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")["Body"].read()
+    return read_range
+
+
+class ScoresReader:
+    '''
+    Reads parts of a binary scores file. read_range(start, end) returns bytes [start, end) of the file,
+    e.g. from s3_range_reader, so only the parts that are asked for are fetched.
+    '''
+
+    def __init__(self, read_range):
+        self.read_range = read_range
+        magic, version, self.row_count, self.protein_count, *offsets = HEADER.unpack(read_range(0, HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a binary scores file")
+        self.offsets = dict(zip(SECTIONS, offsets))
+        self._proteins = None
+
+    def _column(self, section: str, fmt: str, start: int, stop: int) -> tuple:
+        width = struct.calcsize(fmt)
+        base = self.offsets[section]
+        return struct.unpack(f"<{stop - start}{fmt}", self.read_range(base + start * width, base + stop * width))
+
+    def scores(self) -> list:
+        '''
+        Every row's negLL, in row order, with one read.
+        '''
+        return list(self._column("scores", "d", 0, self.row_count))
+
+    def proteins(self) -> list:
+        '''
+        [(protein name, first row, row count)] for every protein, in row order.
+        '''
+        if self._proteins is None:
+            row_starts = self._column("row_starts", "I", 0, self.protein_count + 1)
+            name_offsets = self._column("name_offsets", "Q", 0, self.protein_count + 1)
+            base = self.offsets["name_data"]
+            name_data = self.read_range(base, base + name_offsets[-1])
+            self._proteins = [(name_data[name_offsets[i]:name_offsets[i + 1]].decode(),
+                               row_starts[i], row_starts[i + 1] - row_starts[i])
+                              for i in range(self.protein_count)]
+        return self._proteins
+
+    def rows(self, start: int, stop: int) -> list:
+        '''
+        Rows [start, stop) as (protein, rank, negLL, sequence) tuples.
+        '''
+        stop = min(stop, self.row_count)
+        if start >= stop:
+            return []
+        scores = self._column("scores", "d", start, stop)
+        ranks = self._column("ranks", "I", start, stop)
+        protein_indices = self._column("proteins", "I", start, stop)
+        seq_offsets = self._column("seq_offsets", "Q", start, stop + 1)
+        base = self.offsets["seq_data"]
+        seq_data = self.read_range(base + seq_offsets[0], base + seq_offsets[-1])
+        names = [name for name, _, _ in self.proteins()]
+        return [(names[protein_indices[i]], ranks[i], scores[i],
+                 seq_data[seq_offsets[i] - seq_offsets[0]:seq_offsets[i + 1] - seq_offsets[0]].decode())
+                for i in range(stop - start)]
+
+    def top_rows(self, n: int, protein: str = None) -> list:
+        '''
+        The n best ranked rows of one protein, or of the first protein if none is given.
+        '''
+        for name, first_row, row_count in self.proteins():
+            if protein is None or name == protein:
+                return self.rows(first_row, first_row + min(n, row_count))
+        raise KeyError(protein)
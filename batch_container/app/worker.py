@@ -0,0 +1,84 @@
+'''
+Long-lived worker mode for the batch container.
+Instead of running a single job and exiting, the worker pulls job descriptors from a queue
+and keeps expensive state (the loaded models, the S3 client) around between jobs.
+'''
+import argparse
+import time
+
+from app.job_queue import open_queue
+from app.model_registry import DEFAULT_MEMORY_BUDGET_MB
+
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_POLL_INTERVAL = 1
+
+
+def run_worker(queue, run_job, idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+               poll_interval: float = DEFAULT_POLL_INTERVAL) -> int:
+    '''
+    Runs jobs from the queue until no job has arrived for idle_timeout seconds.
+    run_job is called with each job descriptor.
+    A job that raises is marked failed and the worker moves on to the next one.
+    Returns the number of jobs that succeeded.
+    '''
+    succeeded = 0
+    last_job_time = time.monotonic()
+    while time.monotonic() - last_job_time < idle_timeout:
+        received = queue.receive()
+        if received is None:
+            time.sleep(poll_interval)
+            continue
+
+        descriptor, handle = received
+        print(f"Worker got job {descriptor}")
+        try:
+            # Stops the queue from handing the job to another worker while it runs
+            with queue.keep_alive(handle):
+                run_job(descriptor)
+        except Exception as e:
+            print(f"Job failed: {e!r}")
+            queue.fail(handle)
+        else:
+            queue.ack(handle)
+            succeeded += 1
+        last_job_time = time.monotonic()
+
+    print(f"Worker idle for {idle_timeout}s, exiting after {succeeded} successful jobs")
+    return succeeded
+
+
+def parse_worker_args(args: list):
+    '''
+    Read in arguments for worker mode
+    '''
+
+    parser = argparse.ArgumentParser(usage='job_runner.py --worker [optional arguments] queue',
+                                     description='Runs jobs from a queue until it has been idle for a while.',
+                                     formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('queue',
+                        type=str,
+                        help='SQS queue URL, or path to a local directory of job descriptor files')
+    parser.add_argument('--idle_timeout',
+                        type=float,
+                        default=DEFAULT_IDLE_TIMEOUT,
+                        help='Seconds to wait without receiving a job before exiting')
+    parser.add_argument('--poll_interval',
+                        type=float,
+                        default=DEFAULT_POLL_INTERVAL,
+                        help='Seconds to sleep between checks of an empty local queue')
+    parser.add_argument('--model_cache_mb',
+                        type=int,
+                        default=DEFAULT_MEMORY_BUDGET_MB,
+                        help='Memory budget in MB for keeping loaded models resident between jobs')
+    parser.add_argument('--preload_species',
+                        type=str,
+                        default="",
+                        help='Comma separated species whose models are loaded at startup, e.g. "Ecoli,human"')
+    parser.add_argument('--use_cpu',
+                        action='store_true',
+                        help='Preload models for CPU instead of GPU')
+
+    parsed = parser.parse_args(args)
+    parsed.queue = open_queue(parsed.queue)
+    parsed.preload_species = [species for species in parsed.preload_species.split(",") if species]
+    return parsed
@@ -0,0 +1,175 @@
+'''
+Throughput benchmark for the batch job pipeline.
+
+Runs download_predict_upload end to end against an in-memory S3 stand-in over a grid of
+synthetic FASTA inputs (number of proteins x sequence length x beam size), and reports
+jobs/s, per-stage latency percentiles and peak memory for each configuration.
+
+By default beam_generator is replaced by a fake that sleeps in proportion to the work, which
+isolates the pipeline's own overhead. Pass --model_path to run the real model on CPU instead.
+
+Run from batch_container, with collage importable (see README.md) and the shared modules on the path:
+    export PYTHONPATH=../shared:$PYTHONPATH
+    python -m benchmarks.bench_pipeline --proteins 1 10 --lengths 100 400 --beam_sizes 10 100
+    python -m benchmarks.bench_pipeline --save_baseline baseline.json
+    python -m benchmarks.bench_pipeline --compare baseline.json --tolerance 0.2
+'''
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import random
+import sys
+import time
+import tracemalloc
+from unittest.mock import patch
+
+from app import job_runner
+from instrumentation import percentile
+from tests.fakes import FakeS3
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+CODONS = ["".join(codon) for codon in itertools.product("ACGT", repeat=3)]
+BUCKET = "benchmark-bucket"
+STAGES = ["s3_get", "fasta_parse", "model_init", "beam_search", "serialize", "s3_put"]
+
+
+def synthetic_fasta(num_proteins: int, length: int, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    records = []
+    for i in range(num_proteins):
+        seq = "".join(rng.choice(AMINO_ACIDS) for _ in range(length))
+        records.append(f">synthetic_{i}\n{seq}\n")
+    return "".join(records).encode()
+
+
+def make_fake_beam_generator(seconds_per_residue_beam: float):
+    '''
+    Stands in for collage.generator.beam_generator.
+    Sleeps for length * beam size * seconds_per_residue_beam and returns max_seqs random coding sequences.
+    '''
+    def fake_beam_generator(model, protein, max_seqs=100):
+        time.sleep(len(protein) * max_seqs * seconds_per_residue_beam)
+        rng = random.Random(protein)
+        return {
+            "".join(rng.choice(CODONS) for _ in protein): -rng.uniform(0, len(protein))
+            for _ in range(max_seqs)
+        }
+    return fake_beam_generator
+
+
+def run_config(num_proteins: int, length: int, beam_size: int, args) -> dict:
+    '''
+    Runs one configuration args.repeats times and summarizes it.
+    '''
+    s3_client = FakeS3(latency_seconds=args.s3_latency_ms / 1000)
+    fasta = synthetic_fasta(num_proteins, length)
+    for i in range(args.repeats):
+        s3_client.put_object(Body=fasta, Bucket=BUCKET, Key=f"input/job{i}")
+
+    if args.model_path:
+        model_loader = None
+        beam_patch = contextlib.nullcontext()
+    else:
+        def model_loader(model_path, use_gpu):
+            time.sleep(args.fake_model_load_ms / 1000)
+            return object()
+        beam_patch = patch.object(job_runner, "beam_generator",
+                                  make_fake_beam_generator(args.fake_seconds_per_residue_beam))
+
+    log = io.StringIO()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with beam_patch, contextlib.redirect_stdout(log):
+        for i in range(args.repeats):
+            job_runner.download_predict_upload(BUCKET, f"job{i}", "input/", "output/",
+                                               args.model_path or "/models/fake.pt", beam_size, True,
+                                               multi_protein=num_proteins > 1,
+                                               s3_client=s3_client, model_loader=model_loader)
+    elapsed = time.perf_counter() - start
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Each job emits one metrics line, see shared/instrumentation.py
+    records = [json.loads(line) for line in log.getvalue().splitlines() if line.startswith('{"_aws"')]
+    stages = {}
+    for stage in STAGES:
+        values = [r[f"{stage}_seconds"] for r in records if f"{stage}_seconds" in r]
+        if values:
+            stages[stage] = {"p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99)}
+
+    return {
+        "proteins": num_proteins,
+        "length": length,
+        "beam_size": beam_size,
+        "jobs": args.repeats,
+        "jobs_per_second": args.repeats / elapsed,
+        "stage_seconds": stages,
+        "peak_python_heap_bytes": peak_traced,
+        "peak_rss_bytes": max((r["peak_rss_bytes"] for r in records), default=None),
+    }
+
+
+def config_key(result: dict) -> str:
+    return f"{result['proteins']}x{result['length']}@{result['beam_size']}"
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> list:
+    '''
+    Returns a description of every configuration whose throughput dropped by more than tolerance
+    (a fraction) compared to the baseline.
+    '''
+    regressions = []
+    baseline_by_key = {config_key(r): r for r in baseline["results"]}
+    for result in results:
+        old = baseline_by_key.get(config_key(result))
+        if old is None:
+            continue
+        change = result["jobs_per_second"] / old["jobs_per_second"] - 1
+        print(f"{config_key(result)}: {result['jobs_per_second']:.2f} jobs/s ({change:+.1%} vs baseline)")
+        if change < -tolerance:
+            regressions.append(f"{config_key(result)} throughput {change:+.1%}")
+    return regressions
+
+
+def main(argv: list) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks the batch job pipeline against local stand-ins")
+    parser.add_argument("--proteins", type=int, nargs="+", default=[1, 10, 50], help="Proteins per input FASTA")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[100, 400], help="Residues per protein")
+    parser.add_argument("--beam_sizes", type=int, nargs="+", default=[10, 100], help="Values of --beam_size")
+    parser.add_argument("--repeats", type=int, default=5, help="Jobs to run per configuration")
+    parser.add_argument("--model_path", type=str, default=None,
+                        help="Run the real model from this path on CPU instead of the fake beam_generator")
+    parser.add_argument("--fake_seconds_per_residue_beam", type=float, default=1e-7,
+                        help="Time the fake beam_generator spends per residue per beam")
+    parser.add_argument("--fake_model_load_ms", type=float, default=0, help="Time the fake model takes to load")
+    parser.add_argument("--s3_latency_ms", type=float, default=0, help="Fake latency for every S3 call")
+    parser.add_argument("--save_baseline", type=str, default=None, help="Write results to this JSON file")
+    parser.add_argument("--compare", type=str, default=None, help="Compare results to this baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Fractional throughput drop vs the baseline that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = []
+    for num_proteins, length, beam_size in itertools.product(args.proteins, args.lengths, args.beam_sizes):
+        result = run_config(num_proteins, length, beam_size, args)
+        results.append(result)
+        print(json.dumps(result))
+
+    report = {"fake_model": args.model_path is None, "results": results}
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions: " + "; ".join(regressions))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,134 @@
+'''
+Startup benchmark for the batch container.
+
+Measures the fixed cost every job pays before any prediction: starting the interpreter, importing
+job_runner, loading the model and running the first beam search. Each run is a fresh process that
+runs one job for a short protein against an in-memory S3 stand-in, and reports when it reached
+each point, counted from just before the process was started:
+
+    interpreter   the benchmark's own code starts running
+    imports       job_runner is imported
+    model_loaded  the model is loaded
+    first_token   the first beam search returns, the first predicted sequences being available
+    done          the output is uploaded
+
+--help is timed too, since it should return without importing boto3, collage or torch.
+
+Pass --model_path to load the real model on CPU, once mapped (from the original, or the artifact
+python -m app.model_artifacts built for it) and once read in full. Without it, a fake model is
+used and only the process and import overhead is meaningful.
+
+Run from batch_container, with collage importable (see README.md) and the shared modules on the path:
+    export PYTHONPATH=../shared:$PYTHONPATH
+    python -m benchmarks.bench_startup --repeats 10
+    python -m benchmarks.bench_startup --model_path /models/Ecoli.pt
+'''
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+BUCKET = "benchmark-bucket"
+MARKS = ["interpreter", "imports", "model_loaded", "first_token", "done"]
+
+
+def child(start_ns: int, model_path: str, mapped: bool, length: int, beam_size: int):
+    '''
+    Runs one job in this process and prints when each mark was reached, in seconds since start_ns.
+    '''
+    marks = {"interpreter": time.time_ns()}
+    from app import job_runner
+    marks["imports"] = time.time_ns()
+
+    from unittest.mock import patch
+    from tests.fakes import FakeS3
+    s3_client = FakeS3()
+    s3_client.put_object(Body=f">protein\n{'M' * length}\n", Bucket=BUCKET, Key="input/job0")
+
+    if model_path:
+        # Unmapped skips the artifact and loads the original file
+        load = job_runner.load_collage_model if mapped else job_runner.initialize_collage_model
+        beam_generator = job_runner.beam_generator
+    else:
+        load = lambda path, use_gpu: object()
+        beam_generator = lambda model, protein, max_seqs=100: {"ATG" * len(protein): -1.0}
+
+    def load_and_mark(path, use_gpu):
+        model = load(path, use_gpu)
+        marks["model_loaded"] = time.time_ns()
+        return model
+
+    def beam_and_mark(*args, **kwargs):
+        result = beam_generator(*args, **kwargs)
+        marks.setdefault("first_token", time.time_ns())
+        return result
+
+    args = [BUCKET, "job0", "input/", "output/", "--model_path", model_path or "/models/fake.pt",
+            "--beam_size", str(beam_size), "--use_cpu", "--scores_format", "none",
+            # Always predicted, so every run times a beam search rather than a stored result
+            "--prediction_store", "none"]
+    with patch.object(job_runner.boto3, "client", return_value=s3_client), \
+            patch.object(job_runner, "load_collage_model", load_and_mark), \
+            patch.object(job_runner, "beam_generator", beam_and_mark), \
+            contextlib.redirect_stdout(open(os.devnull, "w")):
+        job_runner.main(args)
+    marks["done"] = time.time_ns()
+    print(json.dumps({mark: (ns - start_ns) / 1e9 for mark, ns in marks.items()}))
+
+
+def run_child(args, mapped: bool) -> dict:
+    options = ["--length", str(args.length), "--beam_size", str(args.beam_size)]
+    if args.model_path:
+        options += ["--model_path", args.model_path]
+    if not mapped:
+        options.append("--no_mapped")
+    # Taken as late as possible, right before the process is started
+    start_ns = time.time_ns()
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--child", str(start_ns)] + options
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def time_help() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "app.job_runner", "--help"], capture_output=True, check=True)
+    return time.perf_counter() - start
+
+
+def summarize(runs: list) -> dict:
+    # Imported here, in the parent only, so that a child doesn't load the shared modules before they're timed
+    from instrumentation import percentile
+    return {mark: {"p50": percentile([r[mark] for r in runs], 50), "p95": percentile([r[mark] for r in runs], 95)}
+            for mark in MARKS if all(mark in r for r in runs)}
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Benchmarks time from process start to first prediction")
+    parser.add_argument("--repeats", type=int, default=5, help="Processes to start per configuration")
+    parser.add_argument("--model_path", type=str, default=None,
+                        help="Load the real model from this path on CPU instead of a fake")
+    parser.add_argument("--length", type=int, default=50, help="Residues in the protein predicted")
+    parser.add_argument("--beam_size", type=int, default=10, help="Value of --beam_size")
+    parser.add_argument("--child", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--no_mapped", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        child(args.child, args.model_path, not args.no_mapped, args.length, args.beam_size)
+        return
+
+    from instrumentation import percentile
+    report = {"fake_model": args.model_path is None,
+              "help_seconds": percentile([time_help() for _ in range(args.repeats)], 50)}
+    # Mapping only makes a difference to a real model
+    for mapped in ([True, False] if args.model_path else [True]):
+        runs = [run_child(args, mapped) for _ in range(args.repeats)]
+        report["mapped" if mapped else "unmapped"] = summarize(runs)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,6 +1,8 @@
 import io
 from unittest.mock import Mock, patch, MagicMock
 
+import pytest
+
 # TODO(auberon): Improve this mocking to not be as complicated
 def mock_boto3_client(config):
     '''
@@ -8,10 +10,11 @@ def mock_boto3_client(config):
     Currently mocked services:
         - S3
     '''
-    mock_file_data = io.BytesIO(b"mock-file-data")
     mock_s3_client = Mock()
-    mock_resp = {"Body": mock_file_data}
-    mock_s3_client.get_object.return_value = mock_resp
+    # A fresh body per call, since reading the body closes it
+    mock_s3_client.get_object.side_effect = lambda **kwargs: {"Body": io.BytesIO(b"mock-file-data")}
+    # No checkpoints from earlier attempts
+    mock_s3_client.list_objects_v2.return_value = {"KeyCount": 0}
 
     clients = {
         "s3": mock_s3_client,
@@ -28,6 +31,11 @@ def mock_boto3_client(config):
     mock_boto_client.side_effect = get_client
     config._boto_patch = patcher
 
+@pytest.fixture(autouse=True)
+def prediction_cache_dir(tmp_path, monkeypatch):
+    # Each test gets its own local prediction store, so one test's predictions aren't found by another
+    monkeypatch.setattr("app.job_runner.DEFAULT_CACHE_DIR", str(tmp_path / "predictions"))
+
 def pytest_configure(config):
     mock_boto3_client(config)
 
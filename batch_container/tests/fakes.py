@@ -0,0 +1,68 @@
+import io
+import time
+
+from botocore.exceptions import ClientError
+
+
+def not_found(operation: str):
+    return ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, operation)
+
+
+class FakeS3:
+    '''
+    In-memory stand-in for the parts of the boto3 S3 client the batch container uses.
+    Objects are stored as bytes in self.objects, keyed by (bucket, key).
+    latency_seconds is slept on every call to imitate network time.
+    '''
+
+    def __init__(self, latency_seconds: float = 0):
+        self.objects = {}
+        self.metadata = {}
+        self.range_requests = []
+        self.latency_seconds = latency_seconds
+
+    def _wait(self):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def put_object(self, Body, Bucket, Key, **kwargs):
+        self._wait()
+        data = Body.read() if hasattr(Body, "read") else Body
+        if isinstance(data, str):
+            data = data.encode()
+        self.objects[(Bucket, Key)] = bytes(data)
+        self.metadata[(Bucket, Key)] = kwargs
+        return {}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, Config=None, **kwargs):
+        self.put_object(Body=Fileobj, Bucket=Bucket, Key=Key, **(ExtraArgs or {}))
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._wait()
+        if (Bucket, Key) not in self.objects:
+            raise not_found("GetObject")
+        data = self.objects[(Bucket, Key)]
+        if "Range" in kwargs:
+            self.range_requests.append((Key, kwargs["Range"]))
+            start, end = kwargs["Range"].removeprefix("bytes=").split("-")
+            # Like S3, a range that ends before it starts is ignored and the whole object returned
+            if int(end) >= int(start):
+                data = data[int(start):int(end) + 1]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data), **self.metadata[(Bucket, Key)]}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._wait()
+        if (Bucket, Key) not in self.objects:
+            raise not_found("HeadObject")
+        return {"ContentLength": len(self.objects[(Bucket, Key)]), **self.metadata[(Bucket, Key)]}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._wait()
+        self.objects.pop((Bucket, Key), None)
+        self.metadata.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        self._wait()
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        return {"KeyCount": len(keys), "Contents": [{"Key": key, "Size": len(self.objects[(Bucket, key)])} for key in keys]}
@@ -0,0 +1,89 @@
+import json
+from unittest import mock
+
+import pytest
+from batch_jobs import build_manifest
+from botocore.exceptions import ClientError
+
+from app.array_job import array_commands, read_manifest
+from app.job_runner import main
+from tests.fakes import FakeS3
+
+
+def make_manifest(num_inputs, inputs_per_child):
+    inputs = [{"input_id": f"id{i}", "species": "Ecoli" if i % 2 else "human"} for i in range(num_inputs)]
+    return build_manifest("mock-bucket", inputs, inputs_per_child)
+
+
+def test_children_split_the_manifest_without_overlap():
+    manifest = make_manifest(5, 2)
+
+    slices = [array_commands(manifest, index) for index in range(3)]
+
+    assert [len(s) for s in slices] == [2, 2, 1]
+    object_names = [command[1] for s in slices for command in s]
+    assert sorted(object_names) == [f"id{i}" for i in range(5)]
+    # Same species are next to each other so a child loads each model once
+    assert [command[5] for command in slices[0]] == ["/models/Ecoli.pt", "/models/Ecoli.pt"]
+
+
+def test_inputs_per_child_is_lowered_to_make_a_valid_array():
+    manifest = make_manifest(3, 10)
+
+    assert manifest["inputs_per_child"] == 2
+
+
+def test_read_manifest_from_s3_and_local_file(tmp_path):
+    manifest = make_manifest(2, 1)
+    s3_client = FakeS3()
+    s3_client.put_object(Body=json.dumps(manifest), Bucket="mock-bucket", Key="manifests/array.json")
+    local = tmp_path / "manifest.json"
+    local.write_text(json.dumps(manifest))
+
+    assert read_manifest("s3://mock-bucket/manifests/array.json", s3_client) == manifest
+    assert read_manifest(str(local)) == manifest
+
+
+@mock.patch('app.job_runner.beam_generator')
+@mock.patch('app.job_runner.initialize_collage_model')
+def test_array_child_runs_its_slice(mocked_init, mocked_beam, tmp_path, monkeypatch):
+    mocked_beam.return_value = {"ATG": -1}
+    s3_client = FakeS3()
+    for i in range(4):
+        s3_client.put_object(Body=b">prot\nM\n", Bucket="mock-bucket", Key=f"input/id{i}")
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps(make_manifest(4, 2)))
+    monkeypatch.setenv("AWS_BATCH_JOB_ARRAY_INDEX", "1")
+
+    with mock.patch('app.job_runner.boto3.client', return_value=s3_client):
+        main(["--manifest", str(manifest_path)])
+
+    outputs = sorted(key for bucket, key in s3_client.objects if key.startswith("output/"))
+    assert [key for key in outputs if ".scores." not in key] == ["output/id0", "output/id2"]
+    # Both jobs in the slice use the human model, which is loaded once
+    assert mocked_init.call_count == 1
+
+
+@mock.patch('app.job_runner.beam_generator')
+@mock.patch('app.job_runner.initialize_collage_model')
+def test_failed_job_doesnt_stop_the_rest_of_the_slice(mocked_init, mocked_beam, tmp_path, monkeypatch):
+    mocked_beam.return_value = {"ATG": -1}
+    s3_client = FakeS3()
+    # id0 has no input, so fetching it fails
+    s3_client.put_object(Body=b">prot\nM\n", Bucket="mock-bucket", Key="input/id2")
+    manifest_path = tmp_path / "manifest.json"
+    manifest_path.write_text(json.dumps(make_manifest(4, 2)))
+    monkeypatch.setenv("AWS_BATCH_JOB_ARRAY_INDEX", "1")
+
+    with mock.patch('app.job_runner.boto3.client', return_value=s3_client):
+        with pytest.raises(ClientError):
+            main(["--manifest", str(manifest_path)])
+        assert ("mock-bucket", "output/id2") in s3_client.objects
+
+        # Batch retrying the child only runs what failed
+        s3_client.put_object(Body=b">prot\nM\n", Bucket="mock-bucket", Key="input/id0")
+        mocked_beam.reset_mock()
+        main(["--manifest", str(manifest_path)])
+
+    assert ("mock-bucket", "output/id0") in s3_client.objects
+    assert mocked_beam.call_count == 1
@@ -0,0 +1,29 @@
+from app.batching import dedupe_sequences, label_predictions, length_batches
+
+
+def test_dedupe_sequences_groups_names_by_sequence():
+    seq_dict = {"a": "MKT", "b": "MKV", "c": "MKT"}
+
+    assert dedupe_sequences(seq_dict) == {"MKT": ["a", "c"], "MKV": ["b"]}
+
+
+def test_length_batches_sorts_and_respects_residue_limit():
+    sequences = ["A" * 5, "A" * 2, "A" * 3, "A" * 12, "A" * 4]
+
+    batches = length_batches(sequences, max_batch_residues=9)
+
+    assert batches == [["A" * 2, "A" * 3, "A" * 4], ["A" * 5], ["A" * 12]]
+
+
+def test_label_predictions_labels_duplicates_under_each_name():
+    seq_dict = {"a": "MKT", "b": "MKV", "c": "MKT"}
+    predictions = {
+        "MKT": {"seq0: negLL: -1": "ATG"},
+        "MKV": {"seq0: negLL: -2": "GTG"},
+    }
+
+    assert label_predictions(seq_dict, predictions) == {
+        "a|seq0: negLL: -1": "ATG",
+        "b|seq0: negLL: -2": "GTG",
+        "c|seq0: negLL: -1": "ATG",
+    }
@@ -0,0 +1,114 @@
+import json
+import os
+import signal
+from unittest import mock
+
+import pytest
+
+from app.checkpoint import Checkpoint, job_fingerprint
+from app.job_runner import main
+from app.prediction_store import model_version
+from tests.fakes import FakeS3
+
+PROTEINS = ["MKT", "MKVLA", "MA", "MKTTVL", "MKKK", "MV"]
+ARGS = ["mock-bucket", "job1", "input/", "output/", "--model_path", "/models/Ecoli.pt", "--beam_size", "2",
+        "--multi_protein", "--use_cpu", "--cpu_workers", "1",
+        # Otherwise the store would have every protein after the first run, leaving nothing to resume
+        "--prediction_store", "none"]
+
+
+def make_s3():
+    s3_client = FakeS3()
+    fasta = "".join(f">prot{i}\n{seq}\n" for i, seq in enumerate(PROTEINS))
+    s3_client.put_object(Body=fasta, Bucket="mock-bucket", Key="input/job1")
+    return s3_client
+
+
+def partial_keys(s3_client):
+    return [key for _, key in s3_client.objects if key.startswith("output/job1.partial/")]
+
+
+def run(s3_client, beam_generator):
+    with mock.patch('app.job_runner.boto3.client', return_value=s3_client), \
+            mock.patch('app.job_runner.initialize_collage_model'), \
+            mock.patch('app.job_runner.beam_generator', side_effect=beam_generator) as mocked_beam:
+        main(ARGS)
+    return mocked_beam
+
+
+def fake_beam_generator(model, protein, max_seqs=100):
+    return {"ATG" * len(protein): -len(protein)}
+
+
+def test_interrupted_job_resumes_without_repeating_work():
+    expected_s3 = make_s3()
+    run(expected_s3, fake_beam_generator)
+    expected_output = expected_s3.objects[("mock-bucket", "output/job1")]
+
+    s3_client = make_s3()
+    calls = []
+
+    def terminated_after_three(model, protein, max_seqs=100):
+        if len(calls) == 3:
+            # Simulates Batch stopping the job, e.g. when a Spot instance is reclaimed
+            os.kill(os.getpid(), signal.SIGTERM)
+        calls.append(protein)
+        return fake_beam_generator(model, protein, max_seqs)
+
+    with pytest.raises(SystemExit):
+        run(s3_client, terminated_after_three)
+
+    assert ("mock-bucket", "output/job1") not in s3_client.objects
+    assert partial_keys(s3_client)
+
+    resumed = run(s3_client, fake_beam_generator)
+
+    # Only the proteins that hadn't finished are predicted again
+    assert resumed.call_count == len(PROTEINS) - 3
+    assert s3_client.objects[("mock-bucket", "output/job1")] == expected_output
+    assert partial_keys(s3_client) == []
+
+
+def test_checkpoint_ignores_chunks_from_other_settings():
+    s3_client = FakeS3()
+    old = Checkpoint(s3_client, "mock-bucket", "output/job1", job_fingerprint("/models/Ecoli.pt", 10))
+    old.add("MKT", {"ATG": -1.0})
+    old.flush()
+
+    same = Checkpoint(s3_client, "mock-bucket", "output/job1", job_fingerprint("/models/Ecoli.pt", 10))
+    other = Checkpoint(s3_client, "mock-bucket", "output/job1", job_fingerprint("/models/Ecoli.pt", 100))
+
+    assert same.load() == {"MKT": {"ATG": -1.0}}
+    assert other.load() == {}
+
+
+def test_resumed_job_still_reports_reduced_beams():
+    s3_client = make_s3()
+    calls = []
+
+    def out_of_memory_on_ma(model, protein, max_seqs=100):
+        if len(calls) == 3:
+            os.kill(os.getpid(), signal.SIGTERM)
+        calls.append(protein)
+        if protein == "MA" and max_seqs > 1:
+            raise MemoryError()
+        return fake_beam_generator(model, protein, max_seqs)
+
+    with mock.patch('app.job_runner.boto3.client', return_value=s3_client), \
+            mock.patch('app.job_runner.initialize_collage_model'):
+        with mock.patch('app.job_runner.beam_generator', side_effect=out_of_memory_on_ma), \
+                pytest.raises(SystemExit):
+            main(ARGS + ["--memory_mode", "adaptive"])
+        # MA was predicted with a smaller beam before the job stopped, and isn't predicted again
+        with mock.patch('app.job_runner.beam_generator', side_effect=fake_beam_generator) as resumed:
+            main(ARGS + ["--memory_mode", "adaptive"])
+
+    assert "MA" not in [call.args[1] for call in resumed.call_args_list]
+    reduced = json.loads(s3_client.objects[("mock-bucket", "output/job1.reduced_beams.json")])
+    assert reduced == {"beamSize": 2, "reducedBeams": {"prot2": 1}}
+
+
+def test_fingerprint_follows_the_weights_not_their_path():
+    with mock.patch('app.prediction_store.weights_digest', return_value="abc"):
+        moved = job_fingerprint(model_version("/other/Ecoli.pt"), 10)
+        assert moved == job_fingerprint(model_version("/models/Ecoli.pt"), 10)
@@ -0,0 +1,57 @@
+import os
+from functools import partial
+from unittest import mock
+
+from app import job_runner
+from app.cpu_engine import parallel_map, plan_workers
+from app.job_runner import predict_scores
+
+# Set by init_offset in each worker process
+_offset = None
+
+
+def test_plan_workers_is_limited_by_tasks_cores_and_memory():
+    assert plan_workers(100, cores=32) == (16, 2)
+    assert plan_workers(3, cores=32) == (3, 10)
+    assert plan_workers(100, cores=32, memory_bytes=4 * 2**30, worker_memory_bytes=2**30) == (4, 8)
+    assert plan_workers(100, cores=1) == (1, 1)
+
+
+def init_offset(offset):
+    global _offset
+    _offset = offset
+
+
+def double_with_offset(item):
+    return item * 2 + _offset, os.getpid()
+
+
+def test_parallel_map_keeps_item_order_and_runs_in_other_processes():
+    items = [3, 1, 4, 1, 5, 9, 2, 6]
+    results = parallel_map(double_with_offset, items, workers=3, threads_per_worker=1, cost=lambda item: item,
+                           initializer=init_offset, initargs=(1000,))
+
+    assert [value for value, _ in results] == [item * 2 + 1000 for item in items]
+    assert os.getpid() not in {pid for _, pid in results}
+
+
+def fake_beam_generator(model, protein, max_seqs=100):
+    return {"ATG" * len(protein): -len(protein), "TTG" * len(protein): -len(protein) - 1}
+
+
+def load_fake_model(model_path):
+    # Runs in each spawned worker, which the test's patch of beam_generator doesn't reach
+    job_runner.beam_generator = fake_beam_generator
+    return object()
+
+
+@mock.patch('app.job_runner.beam_generator', fake_beam_generator)
+def test_parallel_predictions_match_serial_predictions():
+    proteins = list(dict.fromkeys("MKTVL"[:1 + i % 5] * (1 + i) for i in range(12)))
+
+    serial = predict_scores(object(), proteins, 2, 4096, cpu_workers=1)
+    parallel = predict_scores(object(), proteins, 2, 4096, cpu_workers=4,
+                              load_worker_model=partial(load_fake_model, "/models/fake.pt"))
+
+    assert parallel == serial
+    assert set(serial) == set(proteins)
@@ -0,0 +1,53 @@
+import os
+import threading
+
+from app.job_queue import DirectoryJobQueue, SQSJobQueue
+
+
+def test_directory_queue_claims_each_job_once(tmp_path):
+    queue = DirectoryJobQueue(str(tmp_path))
+    queue.put({"command": ["job-1"]})
+
+    descriptor, handle = queue.receive()
+
+    assert descriptor == {"command": ["job-1"]}
+    assert queue.receive() is None
+
+    queue.ack(handle)
+    assert not os.path.exists(handle)
+
+
+def test_directory_queue_moves_failed_jobs_aside(tmp_path):
+    queue = DirectoryJobQueue(str(tmp_path))
+    name = queue.put({"command": ["job-1"]})
+
+    _, handle = queue.receive()
+    queue.fail(handle)
+
+    assert os.listdir(tmp_path / "failed") == [name]
+    assert queue.receive() is None
+
+
+class RecordingSQS:
+    def __init__(self):
+        self.visibility_changes = []
+        self.changed = threading.Event()
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self.visibility_changes.append((ReceiptHandle, VisibilityTimeout))
+        self.changed.set()
+
+
+def test_sqs_queue_extends_visibility_while_a_job_runs():
+    sqs = RecordingSQS()
+    queue = SQSJobQueue("https://sqs.mock/queue", visibility_timeout=60, sqs_client=sqs)
+    queue.heartbeat_seconds = 0.01
+
+    with queue.keep_alive("receipt"):
+        assert sqs.changed.wait(5)
+    changes = len(sqs.visibility_changes)
+
+    assert sqs.visibility_changes[0] == ("receipt", 60)
+    # Nothing more once the job has finished
+    threading.Event().wait(0.05)
+    assert len(sqs.visibility_changes) == changes
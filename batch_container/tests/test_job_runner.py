@@ -1,5 +1,15 @@
+import inspect
+import json
+import os
+import subprocess
+import sys
+
 import boto3
-from app.job_runner import download_predict_upload
+import pytest
+from app.job_runner import download_predict_upload, parse_args
+from app.scores_output import ScoresReader, s3_range_reader
+from content_encoding import compress, open_decompressed
+from tests.fakes import FakeS3
 from unittest import mock
 
 
@@ -30,3 +40,121 @@ def test_job_runner_gets_file_and_uploads_predictions_file_to_s3(mocked_parse, m
     assert s3_put_call["Bucket"] == "mock-bucket"
     assert s3_put_call["Key"] == "mock-output-prefix/mock-object-name"
     assert s3_put_call["Body"] == ">seq0: negLL: -42\nTAGCAT\n>seq1: negLL: -43\nGAGAGA\n"
+
+
+@mock.patch('app.job_runner.beam_generator')
+@mock.patch('app.job_runner.initialize_collage_model')
+@mock.patch('app.job_runner.parse_fasta')
+def test_job_runner_multi_protein_predicts_each_unique_protein_once(mocked_parse, mocked_init, mocked_beam):
+    mocked_parse.return_value = {"prot1": "MKT", "prot2": "MKVL", "prot3": "MKT"}
+    mocked_beam.side_effect = lambda model, protein, max_seqs: {"ATG" * len(protein): -len(protein)}
+
+    download_predict_upload("mock-bucket", "mock-object-name", "in/", "out/", "/mock/path/to/model", 100, True,
+                            multi_protein=True)
+
+    assert mocked_beam.call_count == 2
+    assert mocked_init.call_count == 1
+
+    s3_put_call = boto3.client('s3').put_object.call_args.kwargs
+    assert s3_put_call["Body"] == (">prot1|seq0: negLL: -3\nATGATGATG\n"
+                                   ">prot2|seq0: negLL: -4\nATGATGATGATG\n"
+                                   ">prot3|seq0: negLL: -3\nATGATGATG\n")
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+@mock.patch('app.job_runner.beam_generator')
+@mock.patch('app.job_runner.initialize_collage_model')
+def test_job_runner_reads_and_writes_compressed_fasta(mocked_init, mocked_beam, encoding):
+    if encoding == "zstd":
+        pytest.importorskip("zstandard")
+    mocked_beam.return_value = {"TAGCAT": -42}
+    s3_client = FakeS3()
+    s3_client.put_object(Body=compress(b">prot\nMKT\n", encoding), Bucket="mock-bucket", Key="in/job")
+
+    download_predict_upload("mock-bucket", "job", "in/", "out/", "/mock/path/to/model", 100, True,
+                            output_encoding=encoding, s3_client=s3_client)
+
+    assert mocked_beam.call_args.args[1] == "MKT"
+    output = s3_client.get_object(Bucket="mock-bucket", Key="out/job")
+    assert output["ContentEncoding"] == encoding
+    assert output["ContentType"].startswith("text/plain")
+    reader, detected = open_decompressed(output["Body"])
+    assert detected == encoding
+    assert reader.read() == b">seq0: negLL: -42\nTAGCAT\n"
+
+
+@mock.patch('app.job_runner.beam_generator')
+@mock.patch('app.job_runner.initialize_collage_model')
+def test_job_runner_writes_scores_next_to_the_fasta(mocked_init, mocked_beam):
+    mocked_beam.side_effect = lambda model, protein, max_seqs: {"ATG" * len(protein): -len(protein), "TAA": -0.5}
+    s3_client = FakeS3()
+    s3_client.put_object(Body=">prot1\nMKT\n>prot2\nMKVL\n>prot3\nMKT\n", Bucket="mock-bucket", Key="in/job")
+
+    download_predict_upload("mock-bucket", "job", "in/", "out/", "/mock/path/to/model", 100, True,
+                            multi_protein=True, scores_format="binary", s3_client=s3_client)
+
+    reader = ScoresReader(s3_range_reader(s3_client, "mock-bucket", "out/job.scores.bin"))
+    assert [name for name, _, _ in reader.proteins()] == ["prot1", "prot2", "prot3"]
+    assert reader.top_rows(1, "prot2") == [("prot2", 0, -4.0, "ATGATGATGATG")]
+    assert reader.scores() == [-3.0, -0.5, -4.0, -0.5, -3.0, -0.5]
+    assert ("mock-bucket", "out/job") in s3_client.objects
+
+
+@mock.patch('app.job_runner.beam_generator')
+@mock.patch('app.job_runner.initialize_collage_model')
+def test_job_runner_writes_progress(mocked_init, mocked_beam):
+    mocked_beam.side_effect = lambda model, protein, max_seqs: {"ATG" * len(protein): -len(protein)}
+    s3_client = FakeS3()
+    s3_client.put_object(Body=">prot1\nMKT\n>prot2\nMKVL\n>prot3\nMKT\n", Bucket="mock-bucket", Key="in/job")
+
+    download_predict_upload("mock-bucket", "job", "in/", "out/", "/mock/path/to/model", 100, True,
+                            multi_protein=True, progress_interval=60, s3_client=s3_client)
+
+    progress = json.loads(s3_client.get_object(Bucket="mock-bucket", Key="progress/job.json")["Body"].read())
+    assert progress["proteinsDone"] == progress["proteinsTotal"] == 2
+    assert progress["stage"] is None
+    assert {"s3_get", "model_init", "beam_search", "s3_put"} <= set(progress["stageSeconds"])
+
+
+@mock.patch('app.job_runner.beam_generator')
+@mock.patch('app.job_runner.initialize_collage_model')
+def test_adaptive_memory_mode_retries_out_of_memory_with_a_smaller_beam(mocked_init, mocked_beam):
+    def beam_generator(model, protein, max_seqs):
+        if len(protein) > 3 and max_seqs > 25:
+            raise MemoryError()
+        return {"ATG" * len(protein): -float(max_seqs)}
+
+    mocked_beam.side_effect = beam_generator
+    s3_client = FakeS3()
+    s3_client.put_object(Body=">prot1\nMKT\n>prot2\nMKVL\n", Bucket="mock-bucket", Key="in/job")
+
+    download_predict_upload("mock-bucket", "job", "in/", "out/", "/mock/path/to/model", 100, True,
+                            multi_protein=True, memory_mode="adaptive", s3_client=s3_client)
+
+    output = s3_client.get_object(Bucket="mock-bucket", Key="out/job")["Body"].read().decode()
+    assert output == ">prot1|seq0: negLL: -100.0\nATGATGATG\n>prot2|seq0: negLL: -25.0\nATGATGATGATG\n"
+    reduced = json.loads(s3_client.get_object(Bucket="mock-bucket", Key="out/job.reduced_beams.json")["Body"].read())
+    assert reduced == {"beamSize": 100, "reducedBeams": {"prot2": 25}}
+    assert ("mock-bucket", "memory-models/cpu.json") in s3_client.objects
+
+
+def test_importing_job_runner_defers_heavy_imports():
+    # A fresh interpreter, since this one has already imported everything
+    code = ("import sys, app.job_runner; "
+            "print(sorted(m for m in ('boto3', 'collage', 'torch', 'pyarrow') if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    assert result.stdout.strip() == "[]"
+
+
+def test_command_line_defaults_match_download_predict_upload():
+    # So that tests calling download_predict_upload cover what the service runs. --cpu_workers picks the
+    # workers for the machine, progress is always written for the status API, and conftest.py points
+    # the prediction cache at a temporary directory.
+    expected_differences = {"cpu_workers", "progress_interval", "prediction_cache_dir"}
+    cli_defaults = vars(parse_args(["bucket", "object", "in/", "out/"]))
+    parameters = inspect.signature(download_predict_upload).parameters
+
+    differences = {name for name, value in cli_defaults.items()
+                   if parameters[name].default is not inspect.Parameter.empty and parameters[name].default != value}
+    assert differences == expected_differences
@@ -0,0 +1,112 @@
+from contextlib import contextmanager
+
+import pytest
+
+from app.memory_model import AdaptiveMemory, LoadTracker, MemoryModel, load_memory_model, save_memory_model
+from tests.fakes import FakeS3
+
+
+class FakeProbe:
+    def __init__(self, free_bytes=None, peak_bytes=None):
+        self.free = free_bytes
+        self.peak_bytes = peak_bytes
+        self.released = 0
+
+    def free_bytes(self):
+        return self.free
+
+    @contextmanager
+    def measure(self):
+        result = {"peak_bytes": None}
+        yield result
+        result["peak_bytes"] = self.peak_bytes
+
+    def release(self):
+        self.released += 1
+
+
+def test_learning_replaces_the_default_then_decays_slowly():
+    memory_model = MemoryModel()
+
+    memory_model.observe(100, 10, peak_bytes=2_000_000)
+    assert memory_model.bytes_per_beam_residue == 2000
+    memory_model.observe(100, 10, peak_bytes=1_000_000)
+    assert memory_model.bytes_per_beam_residue == pytest.approx(1980)
+    memory_model.observe_out_of_memory(100, 10, free_bytes=5_000_000)
+    assert memory_model.bytes_per_beam_residue == 5000
+
+
+def test_out_of_memory_halves_the_beam_and_retries():
+    memory = AdaptiveMemory(MemoryModel(bytes_per_beam_residue=1), FakeProbe(free_bytes=10**9, peak_bytes=800))
+    beams = []
+
+    def generate(protein, beam):
+        beams.append(beam)
+        if beam > 25:
+            raise RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return {"ATG": -1.0}
+
+    assert memory.predict(generate, "MKT", 100) == ({"ATG": -1.0}, 25)
+    assert beams == [100, 50, 25]
+    assert memory.out_of_memory_retries == 2
+    assert memory.reduced_beams == {"MKT": 25}
+    assert memory.probe.released == 2
+
+
+def test_full_beam_is_tried_first_however_little_memory_seems_free():
+    # An estimate far above what's free only plans CPU workers, the beam is reduced after a real out of memory error
+    memory = AdaptiveMemory(MemoryModel(bytes_per_beam_residue=10**9), FakeProbe(free_bytes=1, peak_bytes=800))
+    beams = []
+
+    def generate(protein, beam):
+        beams.append(beam)
+        return {"ATG": -1.0}
+
+    assert memory.predict(generate, "MKT", 100) == ({"ATG": -1.0}, 100)
+    assert beams == [100]
+    assert memory.reduced_beams == {}
+
+
+def test_nothing_is_learned_from_a_beam_search_that_overlapped_a_model_load():
+    loads = LoadTracker()
+    memory = AdaptiveMemory(MemoryModel(), FakeProbe(free_bytes=10**9, peak_bytes=10**9), loads)
+
+    with loads.loading():
+        memory.predict(lambda protein, beam: {"ATG": -1.0}, "MKT", 100)
+
+    def generate_while_a_load_starts(protein, beam):
+        with loads.loading():
+            if beam > 50:
+                raise MemoryError()
+            return {"ATG": -1.0}
+
+    assert memory.predict(generate_while_a_load_starts, "MKT", 100) == ({"ATG": -1.0}, 50)
+    assert memory.memory_model.observations == 0
+
+    memory.predict(lambda protein, beam: {"ATG": -1.0}, "MKT", 100)
+    assert memory.memory_model.observations == 1
+
+
+def test_other_errors_and_the_smallest_beam_are_not_retried():
+    memory = AdaptiveMemory(MemoryModel(), FakeProbe())
+
+    def fails_with(error):
+        def generate(protein, beam):
+            raise error
+        return generate
+
+    with pytest.raises(ValueError):
+        memory.predict(fails_with(ValueError("bad protein")), "MKT", 100)
+    with pytest.raises(MemoryError):
+        memory.predict(fails_with(MemoryError()), "MKT", 1)
+
+
+def test_memory_model_is_saved_and_loaded():
+    s3_client = FakeS3()
+    assert load_memory_model(s3_client, "mock-bucket", "gpu").observations == 0
+
+    save_memory_model(s3_client, "mock-bucket", "gpu", MemoryModel(1234, 5))
+    loaded = load_memory_model(s3_client, "mock-bucket", "gpu")
+
+    assert (loaded.bytes_per_beam_residue, loaded.observations) == (1234, 5)
+    assert load_memory_model(s3_client, "mock-bucket", "cpu").observations == 0
@@ -0,0 +1,86 @@
+import sys
+import threading
+import types
+import zipfile
+
+import pytest
+
+from app.model_artifacts import artifact_path, build_all, digest_path, load_model
+from app.prediction_store import model_version
+
+
+def test_loads_the_original_model_without_an_artifact(tmp_path):
+    model_path = str(tmp_path / "Ecoli.pt")
+    calls = []
+
+    load_model(model_path, False, lambda path, use_gpu: calls.append((path, use_gpu)))
+
+    assert calls == [(model_path, False)]
+
+
+def test_maps_a_model_saved_in_the_zip_format_without_copying_it(tmp_path):
+    torch = pytest.importorskip("torch")
+    weights = {"weight": torch.arange(12.0).reshape(3, 4), "bias": torch.ones(3)}
+    torch.save(weights, tmp_path / "Ecoli.pt")
+    (tmp_path / "notes.txt").write_text("not a model")
+
+    assert build_all(str(tmp_path)) == []
+
+    def initialize(path, use_gpu):
+        # Like initialize_collage_model, which calls torch.load without mmap
+        return path, torch.load(path)
+
+    path, loaded = load_model(str(tmp_path / "Ecoli.pt"), False, initialize)
+    assert path == str(tmp_path / "Ecoli.pt")
+    assert torch.equal(loaded["weight"], weights["weight"])
+
+
+def test_loads_the_mapped_artifact_of_a_model_in_the_older_format(tmp_path):
+    torch = pytest.importorskip("torch")
+    weights = {"weight": torch.arange(12.0).reshape(3, 4)[:, 1:], "bias": torch.ones(3)}
+    torch.save(weights, tmp_path / "Ecoli.pt", _use_new_zipfile_serialization=False)
+
+    assert build_all(str(tmp_path)) == [artifact_path(str(tmp_path / "Ecoli.pt"))]
+
+    path, loaded = load_model(str(tmp_path / "Ecoli.pt"), False, lambda path, use_gpu: (path, torch.load(path)))
+    assert path == str(tmp_path / "Ecoli.mmap.pt")
+    assert torch.equal(loaded["weight"], weights["weight"])
+    assert torch.equal(loaded["bias"], weights["bias"])
+
+
+def test_only_the_loading_thread_maps(tmp_path, monkeypatch):
+    fake_torch = types.ModuleType("torch")
+    fake_torch.load = lambda path, mmap=None: mmap
+    monkeypatch.setitem(sys.modules, "torch", fake_torch)
+    with zipfile.ZipFile(tmp_path / "Ecoli.pt", "w") as f:
+        f.writestr("data.pkl", b"")
+    other_thread = []
+
+    def initialize(path, use_gpu):
+        # Another thread loading while the model does, e.g. a job's io thread
+        thread = threading.Thread(target=lambda: other_thread.append(fake_torch.load(path)))
+        thread.start()
+        thread.join()
+        return fake_torch.load(path)
+
+    assert load_model(str(tmp_path / "Ecoli.pt"), False, initialize) is True
+    assert other_thread == [None]
+    assert fake_torch.load(str(tmp_path / "Ecoli.pt")) is None
+
+
+def test_build_writes_digests_that_model_versions_use(tmp_path, monkeypatch):
+    model_path = tmp_path / "Ecoli.pt"
+    with zipfile.ZipFile(model_path, "w") as f:
+        f.writestr("data.pkl", b"weights")
+
+    assert build_all(str(tmp_path)) == []
+
+    digest = (tmp_path / "Ecoli.sha256").read_text()
+    assert digest_path(str(model_path)) == str(tmp_path / "Ecoli.sha256")
+    assert model_version(str(model_path)).startswith(f"{digest}:")
+    # The weights aren't hashed again at runtime
+    model_path.write_bytes(b"retrained")
+    assert model_version(str(model_path)).startswith(f"{digest}:")
+
+    monkeypatch.setattr("app.prediction_store.collage_version", lambda: "2.0")
+    assert model_version(str(model_path)) == f"{digest}:2.0"
@@ -0,0 +1,47 @@
+from unittest.mock import Mock
+
+from app.model_registry import ModelRegistry
+
+MB = 2**20
+
+
+def make_registry(budget_mb, sizes_mb):
+    load_model = Mock(side_effect=lambda path, use_gpu: path)
+    registry = ModelRegistry(load_model, budget_mb * MB, size_of=lambda model: sizes_mb[model] * MB)
+    return registry, load_model
+
+
+def test_registry_caches_loaded_models():
+    registry, load_model = make_registry(10, {"/models/Ecoli.pt": 4})
+
+    assert registry("/models/Ecoli.pt", True) == "/models/Ecoli.pt"
+    assert registry("/models/Ecoli.pt", True) == "/models/Ecoli.pt"
+
+    assert load_model.call_count == 1
+    stats = registry.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert len(stats["load_seconds"]["/models/Ecoli.pt"]) == 1
+
+
+def test_registry_evicts_least_recently_used_model_over_budget():
+    registry, load_model = make_registry(10, {"/models/a.pt": 4, "/models/b.pt": 4, "/models/c.pt": 4})
+
+    registry.preload(["a", "b"], True)
+    # Touch a so that b is the least recently used
+    registry.get_species("a", True)
+    registry.get_species("c", True)
+
+    stats = registry.stats()
+    assert stats["evictions"] == 1
+    assert stats["resident_models"] == ["/models/a.pt", "/models/c.pt"]
+    assert stats["resident_bytes"] == 8 * MB
+
+
+def test_registry_keeps_oversized_model_on_its_own():
+    registry, load_model = make_registry(10, {"/models/a.pt": 4, "/models/huge.pt": 20})
+
+    registry.get_species("a", True)
+    registry.get_species("huge", True)
+
+    assert registry.stats()["resident_models"] == ["/models/huge.pt"]
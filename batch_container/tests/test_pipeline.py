@@ -0,0 +1,90 @@
+import threading
+from unittest.mock import Mock, patch
+
+import pytest
+from app.pipeline import run_pipeline, upload_bytes
+
+
+def test_pipeline_returns_outputs_in_order_and_uploads_each():
+    uploaded = {}
+
+    outputs = run_pipeline(
+        [1, 2, 3],
+        fetch=lambda job: job * 10,
+        load_model=lambda job: "model",
+        predict=lambda model, job, job_input: f"{model}:{job_input}",
+        upload=lambda job, output: uploaded.__setitem__(job, output),
+    )
+
+    assert outputs == ["model:10", "model:20", "model:30"]
+    assert uploaded == {1: "model:10", 2: "model:20", 3: "model:30"}
+
+
+def test_pipeline_loads_model_while_fetching():
+    model_loading = threading.Event()
+
+    def fetch(job):
+        # Would time out if the model were only loaded after the fetch finished
+        assert model_loading.wait(2)
+        return job
+
+    def load_model(job):
+        model_loading.set()
+        return "model"
+
+    assert run_pipeline([1], fetch, load_model, lambda m, j, i: i, lambda j, o: None) == [1]
+
+
+def test_pipeline_prefetches_next_input_during_prediction():
+    second_fetched = threading.Event()
+
+    def fetch(job):
+        if job == 2:
+            second_fetched.set()
+        return job
+
+    def predict(model, job, job_input):
+        if job == 1:
+            assert second_fetched.wait(2)
+        return job_input
+
+    assert run_pipeline([1, 2], fetch, lambda job: None, predict, lambda j, o: None) == [1, 2]
+
+
+def test_pipeline_raises_upload_errors():
+    def upload(job, output):
+        raise RuntimeError("upload failed")
+
+    with pytest.raises(RuntimeError):
+        run_pipeline([1], lambda job: job, lambda job: None, lambda m, j, i: i, upload)
+
+
+def test_pipeline_runs_the_other_jobs_when_one_fails():
+    uploaded = {}
+
+    def fetch(job):
+        if job == 1:
+            raise RuntimeError("fetch failed")
+        return job
+
+    def predict(model, job, job_input):
+        if job == 2:
+            raise ValueError("predict failed")
+        return job_input
+
+    with pytest.raises(RuntimeError, match="fetch failed"):
+        run_pipeline([1, 2, 3], fetch, lambda job: None, predict, uploaded.__setitem__)
+
+    assert uploaded == {3: 3}
+
+
+def test_upload_bytes_uses_multipart_for_large_bodies():
+    s3_client = Mock()
+
+    with patch('app.pipeline.MULTIPART_THRESHOLD_BYTES', 10):
+        upload_bytes(s3_client, "bucket", "small", "tiny")
+        upload_bytes(s3_client, "bucket", "large", "A" * 100)
+
+    assert s3_client.put_object.call_args.kwargs == {"Body": "tiny", "Bucket": "bucket", "Key": "small"}
+    fileobj, bucket, key = s3_client.upload_fileobj.call_args.args
+    assert (fileobj.read(), bucket, key) == (b"A" * 100, "bucket", "large")
@@ -0,0 +1,85 @@
+import json
+import os
+from unittest import mock
+
+from app.job_runner import download_predict_upload
+from app.prediction_store import DiskLRU, PredictionStore, STORE_PREFIX
+from tests.fakes import FakeS3
+
+
+def test_disk_lru_drops_least_recently_used(tmp_path):
+    lru = DiskLRU(str(tmp_path), max_bytes=10)
+    lru.put("a", b"aaaa")
+    lru.put("b", b"bbbb")
+    assert lru.get("a") == b"aaaa"
+    lru.put("c", b"cccc")
+
+    assert lru.get("b") is None
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+    # A later run picks up what's on disk
+    assert DiskLRU(str(tmp_path), max_bytes=10).get("c") == b"cccc"
+
+
+def test_store_falls_back_to_s3_and_caches_locally(tmp_path):
+    s3_client = FakeS3()
+    PredictionStore(s3_client, "mock-bucket", str(tmp_path / "first")).for_model("v1", 10).put("MKT", {"ATG": -1.0})
+    assert [key for _, key in s3_client.objects if key.startswith(STORE_PREFIX)]
+
+    # Another container, with an empty local tier
+    predictions = PredictionStore(s3_client, "mock-bucket", str(tmp_path / "second")).for_model("v1", 10)
+    assert predictions.get_many(["MKT", "MKV"]) == {"MKT": {"ATG": -1.0}}
+    assert predictions.get_many(["MKT"]) == {"MKT": {"ATG": -1.0}}
+    assert (predictions.hits, predictions.local_hits, predictions.misses) == (2, 1, 1)
+
+    # Other model versions and beam sizes don't share results
+    store = PredictionStore(s3_client, "mock-bucket", str(tmp_path / "second"))
+    assert store.for_model("v2", 10).get_many(["MKT"]) == {}
+    assert store.for_model("v1", 100).get_many(["MKT"]) == {}
+
+
+def beam_generator(model, protein, max_seqs):
+    return {"ATG" * len(protein): -len(protein)}
+
+
+@mock.patch('app.job_runner.beam_generator', side_effect=beam_generator)
+@mock.patch('app.job_runner.initialize_collage_model')
+def test_overlapping_jobs_only_predict_new_proteins(mocked_init, mocked_beam, tmp_path, capsys):
+    s3_client = FakeS3()
+    s3_client.put_object(Body=">prot1\nMKT\n>prot2\nMKVL\n", Bucket="mock-bucket", Key="in/job1")
+    s3_client.put_object(Body=">prot1\nMKT\n>prot2\nMKVL\n>prot3\nMA\n", Bucket="mock-bucket", Key="in/job2")
+    options = dict(multi_protein=True, prediction_store="s3", s3_client=s3_client)
+
+    download_predict_upload("mock-bucket", "job1", "in/", "out/", "/models/Ecoli.pt", 10, True,
+                            prediction_cache_dir=str(tmp_path / "first"), **options)
+    mocked_beam.reset_mock()
+    capsys.readouterr()
+    download_predict_upload("mock-bucket", "job2", "in/", "out/", "/models/Ecoli.pt", 10, True,
+                            prediction_cache_dir=str(tmp_path / "second"), **options)
+
+    assert [call.args[1] for call in mocked_beam.call_args_list] == ["MA"]
+    # Only what the model predicted counts towards the routing calibration
+    record = next(json.loads(line) for line in capsys.readouterr().out.splitlines() if '"service"' in line)
+    assert (record["predicted_sequences"], record["predicted_residues"], record["store_hits"]) == (1, 2, 2)
+    assert s3_client.objects[("mock-bucket", "out/job2")] == (b">prot1|seq0: negLL: -3\nATGATGATG\n"
+                                                               b">prot2|seq0: negLL: -4\nATGATGATGATG\n"
+                                                               b">prot3|seq0: negLL: -2\nATGATG\n")
+
+
+@mock.patch('app.job_runner.initialize_collage_model')
+def test_reduced_beam_predictions_are_not_stored(mocked_init, tmp_path):
+    def out_of_memory_above_five(model, protein, max_seqs):
+        if max_seqs > 5:
+            raise MemoryError()
+        return beam_generator(model, protein, max_seqs)
+
+    s3_client = FakeS3()
+    s3_client.put_object(Body=">prot1\nMKT\n", Bucket="mock-bucket", Key="in/job1")
+
+    with mock.patch('app.job_runner.beam_generator', side_effect=out_of_memory_above_five):
+        download_predict_upload("mock-bucket", "job1", "in/", "out/", "/models/Ecoli.pt", 10, True,
+                                memory_mode="adaptive", prediction_store="s3", s3_client=s3_client,
+                                prediction_cache_dir=str(tmp_path))
+
+    assert ("mock-bucket", "out/job1") in s3_client.objects
+    assert not [key for _, key in s3_client.objects if key.startswith(STORE_PREFIX)]
+    assert os.listdir(tmp_path) == []
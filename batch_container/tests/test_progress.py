@@ -0,0 +1,73 @@
+import json
+import time
+
+from app.progress import ProgressReporter
+from tests.fakes import FakeS3
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def read_progress(s3_client, job_id="job1"):
+    return json.loads(s3_client.get_object(Bucket="mock-bucket", Key=f"progress/{job_id}.json")["Body"].read())
+
+
+def test_changes_within_the_interval_are_coalesced():
+    s3_client = FakeS3()
+    clock = FakeClock()
+    reporter = ProgressReporter(s3_client, "mock-bucket", "job1", min_interval_seconds=60, clock=clock)
+
+    reporter.set_total(100)
+    for _ in range(40):
+        reporter.protein_done()
+    # Only the first change is written straight away, the rest wait out the interval
+    assert reporter.writes == 1
+    assert read_progress(s3_client)["proteinsDone"] == 0
+
+    clock.now = 61
+    reporter.protein_done()
+    assert reporter.writes == 2
+    assert read_progress(s3_client)["proteinsDone"] == 41
+    assert read_progress(s3_client)["elapsedSeconds"] == 61
+
+
+def test_pending_change_is_written_when_the_interval_is_up():
+    s3_client = FakeS3()
+    reporter = ProgressReporter(s3_client, "mock-bucket", "job1", min_interval_seconds=0.1)
+
+    reporter.set_total(2)
+    reporter.protein_done()
+    time.sleep(0.3)
+
+    assert reporter.writes == 2
+    assert read_progress(s3_client)["proteinsDone"] == 1
+
+
+def test_stages_are_reported():
+    s3_client = FakeS3()
+    reporter = ProgressReporter(s3_client, "mock-bucket", "job1", min_interval_seconds=0)
+
+    reporter.on_stage("s3_get", None)
+    assert read_progress(s3_client)["stage"] == "s3_get"
+    reporter.on_stage("s3_get", 0.25)
+    reporter.on_stage("beam_search", None)
+
+    progress = read_progress(s3_client)
+    assert progress["stage"] == "beam_search"
+    assert progress["stageSeconds"] == {"s3_get": 0.25}
+
+
+def test_failed_write_does_not_raise():
+    class FailingS3:
+        def put_object(self, **kwargs):
+            raise ConnectionError("no network")
+
+    reporter = ProgressReporter(FailingS3(), "mock-bucket", "job1")
+    reporter.set_total(1)
+    reporter.protein_done()
+    reporter.flush()
@@ -0,0 +1,94 @@
+import io
+
+import pytest
+
+from app.scores_output import (AUTO, BINARY, PARQUET, ScoresReader, resolve_format, s3_range_reader,
+                               serialize_scores, write_binary)
+from tests.fakes import FakeS3
+
+SCORES = {
+    "prot1": {"ATGAAA": 1.5, "ATGAAG": 2.25, "ATGCCC": 7.0},
+    "protéine2": {"ATG": 0.5},
+    "prot3": {"ATGTTTTTT": 3.0, "ATGTTC": 4.0},
+}
+
+
+def s3_reader(data: bytes):
+    s3_client = FakeS3()
+    s3_client.put_object(Body=data, Bucket="mock-bucket", Key="out/job.scores.bin")
+    return ScoresReader(s3_range_reader(s3_client, "mock-bucket", "out/job.scores.bin")), s3_client
+
+
+def test_binary_scores_round_trip():
+    reader, _ = s3_reader(write_binary(SCORES))
+
+    assert reader.row_count == 6
+    assert reader.proteins() == [("prot1", 0, 3), ("protéine2", 3, 1), ("prot3", 4, 2)]
+    assert reader.rows(0, 6) == [
+        ("prot1", 0, 1.5, "ATGAAA"),
+        ("prot1", 1, 2.25, "ATGAAG"),
+        ("prot1", 2, 7.0, "ATGCCC"),
+        ("protéine2", 0, 0.5, "ATG"),
+        ("prot3", 0, 3.0, "ATGTTTTTT"),
+        ("prot3", 1, 4.0, "ATGTTC"),
+    ]
+
+
+def test_rows_are_ranked_by_score_whatever_order_the_beam_search_returned():
+    reader, _ = s3_reader(write_binary({"prot1": {"ATGCCC": 7.0, "ATGAAA": 1.5, "ATGAAG": 2.25}}))
+
+    assert reader.top_rows(2, "prot1") == [("prot1", 0, 1.5, "ATGAAA"), ("prot1", 1, 2.25, "ATGAAG")]
+
+
+def test_empty_scores_file_reads_no_rows():
+    reader, _ = s3_reader(write_binary({}))
+
+    assert reader.row_count == 0
+    assert reader.scores() == []
+    assert reader.proteins() == []
+
+
+def test_top_rows_only_reads_the_rows_asked_for():
+    data = write_binary(SCORES)
+    reader, s3_client = s3_reader(data)
+    reader.proteins()
+    s3_client.range_requests.clear()
+
+    assert reader.top_rows(2, "prot3") == [("prot3", 0, 3.0, "ATGTTTTTT"), ("prot3", 1, 4.0, "ATGTTC")]
+
+    fetched = 0
+    for _, byte_range in s3_client.range_requests:
+        start, end = byte_range.removeprefix("bytes=").split("-")
+        fetched += int(end) - int(start) + 1
+    # Two scores, ranks and protein indices, three sequence offsets and the two sequences
+    assert fetched == 2 * 8 + 2 * 4 + 2 * 4 + 3 * 8 + len("ATGTTTTTTATGTTC")
+
+
+def test_score_column_is_one_read():
+    reader, s3_client = s3_reader(write_binary(SCORES))
+    s3_client.range_requests.clear()
+
+    assert reader.scores() == [1.5, 2.25, 7.0, 0.5, 3.0, 4.0]
+    assert len(s3_client.range_requests) == 1
+
+
+def test_rejects_other_files():
+    with pytest.raises(ValueError):
+        ScoresReader(lambda start, end: b"\0" * (end - start))
+
+
+def test_parquet_scores():
+    pq = pytest.importorskip("pyarrow.parquet")
+    data, suffix, _ = serialize_scores(SCORES, PARQUET)
+
+    table = pq.read_table(io.BytesIO(data))
+    assert suffix == ".scores.parquet"
+    assert table.column_names == ["protein", "rank", "neg_log_likelihood", "sequence"]
+    assert table.column("neg_log_likelihood").to_pylist() == [1.5, 2.25, 7.0, 0.5, 3.0, 4.0]
+
+
+def test_auto_format_falls_back_to_binary_without_pyarrow(monkeypatch):
+    monkeypatch.setattr("app.scores_output.pyarrow_available", lambda: False)
+    assert resolve_format(AUTO) == BINARY
+    with pytest.raises(ValueError):
+        resolve_format(PARQUET)
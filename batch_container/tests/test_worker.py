@@ -0,0 +1,18 @@
+from app.job_queue import DirectoryJobQueue
+from app.worker import run_worker
+
+
+def test_worker_runs_queued_jobs_until_idle(tmp_path):
+    queue = DirectoryJobQueue(str(tmp_path))
+    queue.put({"command": ["good"]})
+    queue.put({"command": ["bad"]})
+
+    def run_job(descriptor):
+        if descriptor["command"] == ["bad"]:
+            raise RuntimeError("job failed")
+
+    succeeded = run_worker(queue, run_job, idle_timeout=0.05, poll_interval=0.01)
+
+    assert succeeded == 1
+    assert len(list((tmp_path / "failed").iterdir())) == 1
+
@@ -0,0 +1,126 @@
+"""
+Cold start benchmark for the request_job lambda.
+
+Each sample runs in a fresh Python process, like a new Lambda execution environment,
+and measures the module import plus the first invocation. AWS clients are stubbed,
+with optional fake latency for client creation and the Secrets Manager call.
+
+Run from sam/backend:
+    python -m benchmarks.cold_start --samples 20 --client_latency_ms 50 --secret_latency_ms 100
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED_DIR = os.path.join(BACKEND_DIR, "..", "..", "shared")
+
+
+def summarize(values: list) -> dict:
+    # Imported here, in the parent only, so that a child doesn't load the shared layer before it's timed
+    if SHARED_DIR not in sys.path:
+        sys.path.insert(0, SHARED_DIR)
+    from instrumentation import percentile
+    return {
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "mean_ms": statistics.mean(values),
+    }
+
+
+def run_child(method: str, client_latency_ms: float, secret_latency_ms: float) -> dict:
+    """
+    Runs in the fresh process. Stubs boto3, imports the lambda and invokes it once.
+    boto3 is replaced by a stub module rather than patched, since patching would import the real one
+    before the timer starts and hide its cost.
+    """
+    import types
+    from unittest.mock import Mock, patch
+
+    def get_secret_value(**kwargs):
+        time.sleep(secret_latency_ms / 1000)
+        return {"SecretString": "benchmark-secret"}
+
+    def make_client(service_name, *args, **kwargs):
+        from tests.unit.fakes import FakeS3
+        time.sleep(client_latency_ms / 1000)
+        if service_name == "s3":
+            return FakeS3()
+        if service_name == "secretsmanager":
+            return Mock(get_secret_value=Mock(side_effect=get_secret_value))
+        return Mock()
+
+    sys.modules["boto3"] = types.SimpleNamespace(client=make_client)
+
+    start = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+
+    from tests.unit.conftest import create_multipart
+
+    if method == "OPTIONS":
+        event = {"httpMethod": "OPTIONS"}
+    else:
+        body, headers = create_multipart({"token": "token", "species": "human"},
+                                         {"fasta": ("a.fasta", b">prot\nMKT\n", "text/plain")})
+        event = {"httpMethod": "POST", "isBase64Encoded": False, "headers": headers, "body": body}
+
+    recaptcha_response = Mock(status_code=200, json=Mock(return_value={"success": True, "score": 0.9}))
+    with patch("requests.post", return_value=recaptcha_response), \
+            patch("requests.Session.post", return_value=recaptcha_response):
+        invoke_start = time.perf_counter()
+        ret = app.lambda_handler(event, None)
+        invoked = time.perf_counter()
+
+    return {
+        "status": ret["statusCode"],
+        "import_ms": (imported - start) * 1000,
+        "first_invoke_ms": (invoked - invoke_start) * 1000,
+    }
+
+
+def sample(method: str, args) -> dict:
+    env = dict(os.environ, AWS_REGION="us-west-1", INPUT_BUCKET="benchmark-bucket",
+               JOB_DEFINITION="benchmark-job-definition", JOB_QUEUE="benchmark-job-queue",
+               PYTHONPATH=os.pathsep.join([BACKEND_DIR, os.path.join(BACKEND_DIR, "request_job"), SHARED_DIR]))
+    cmd = [sys.executable, "-m", "benchmarks.cold_start", "--child", method,
+           "--client_latency_ms", str(args.client_latency_ms), "--secret_latency_ms", str(args.secret_latency_ms)]
+    # Time the whole process too, since interpreter startup is part of a real cold start
+    start = time.perf_counter()
+    out = subprocess.run(cmd, cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True).stdout
+    total_ms = (time.perf_counter() - start) * 1000
+    result = json.loads(out.strip().splitlines()[-1])
+    result["process_ms"] = total_ms
+    return result
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Measures request_job cold start latency with stubbed AWS clients")
+    parser.add_argument("--samples", type=int, default=10, help="Fresh processes to run per request method")
+    parser.add_argument("--client_latency_ms", type=float, default=0, help="Fake delay for creating each boto3 client")
+    parser.add_argument("--secret_latency_ms", type=float, default=0, help="Fake delay for the Secrets Manager call")
+    parser.add_argument("--child", choices=["OPTIONS", "POST"], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.client_latency_ms, args.secret_latency_ms)))
+        return
+
+    report = {}
+    for method in ("OPTIONS", "POST"):
+        results = [sample(method, args) for _ in range(args.samples)]
+        report[method] = {
+            metric: summarize([r[metric] for r in results])
+            for metric in ("import_ms", "first_invoke_ms", "process_ms")
+        }
+        report[method]["statuses"] = sorted({r["status"] for r in results})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,259 @@
+"""
+Load test for the API lambdas.
+
+Replays API Gateway events against request_job and Batch state change events against
+job_status_change, in process, from --concurrency threads at once. Each thread stands in for
+one Lambda execution environment: it loads its own copy of the lambda module, so its first
+invocation is a cold start (module import plus first invoke) and the rest are warm. Pass
+--recycle_every to start a fresh environment every N invocations.
+
+AWS clients are local stand-ins from tests/unit/fakes.py and reCAPTCHA is a local HTTP server.
+Each can be given fake latency and an error rate. Latency is reported separately for cold and
+warm invocations, as p50/p95/p99, along with throughput and counts per status code.
+
+Everything shares one interpreter, so CPU bound work contends for the GIL. Treat warm latency
+under high concurrency as an upper bound, and use benchmarks.cold_start for process startup cost.
+
+Run from sam/backend:
+    python -m benchmarks.load_test --requests 500 --concurrency 16 --fasta_kb 1 64 1024
+    python -m benchmarks.load_test --s3_latency_ms 20 --s3_error_rate 0.01 --recaptcha_latency_ms 100
+"""
+import argparse
+import base64
+import contextlib
+import importlib.util
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from unittest.mock import patch
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED_DIR = os.path.join(BACKEND_DIR, "..", "..", "shared")
+TARGETS = {
+    "request_job": os.path.join(BACKEND_DIR, "request_job", "app.py"),
+    "job_status_change": os.path.join(BACKEND_DIR, "job_status_change", "app.py"),
+}
+BUCKET = "load-test-bucket"
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+SPECIES = ["human", "Ecoli", "yeast"]
+BATCH_STATUSES = ["SUBMITTED", "PENDING", "RUNNABLE", "STARTING", "RUNNING", "SUCCEEDED", "FAILED"]
+
+# The lambdas import their sibling modules and the shared layer by top level name
+for path in (os.path.join(BACKEND_DIR, "request_job"), SHARED_DIR, BACKEND_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from instrumentation import percentile  # noqa: E402
+from tests.unit.conftest import create_multipart  # noqa: E402
+from tests.unit.fakes import FakeBatch, FakeS3, FakeSecretsManager, FaultInjector, StubRecaptchaServer  # noqa: E402
+
+
+def summarize(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "mean_ms": statistics.mean(values),
+        "max_ms": max(values),
+    }
+
+
+def synthetic_fasta(size_bytes: int, rng: random.Random) -> bytes:
+    records = []
+    size = 0
+    i = 0
+    while size < size_bytes:
+        length = rng.randint(50, 1000)
+        record = f">protein_{i}\n" + "".join(rng.choice(AMINO_ACIDS) for _ in range(length)) + "\n"
+        records.append(record)
+        size += len(record)
+        i += 1
+    return "".join(records).encode()
+
+
+def make_request_job_event(fasta: bytes, use_base64: bool, rng: random.Random) -> dict:
+    '''
+    A form POST as API Gateway delivers it. Tokens are unique so reCAPTCHA's verdict cache never hits.
+    '''
+    body, headers = create_multipart({"token": uuid.uuid4().hex, "species": rng.choice(SPECIES)},
+                                     {"fasta": ("input.fasta", fasta, "application/octet-stream")})
+    return {
+        "httpMethod": "POST",
+        "resource": "/",
+        "path": "/",
+        "isBase64Encoded": use_base64,
+        "headers": headers,
+        "body": base64.b64encode(body).decode() if use_base64 else body,
+        "requestContext": {"identity": {"sourceIp": f"10.0.{rng.randint(0, 255)}.{rng.randint(1, 254)}"}},
+    }
+
+
+def make_status_change_event(rng: random.Random) -> dict:
+    status = rng.choice(BATCH_STATUSES)
+    return {
+        "source": "aws.batch",
+        "detail-type": "Batch Job State Change",
+        "detail": {
+            "jobName": uuid.uuid4().hex,
+            "jobId": str(uuid.uuid4()),
+            "status": status,
+            "statusReason": "Essential container in task exited" if status == "FAILED" else None,
+        },
+    }
+
+
+def make_events(target: str, args) -> list:
+    '''
+    Builds every event up front so generating them isn't part of the measured latency.
+    '''
+    rng = random.Random(args.seed)
+    if target == "job_status_change":
+        return [make_status_change_event(rng) for _ in range(args.requests)]
+
+    fastas = {kb: synthetic_fasta(kb * 1024, rng) for kb in args.fasta_kb}
+    events = []
+    for _ in range(args.requests):
+        kb = rng.choice(args.fasta_kb)
+        use_base64 = rng.random() < args.base64_fraction
+        events.append((f"{kb}KB{' base64' if use_base64 else ''}", make_request_job_event(fastas[kb], use_base64, rng)))
+    return events
+
+
+def load_environment(target: str, env_id: int):
+    '''
+    Imports a private copy of the lambda module, like a new execution environment would.
+    '''
+    spec = importlib.util.spec_from_file_location(f"load_test_{target}_{env_id}", TARGETS[target])
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_target(target: str, args) -> dict:
+    events = make_events(target, args)
+    results = []
+    results_lock = threading.Lock()
+    env_ids = itertools.count()
+    next_event = iter(events)
+    next_event_lock = threading.Lock()
+
+    def worker():
+        module = None
+        invocations = 0
+        while True:
+            with next_event_lock:
+                event = next(next_event, None)
+            if event is None:
+                return
+            label, event = event if isinstance(event, tuple) else ("", event)
+
+            start = time.perf_counter()
+            cold = module is None or (args.recycle_every and invocations >= args.recycle_every)
+            if cold:
+                module = load_environment(target, next(env_ids))
+                invocations = 0
+            try:
+                ret = module.lambda_handler(event, None)
+                status = str(ret["statusCode"]) if ret else "ok"
+            except Exception as e:
+                status = f"error:{type(e).__name__}"
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            invocations += 1
+
+            with results_lock:
+                results.append({"cold": cold, "label": label, "status": status, "ms": elapsed_ms})
+
+    threads = [threading.Thread(target=worker, name=f"env-{i}") for i in range(args.concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "requests_per_second": len(results) / elapsed,
+        "cold": summarize([r["ms"] for r in results if r["cold"]]),
+        "warm": summarize([r["ms"] for r in results if not r["cold"]]),
+        "statuses": dict(sorted((status, sum(r["status"] == status for r in results))
+                                for status in {r["status"] for r in results})),
+    }
+    labels = sorted({r["label"] for r in results if r["label"]})
+    if labels:
+        report["warm_by_input"] = {
+            label: summarize([r["ms"] for r in results if not r["cold"] and r["label"] == label])
+            for label in labels
+        }
+    return report
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Load tests the API lambdas in process against local stand-ins")
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS),
+                        help="Lambdas to load test")
+    parser.add_argument("--requests", type=int, default=200, help="Invocations per lambda")
+    parser.add_argument("--concurrency", type=int, default=8, help="Simulated execution environments")
+    parser.add_argument("--recycle_every", type=int, default=0,
+                        help="Replace an environment with a cold one after this many invocations, 0 for never")
+    parser.add_argument("--fasta_kb", type=int, nargs="+", default=[1, 64, 1024], help="FASTA upload sizes to mix")
+    parser.add_argument("--base64_fraction", type=float, default=0.5,
+                        help="Fraction of request_job bodies sent base64 encoded")
+    parser.add_argument("--content_addressed", action="store_true", help="Set CONTENT_ADDRESSED_JOBS=true")
+    parser.add_argument("--s3_latency_ms", type=float, default=0, help="Fake latency for every S3 call")
+    parser.add_argument("--s3_error_rate", type=float, default=0, help="Fraction of S3 calls that fail")
+    parser.add_argument("--batch_latency_ms", type=float, default=0, help="Fake latency for every Batch call")
+    parser.add_argument("--batch_error_rate", type=float, default=0, help="Fraction of Batch calls that fail")
+    parser.add_argument("--secret_latency_ms", type=float, default=0, help="Fake latency for Secrets Manager")
+    parser.add_argument("--recaptcha_latency_ms", type=float, default=0, help="Fake latency for reCAPTCHA")
+    parser.add_argument("--recaptcha_error_rate", type=float, default=0,
+                        help="Fraction of reCAPTCHA requests answered with a 503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=str, default=None, help="Also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    recaptcha = StubRecaptchaServer(latency_seconds=args.recaptcha_latency_ms / 1000,
+                                    error_rate=args.recaptcha_error_rate, seed=args.seed)
+    clients = {
+        "s3": FaultInjector(FakeS3(), args.s3_latency_ms / 1000, args.s3_error_rate, args.seed),
+        "batch": FaultInjector(FakeBatch(), args.batch_latency_ms / 1000, args.batch_error_rate, args.seed),
+        "secretsmanager": FaultInjector(FakeSecretsManager({"RecaptchaKeySecret": "load-test-secret"}),
+                                        args.secret_latency_ms / 1000),
+    }
+
+    def make_client(service_name=None, *a, **kwargs):
+        return clients[service_name]
+
+    os.environ.update(AWS_REGION="us-west-1", INPUT_BUCKET=BUCKET, STATUS_BUCKET=BUCKET,
+                      JOB_DEFINITION="load-test-job-definition", JOB_QUEUE="load-test-job-queue",
+                      RECAPTCHA_URL=recaptcha.url,
+                      CONTENT_ADDRESSED_JOBS="true" if args.content_addressed else "false")
+
+    report = {}
+    try:
+        # The lambdas log every invocation, keep that out of the report
+        with patch("boto3.client", side_effect=make_client), open(os.devnull, "w") as devnull, \
+                contextlib.redirect_stdout(devnull):
+            for target in args.targets:
+                report[target] = run_target(target, args)
+    finally:
+        recaptcha.close()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,191 @@
+"""
+Status queries for many jobs at once, answered from the status index (see shared/status_index.py)
+instead of one status/<id>.json GET per job.
+
+GET /status?ids=<id>,<id>,...&wait=<seconds>
+
+Returns {"jobs": {id: {"status", "statusReason", "updatedAt"}}} with an ETag, where jobs without a
+status yet are null. Jobs that are STARTING or RUNNING also have the "progress" job_runner last
+wrote for them (see batch_container/app/progress.py), or null if it hasn't written any. A request
+whose If-None-Match matches the current ETag gets a 304 with no body.
+
+With wait as well, the request is held until a status changes or wait seconds have passed, so a
+client can wait for a transition with one request rather than polling. Progress is rewritten every
+few seconds while a job runs, so a change to it alone doesn't end the wait early. It's returned
+when the wait ends instead, as a 200 rather than a 304. The ETag has a part for the statuses and a
+part for the progress so that the two can be told apart.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+from instrumentation import JobMetrics
+from batch_jobs import progress_key
+from status_index import read_shard, shard_key
+
+STATUS_BUCKET = os.environ.get("STATUS_BUCKET")
+MAX_IDS = 100
+JOB_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,128}")
+# Comfortably under API Gateway's 29 second integration timeout
+MAX_WAIT_SECONDS = 20
+POLL_INTERVAL_SECONDS = 2
+# A shard or progress record read this recently is reused without asking S3 again
+SHARD_CACHE_SECONDS = 1
+# Suggested wait before retrying when S3 can't be read
+RETRY_AFTER_SECONDS = 1
+# Statuses that job_runner writes progress for
+PROGRESS_STATUSES = ("STARTING", "RUNNING")
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET,OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type,If-None-Match',
+    # Browsers only let scripts read the ETag if it's listed here
+    'Access-Control-Expose-Headers': 'ETag',
+}
+
+s3 = boto3.client('s3')
+# key -> (contents, etag, monotonic time read), for shards and progress records. Kept between warm invocations.
+_objects = {}
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def get_object(key: str) -> dict:
+    '''
+    A JSON object, {} if it doesn't exist. Once cached, re-reads are conditional, so an unchanged object
+    isn't downloaded again.
+    '''
+    cached = _objects.get(key)
+    now = time.monotonic()
+    if cached and now - cached[2] < SHARD_CACHE_SECONDS:
+        return cached[0]
+    contents, etag = read_shard(s3, STATUS_BUCKET, key, cached[1] if cached else None)
+    if contents is None:
+        contents = cached[0]
+    _objects[key] = (contents, etag, now)
+    return contents
+
+
+def lookup(job_ids: list) -> dict:
+    keys = {job_id: shard_key(job_id) for job_id in job_ids}
+    shards = {key: get_object(key) for key in set(keys.values())}
+    jobs = {job_id: shards[key].get(job_id) for job_id, key in keys.items()}
+    for job_id, entry in jobs.items():
+        if entry and entry["status"] in PROGRESS_STATUSES:
+            jobs[job_id] = dict(entry, progress=get_object(progress_key(job_id)) or None)
+    return jobs
+
+
+def parse_ids(event) -> list:
+    params = event.get("multiValueQueryStringParameters") or {}
+    values = params.get("ids") or [(event.get("queryStringParameters") or {}).get("ids") or ""]
+    # Repeated ids are only looked up once, in the order first given
+    job_ids = list(dict.fromkeys(job_id for value in values for job_id in value.split(",") if job_id))
+    if not job_ids:
+        raise BadRequest("Malformed request, missing job ids")
+    if len(job_ids) > MAX_IDS:
+        raise BadRequest(f"At most {MAX_IDS} job ids can be queried at once")
+    for job_id in job_ids:
+        if not JOB_ID_PATTERN.fullmatch(job_id):
+            raise BadRequest("Malformed request, bad job id")
+    return job_ids
+
+
+def parse_wait(event) -> float:
+    wait = (event.get("queryStringParameters") or {}).get("wait") or "0"
+    try:
+        return min(max(float(wait), 0), MAX_WAIT_SECONDS)
+    except ValueError:
+        raise BadRequest("Malformed request, wait must be a number of seconds")
+
+
+def _digest(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:32]
+
+
+def jobs_etag(jobs: dict) -> str:
+    '''
+    "<statuses digest>.<progress digest>" for lookup's result, see the module docstring.
+    '''
+    statuses = {job_id: entry and {k: v for k, v in entry.items() if k != "progress"} for job_id, entry in jobs.items()}
+    progress = {job_id: entry["progress"] for job_id, entry in jobs.items() if entry and "progress" in entry}
+    return f'"{_digest(statuses)}.{_digest(progress)}"'
+
+
+def status_part(etag: str):
+    return etag.strip('"').split(".")[0] if etag else None
+
+
+def response(status_code: int, body: str = "", etag: str = None) -> dict:
+    headers = dict(CORS_HEADERS)
+    if etag:
+        headers["ETag"] = etag
+        # Clients and caches may keep the response, but must check it's current with If-None-Match
+        headers["Cache-Control"] = "no-cache"
+    return {"statusCode": status_code, "headers": headers, "body": body}
+
+
+def lambda_handler(event, context):
+    """
+    Answers GET /status, see the module docstring.
+
+    Parameters
+    ----------
+    event: dict, required
+        API Gateway Lambda Proxy Input Format
+
+        Event doc: https://docs.aws.amazon.com/apigateway/latest/developerguide/set-up-lambda-proxy-integrations.html#api-gateway-simple-proxy-for-lambda-input-format
+
+    context: object, required
+        Lambda Context runtime methods and attributes
+
+        Context doc: https://docs.aws.amazon.com/lambda/latest/dg/python-context-object.html
+    """
+    if event.get("httpMethod") == "OPTIONS":
+        return response(200)
+
+    metrics = JobMetrics("job_status")
+    try:
+        job_ids = parse_ids(event)
+        wait = parse_wait(event)
+    except BadRequest as e:
+        ret = response(400, json.dumps({"msg": str(e)}))
+    else:
+        headers = {name.lower(): value for name, value in (event.get("headers") or {}).items()}
+        if_none_match = headers.get("if-none-match")
+        metrics.put_metric("job_ids", len(job_ids), "Count")
+        deadline = time.monotonic() + wait
+        polls = 0
+        try:
+            while True:
+                polls += 1
+                jobs = lookup(job_ids)
+                etag = jobs_etag(jobs)
+                if status_part(etag) != status_part(if_none_match) or (etag != if_none_match and not wait):
+                    break
+                if time.monotonic() + POLL_INTERVAL_SECONDS > deadline:
+                    break
+                time.sleep(POLL_INTERVAL_SECONDS)
+        except ClientError as e:
+            # e.g. S3 throttling. Answered here so the client still gets the CORS headers it needs to read it.
+            print(f"Status lookup failed: {e!r}")
+            ret = response(503, json.dumps({"msg": "Job statuses are unavailable, try again shortly"}))
+            ret["headers"]["Retry-After"] = str(RETRY_AFTER_SECONDS)
+        else:
+            if etag == if_none_match:
+                ret = response(304, etag=etag)
+            else:
+                ret = response(200, json.dumps({"jobs": jobs}, sort_keys=True), etag)
+        metrics.put_metric("polls", polls, "Count")
+
+    metrics.set_property("status_code", ret["statusCode"])
+    metrics.emit()
+    return ret
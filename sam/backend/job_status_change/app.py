@@ -1,12 +1,56 @@
 import json
 import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from batch_jobs import child_jobs, manifest_key
+from status_index import update_index
 
 STATUS_BUCKET = os.environ.get("STATUS_BUCKET")
 STATUS_PREFIX = "status/"
+# Statuses an array job passes through before its children exist. After that the children report for themselves.
+ARRAY_PARENT_STATUSES = {"SUBMITTED", "PENDING"}
+# Status objects written at once for an array job's inputs
+PUT_THREADS = 16
 s3 = boto3.client('s3')
 
 
+def put_status(job_info: dict):
+    key = f"{STATUS_PREFIX}{job_info['jobName']}.json"
+
+    s3.put_object(
+        Body=json.dumps(job_info).encode(),
+        Bucket=STATUS_BUCKET,
+        Key=key
+    )
+
+
+def array_input_ids(detail: dict) -> list:
+    '''
+    The inputs an array job event is about: a child's slice of the manifest, or all of it for the parent.
+    Returns an empty list for parent events that the children's own events supersede.
+    '''
+    array_properties = detail["arrayProperties"]
+    if "index" not in array_properties and detail.get("status") not in ARRAY_PARENT_STATUSES:
+        return []
+
+    response = s3.get_object(Bucket=STATUS_BUCKET, Key=manifest_key(detail["jobName"]))
+    manifest = json.loads(response["Body"].read())
+    jobs = child_jobs(manifest, array_properties["index"]) if "index" in array_properties else manifest["jobs"]
+    return [job["input_id"] for job in jobs]
+
+
+def event_time(event: dict) -> float:
+    '''
+    When Batch reported the change, so that events that arrive out of order are indexed in the right order.
+    Falls back to now for events without a time.
+    '''
+    if not event.get("time"):
+        return None
+    return datetime.fromisoformat(event["time"].replace("Z", "+00:00")).timestamp()
+
+
 def lambda_handler(event, context):
     """
     Uploads status information to a JSON file in an S3 bucket when a batch job changes state.
@@ -14,6 +58,9 @@ def lambda_handler(event, context):
     The bucket used is specified by the STATUS_BUCKET environment variable.
     The key for the S3 object is status/JOB_NAME.json
     The keys of the JSON object are jobName, status, and statusReason.
+    For array jobs, a status file is written for each input in the job's manifest instead,
+    with jobName set to the input's id.
+    Every status written is also recorded in the status index read by the job_status lambda, see status_index.py.
 
     Parameters
     ----------
@@ -31,14 +78,18 @@ def lambda_handler(event, context):
     detail = event["detail"]
 
     job_info = {k: detail.get(k) for k in ("jobName", "status", "statusReason")}
-    job_info_json = json.dumps(job_info).encode()
 
     print(job_info)
 
-    key = f"{STATUS_PREFIX}{job_info['jobName']}.json"
+    if "arrayProperties" not in detail:
+        statuses = [job_info]
+    else:
+        statuses = [dict(job_info, jobName=input_id) for input_id in array_input_ids(detail)]
 
-    s3.put_object(
-        Body=job_info_json,
-        Bucket=STATUS_BUCKET,
-        Key=key
-    )
+    if len(statuses) > 1:
+        with ThreadPoolExecutor(max_workers=min(PUT_THREADS, len(statuses))) as pool:
+            list(pool.map(put_status, statuses))
+    elif statuses:
+        put_status(statuses[0])
+    if statuses:
+        update_index(s3, STATUS_BUCKET, {status["jobName"]: status for status in statuses}, now=event_time(event))
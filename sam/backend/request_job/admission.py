@@ -0,0 +1,198 @@
+"""
+Admission control for new jobs, so that bursts can't grow the job queues without bound.
+
+Two checks, both made before anything is stored or submitted:
+
+- Each client has a token bucket of `burst` jobs that refills at `jobs_per_hour`. Buckets are
+  kept in the execution environment, so they limit a client per warm lambda instance rather
+  than globally. That is enough to stop one scripted client from filling the queue.
+- The number of jobs waiting or running in the queue a job would go to, counted with Batch's
+  list_jobs, one status at a time and all at once. Counts are cached for a few seconds so that a
+  burst of requests doesn't turn into a burst of list_jobs calls. Once a queue holds max_depth
+  jobs, new ones are turned away until roughly one job's run time has passed.
+
+Accepted jobs get an estimated completion time from the queue depth and how long recent jobs
+on that queue ran, which also comes from list_jobs. Run times change slowly, so they're cached
+for much longer than depths. An array job's children are counted as jobs of their own for both,
+since each runs like a single job would.
+"""
+import math
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Jobs in these states are ahead of a newly submitted job
+ACTIVE_STATUSES = ("SUBMITTED", "PENDING", "RUNNABLE", "STARTING", "RUNNING")
+LIST_JOBS_PAGE_SIZE = 100
+# Finished jobs whose run times the estimates are based on
+RECENT_JOBS = 20
+# Array jobs whose children are listed for those run times, which bounds the list_jobs calls
+MAX_ARRAY_LOOKUPS = 2
+RUN_SECONDS_TTL_SECONDS = 10 * 60
+MAX_TRACKED_CLIENTS = 10000
+
+
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_second: float, now: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """
+        Takes a token if there is one and returns 0. Otherwise returns the seconds until there will be one.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.refill_per_second
+
+
+class ClientLimiter:
+    """
+    A token bucket per client. Only the most recently seen max_clients are tracked,
+    and a client that was dropped starts again with a full bucket.
+    """
+
+    def __init__(self, burst: int, jobs_per_hour: float, max_clients: int = MAX_TRACKED_CLIENTS,
+                 clock=time.monotonic):
+        self.burst = burst
+        self.refill_per_second = jobs_per_hour / 3600
+        self.max_clients = max_clients
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, client: str) -> float:
+        """
+        Counts a job against client. Returns 0 if it's allowed, otherwise the seconds until it would be.
+        """
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.burst, self.refill_per_second, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            self._buckets.move_to_end(client)
+            return bucket.take(now)
+
+
+def _count_status(batch_client, job_queue: str, status: str, limit: int = None) -> int:
+    count = 0
+    kwargs = {"jobQueue": job_queue, "jobStatus": status, "maxResults": LIST_JOBS_PAGE_SIZE}
+    while limit is None or count < limit:
+        response = batch_client.list_jobs(**kwargs)
+        count += sum(job.get("arrayProperties", {}).get("size", 1) for job in response["jobSummaryList"])
+        if not response.get("nextToken"):
+            break
+        kwargs["nextToken"] = response["nextToken"]
+    return count
+
+
+def count_jobs(batch_client, job_queue: str, statuses=ACTIVE_STATUSES, limit: int = None) -> int:
+    """
+    Jobs in job_queue with one of statuses, each status listed concurrently. list_jobs lists an array job once,
+    so its children are counted from its size. With limit, counting a status stops once it's reached, which
+    bounds the calls for a long queue.
+    """
+    with ThreadPoolExecutor(max_workers=len(statuses)) as pool:
+        count = sum(pool.map(lambda status: _count_status(batch_client, job_queue, status, limit), statuses))
+    return count if limit is None else min(count, limit)
+
+
+def _run_seconds(jobs: list) -> list:
+    return [(job["stoppedAt"] - job["startedAt"]) / 1000 for job in jobs if "startedAt" in job and "stoppedAt" in job]
+
+
+def recent_run_seconds(batch_client, job_queue: str, count: int = RECENT_JOBS) -> list:
+    """
+    How long up to count of the most recently finished jobs in job_queue ran for. An array job's own
+    times cover all of its children, so its children are listed and their times used instead, for at most
+    MAX_ARRAY_LOOKUPS array jobs.
+    """
+    response = batch_client.list_jobs(jobQueue=job_queue, jobStatus="SUCCEEDED", maxResults=count)
+    run_seconds = []
+    lookups = 0
+    for job in response["jobSummaryList"]:
+        if len(run_seconds) >= count:
+            break
+        if "arrayProperties" not in job:
+            run_seconds += _run_seconds([job])
+            continue
+        if lookups == MAX_ARRAY_LOOKUPS:
+            continue
+        lookups += 1
+        children = batch_client.list_jobs(arrayJobId=job["jobId"], jobStatus="SUCCEEDED",
+                                          maxResults=count - len(run_seconds))
+        run_seconds += _run_seconds(children["jobSummaryList"])
+    return run_seconds[:count]
+
+
+class QueueMonitor:
+    """
+    Cached depth and typical job run time of Batch job queues.
+    Depths are kept for ttl_seconds and run times for run_ttl_seconds.
+    """
+
+    def __init__(self, batch_client, max_depth: int, ttl_seconds: float,
+                 run_ttl_seconds: float = RUN_SECONDS_TTL_SECONDS, clock=time.monotonic):
+        self.batch_client = batch_client
+        self.max_depth = max_depth
+        self.ttl_seconds = ttl_seconds
+        self.run_ttl_seconds = run_ttl_seconds
+        self.clock = clock
+        # job queue -> {"depth", "fetched_at"}
+        self._queues = {}
+        # job queue -> (median run seconds, fetched at)
+        self._run_seconds = {}
+        self._lock = threading.Lock()
+
+    def _median_run_seconds(self, job_queue: str) -> float:
+        cached = self._run_seconds.get(job_queue)
+        if cached is None or self.clock() - cached[1] >= self.run_ttl_seconds:
+            run_seconds = recent_run_seconds(self.batch_client, job_queue)
+            cached = self._run_seconds[job_queue] = (statistics.median(run_seconds) if run_seconds else None,
+                                                     self.clock())
+        return cached[0]
+
+    def state(self, job_queue: str) -> dict:
+        with self._lock:
+            state = self._queues.get(job_queue)
+            if state is None or self.clock() - state["fetched_at"] >= self.ttl_seconds:
+                state = self._queues[job_queue] = {
+                    # One past the limit is enough to know the queue is full
+                    "depth": count_jobs(self.batch_client, job_queue, limit=self.max_depth + 1),
+                    "fetched_at": self.clock(),
+                }
+            return dict(state, run_seconds=self._median_run_seconds(job_queue))
+
+    def record_submitted(self, job_queue: str):
+        """
+        Counts a job submitted since the depth was fetched, so a burst is seen before the cache expires.
+        """
+        with self._lock:
+            if job_queue in self._queues:
+                self._queues[job_queue]["depth"] += 1
+
+
+def estimate_completion_seconds(depth: int, parallel_jobs: int, queued_run_seconds: float,
+                                run_seconds: float) -> float:
+    """
+    Seconds until a job that runs for run_seconds finishes, behind depth jobs that each take queued_run_seconds,
+    with parallel_jobs running at a time.
+    """
+    return (depth // parallel_jobs) * queued_run_seconds + run_seconds
+
+
+def retry_after_seconds(depth: int, max_depth: int, parallel_jobs: int, queued_run_seconds: float) -> int:
+    """
+    Roughly when a full queue will have room again: after enough jobs have finished to bring it under max_depth.
+    """
+    waves = (depth - max_depth) // parallel_jobs + 1
+    return max(1, math.ceil(waves * queued_run_seconds))
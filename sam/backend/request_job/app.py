@@ -1,11 +1,23 @@
 import json
 import uuid
-import requests
-import os
-import boto3
 import base64
-import cgi
-from requests_toolbelt.multipart import decoder
+import hashlib
+import io
+import os
+import re
+import time
+from botocore.exceptions import ClientError
+
+from admission import ClientLimiter, QueueMonitor, estimate_completion_seconds, retry_after_seconds
+from aws_clients import CachedSecret, LazyClient
+from batch_jobs import INPUT_PREFIX, OUTPUT_PREFIX, load_job_options, prediction_command
+from content_encoding import (IDENTITY, CompressionError, DecompressedTooLarge, compress, object_headers,
+                              open_decompressed)
+from fasta_validation import MAX_HEADER_BYTES, FastaError, FastaValidator
+from form_parser import FormDataError, parse_form_data
+from instrumentation import JobMetrics
+from job_routing import choose_device, estimate_seconds, load_routing
+from recaptcha import RecaptchaError, RecaptchaVerifier
 
 # Score above which to consider captcha passed
 SCORE_THRESH = .5
@@ -15,31 +27,84 @@ print(f"REGION: {REGION}")
 RECAPTCHA_SECRET_NAME = "RecaptchaKeySecret"
 
 INPUT_BUCKET = os.environ.get("INPUT_BUCKET")
-INPUT_PREFIX = "input/"
-OUTPUT_PREFIX = "output/"
+STATUS_PREFIX = "status/"
 print(f"INPUT_BUCKET: {INPUT_BUCKET}")
 
+# If true, job ids are a digest of the request contents so duplicate requests reuse the earlier job
+CONTENT_ADDRESSED_JOBS = os.environ.get("CONTENT_ADDRESSED_JOBS", "false").lower() == "true"
+# Upload size limits in bytes
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", 6 * 2**20))
+MAX_FASTA_BYTES = int(os.environ.get("MAX_FASTA_BYTES", MAX_BODY_BYTES))
+MAX_FIELD_BYTES = 4096
+# gzip and zstd uploads are accepted, up to this size once decompressed
+MAX_DECOMPRESSED_FASTA_BYTES = int(os.environ.get("MAX_DECOMPRESSED_FASTA_BYTES", 64 * 2**20))
+FASTA_CONTENT_TYPE = "text/plain; charset=utf-8"
+# Uploaded FASTA is validated against these before anything is stored, see fasta_validation.py
+MAX_RECORD_RESIDUES = int(os.environ.get("MAX_RECORD_RESIDUES", 10000))
+MAX_TOTAL_RESIDUES = int(os.environ.get("MAX_TOTAL_RESIDUES", 200000))
+# Uploads through a presigned URL skip API Gateway, so S3 is told to refuse anything bigger than a valid FASTA
+# is likely to be: every residue allowed with a line break after it, and a header of the longest allowed for every
+# 10 of them. What's under this is still validated on submit.
+MAX_DIRECT_UPLOAD_BYTES = int(os.environ.get("MAX_DIRECT_UPLOAD_BYTES",
+                                             2 * MAX_TOTAL_RESIDUES + MAX_TOTAL_RESIDUES // 10 * (MAX_HEADER_BYTES + 1)))
+UPLOAD_URL_EXPIRY_SECONDS = 15 * 60
+# Comma separated species that have a model under /models/ in the batch container. When empty, any
+# species that is a plain name is accepted.
+ALLOWED_SPECIES = [species for species in os.environ.get("ALLOWED_SPECIES", "").split(",") if species]
+SPECIES_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+UPLOAD_ROUTE = "/upload"
+SUBMIT_ROUTE = "/submit"
+
+# Must match the default --beam_size in batch_container/app/job_runner.py
+BEAM_SIZE = 100
+# The models' version, e.g. the batch container image tag. It's part of content addressed job ids, so changing it
+# stops outputs of older models being reused. Empty keeps the ids jobs had before it was set.
+MODEL_VERSION = os.environ.get("MODEL_VERSION", "")
+# An input with no status this long after it was stored is taken to have never been submitted
+IN_FLIGHT_GRACE_SECONDS = int(os.environ.get("IN_FLIGHT_GRACE_SECONDS", 5 * 60))
+
 JOB_DEFINITION = os.environ.get("JOB_DEFINITION")
 JOB_QUEUE = os.environ.get("JOB_QUEUE")
 print(f"{JOB_DEFINITION=} {JOB_QUEUE=}")
-
-MODEL_ARG = "--model_path"
-MODEL_PATTERN = "/models/{species}.pt"
-
-secrets_client = boto3.client(
-    service_name="secretsmanager",
-    region_name=REGION
-)
-
-s3_client = boto3.client(
-    service_name="s3",
-    region_name=REGION
-)
-
-batch_client = boto3.client(
-    service_name="batch",
-    region_name=REGION
-)
+# Small jobs go to the CPU queue when these are set, see job_routing.py
+CPU_JOB_DEFINITION = os.environ.get("CPU_JOB_DEFINITION")
+CPU_JOB_QUEUE = os.environ.get("CPU_JOB_QUEUE")
+JOB_ROUTING = load_routing(os.environ.get("JOB_ROUTING"))
+# If set, jobs are sent to this SQS queue and submitted in bursts as array jobs by the submit_batch lambda
+COALESCE_QUEUE_URL = os.environ.get("COALESCE_QUEUE_URL")
+# Options passed to job_runner for every job submitted from here, see shared/batch_jobs.py
+JOB_RUNNER_OPTIONS = load_job_options(os.environ.get("JOB_RUNNER_OPTIONS"))
+
+# Admission control, see admission.py. Each check is off while its setting is 0.
+# Jobs a client can submit at once, and how fast that allowance comes back
+CLIENT_BURST = int(os.environ.get("CLIENT_BURST", 0))
+CLIENT_JOBS_PER_HOUR = float(os.environ.get("CLIENT_JOBS_PER_HOUR", 0))
+# Jobs waiting or running in a queue above which new jobs for it are turned away.
+# Also turns on the estimated completion time in responses.
+MAX_QUEUE_DEPTH = int(os.environ.get("MAX_QUEUE_DEPTH", 0))
+QUEUE_STATE_TTL_SECONDS = float(os.environ.get("QUEUE_STATE_TTL_SECONDS", 15))
+# Recent run times change slowly, so they're fetched much less often than depths
+RUN_TIMES_TTL_SECONDS = float(os.environ.get("RUN_TIMES_TTL_SECONDS", 10 * 60))
+# Jobs each queue's compute environment runs at once, its MaxvCpus over the job definition's vCPUs
+GPU_PARALLEL_JOBS = int(os.environ.get("GPU_PARALLEL_JOBS", 1))
+CPU_PARALLEL_JOBS = int(os.environ.get("CPU_PARALLEL_JOBS", 1))
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'DELETE,GET,HEAD,OPTIONS,PATCH,POST,PUT',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
+}
+
+# Clients are only created when first used, see aws_clients.py
+secrets_client = LazyClient("secretsmanager", REGION)
+s3_client = LazyClient("s3", REGION)
+batch_client = LazyClient("batch", REGION)
+sqs_client = LazyClient("sqs", REGION)
+
+# Module level so that they're kept between warm invocations
+client_limiter = ClientLimiter(CLIENT_BURST, CLIENT_JOBS_PER_HOUR)
+queue_monitor = QueueMonitor(batch_client, MAX_QUEUE_DEPTH, QUEUE_STATE_TTL_SECONDS, RUN_TIMES_TTL_SECONDS)
 
 
 def get_recaptcha_secret() -> str:
@@ -53,8 +118,14 @@ def get_recaptcha_secret() -> str:
     return secret_response["SecretString"]
 
 
-RECAPTCHA_SECRET = get_recaptcha_secret()
-RECAPTCHA_URL = "https://www.google.com/recaptcha/api/siteverify"
+# Fetched on first use and refreshed in the background once it's older than RECAPTCHA_SECRET_REFRESH_SECONDS
+RECAPTCHA_SECRET_TTL_SECONDS = int(os.environ.get("RECAPTCHA_SECRET_TTL_SECONDS", 60 * 60))
+RECAPTCHA_SECRET_REFRESH_SECONDS = RECAPTCHA_SECRET_TTL_SECONDS * 0.8
+recaptcha_secret = CachedSecret(get_recaptcha_secret, RECAPTCHA_SECRET_TTL_SECONDS, RECAPTCHA_SECRET_REFRESH_SECONDS)
+# Overridable so load tests can point at a local stand-in
+RECAPTCHA_URL = os.environ.get("RECAPTCHA_URL", "https://www.google.com/recaptcha/api/siteverify")
+# Module level so the pooled connection and verdict cache survive between warm invocations
+recaptcha_verifier = RecaptchaVerifier(RECAPTCHA_URL)
 
 
 class EarlyExitException(Exception):
@@ -64,56 +135,45 @@ class EarlyExitException(Exception):
     If caught, the top level handler should return to_return.
     '''
 
-    def __init__(self, message: str, status_code: int):
+    def __init__(self, message: str, status_code: int, headers: dict = None):
         self.to_return = {
             "statusCode": status_code,
             "body": json.dumps({
                 "msg": message
             })
         }
+        if headers:
+            self.to_return["headers"] = headers
 
 
 def verify_recaptcha(secret_key: str, token: str, ip: str = None, thresh: float = SCORE_THRESH) -> bool:
     """Verify reCAPTCHA token with Google's reCAPTCHA API."""
-    params = {
-        "secret": secret_key,
-        "response": token
-    }
-    if ip:
-        params["remoteip"] = ip
-
-    response = requests.post(RECAPTCHA_URL, params=params)
-
-    if response.status_code != 200:
-        # TODO(auberon): Retry on 429, others?
-        raise EarlyExitException("Internal error when trying to resolve captcha", 500)
     try:
-        result = response.json()
-    except ValueError:
+        result = recaptcha_verifier.verify(secret_key, token, ip)
+    except RecaptchaError as e:
+        print(repr(e))
         raise EarlyExitException("Internal error when trying to resolve captcha", 500)
 
     return result.get("success", False) and result.get("score", False) >= thresh
 
 
 def decode_form_data(body: str, is_base64: bool, content_type: str) -> dict:
-    if is_base64:
-        body = base64.b64decode(body)
-
-    multipart_data = decoder.MultipartDecoder(body, content_type)
-
+    """
+    Parses the request form. String fields are decoded to str.
+    The fasta file is left as a FormPart, a view into the request body, so that it isn't copied.
+    """
     expected_parts = {"fasta": "file", "token": "string", "species": "string"}
+    optional_parts = {"multi_protein": "string"}
+    part_limits = {"fasta": MAX_FASTA_BYTES, "token": MAX_FIELD_BYTES, "species": MAX_FIELD_BYTES,
+                   "multi_protein": MAX_FIELD_BYTES}
+    try:
+        parts = parse_form_data(body, is_base64, content_type, part_limits, MAX_BODY_BYTES)
+    except FormDataError as e:
+        raise EarlyExitException(str(e), e.status_code)
+
     data = {}
-    for part in multipart_data.parts:
-        content_disposition = part.headers.get(b'Content-Disposition', b'').decode('utf-8')
-        if content_disposition:
-            parsed = cgi.parse_header(content_disposition)
-            # TODO(auberon): More header validation?
-            name = parsed[1]["name"]
-            if name not in expected_parts:
-                raise EarlyExitException(f"Malformed request, go unexpected form part '{name}'", 400)
-            data[name] = part.text if expected_parts[name] == "string" else part.content
-        else:
-            raise EarlyExitException("Malformed request, missing Content-Disposition on form part", 400)
+    for name, part in parts.items():
+        data[name] = part.text if {**expected_parts, **optional_parts}[name] == "string" else part
 
     for expected_part in expected_parts:
         if expected_part not in data:
@@ -122,6 +182,432 @@ def decode_form_data(body: str, is_base64: bool, content_type: str) -> dict:
     return data
 
 
+def check_species(species: str):
+    '''
+    Turns away a species there's no model for, which would otherwise only fail once its job had started.
+    '''
+    if ALLOWED_SPECIES:
+        if species not in ALLOWED_SPECIES:
+            raise EarlyExitException(f"Unknown species, expected one of {', '.join(ALLOWED_SPECIES)}", 400)
+    elif not SPECIES_PATTERN.fullmatch(species):
+        raise EarlyExitException("Malformed request, bad species", 400)
+
+
+def parse_multi_protein(value) -> bool:
+    '''
+    The optional multi_protein field, which asks for every protein in the FASTA to be predicted rather than
+    only the first. Forms send it as "true" or "false", JSON bodies as a boolean.
+    '''
+    if value is None:
+        return False
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    raise EarlyExitException("Malformed request, multi_protein must be true or false", 400)
+
+
+def new_validator() -> FastaValidator:
+    return FastaValidator(MAX_RECORD_RESIDUES, MAX_TOTAL_RESIDUES)
+
+
+class StreamReader(io.RawIOBase):
+    '''
+    Raw reader over anything with read(size), e.g. an S3 object's body, so that it can be buffered and peeked at.
+    '''
+
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_fasta(fasta):
+    '''
+    Reader over the decompressed content of fasta, which may be bytes, an uploaded FormPart or a stream such as
+    an S3 object's body, compressed or not. Raises EarlyExitException as it is read if it can't be decompressed.
+    Returns (reader, encoding).
+    '''
+    if hasattr(fasta, "open"):
+        stream = fasta.open()
+    elif hasattr(fasta, "read"):
+        stream = io.BufferedReader(StreamReader(fasta))
+    else:
+        stream = io.BytesIO(fasta)
+    return open_decompressed(stream, MAX_DECOMPRESSED_FASTA_BYTES)
+
+
+def read_fasta(fasta, consume):
+    '''
+    Calls consume with the decompressed lines of fasta and returns its result.
+    Turns decompression and validation errors into the right client errors.
+    '''
+    try:
+        reader, _ = open_fasta(fasta)
+        return consume(reader)
+    except DecompressedTooLarge:
+        raise EarlyExitException(f"FASTA is larger than {MAX_DECOMPRESSED_FASTA_BYTES} bytes once decompressed", 413)
+    except CompressionError as e:
+        raise EarlyExitException(f"Malformed request, {e}", 400)
+    except FastaError as e:
+        raise EarlyExitException(f"Invalid FASTA, {e}", 400)
+
+
+def validate_fasta(fasta, validator: FastaValidator) -> bytes:
+    '''
+    The canonical form of fasta, which may be bytes or an uploaded FormPart, compressed or not.
+    Raises EarlyExitException for a FASTA that isn't valid.
+    '''
+    return read_fasta(fasta, lambda lines: b"".join(validator.canonical(lines)))
+
+
+def check_fasta(fasta, validator: FastaValidator):
+    '''
+    Like validate_fasta, but only counts fasta in validator rather than keeping its canonical form.
+    '''
+    def consume(lines):
+        for _ in validator.canonical(lines):
+            pass
+    read_fasta(fasta, consume)
+
+
+def canonical_job_id(canonical: bytes, species: str, beam_size: int = BEAM_SIZE, multi_protein: bool = False,
+                     model_version: str = "", options: dict = None) -> str:
+    '''
+    The id of a job for canonical FASTA, which is the same for any request that would give the same output.
+    options are the job_runner options, see load_job_options.
+    '''
+    digest = hashlib.sha256()
+    digest.update(f"{species}\n{beam_size}\n".encode())
+    # Each only added when set, so jobs without them keep the ids they had before they existed
+    if multi_protein:
+        digest.update(b"multi_protein\n")
+    if model_version:
+        digest.update(f"model_version {model_version}\n".encode())
+    if options:
+        digest.update(f"options {json.dumps(options, sort_keys=True)}\n".encode())
+    digest.update(canonical)
+    return digest.hexdigest()
+
+
+def object_exists(key: str) -> bool:
+    try:
+        s3_client.head_object(Bucket=INPUT_BUCKET, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return False
+        raise
+    return True
+
+
+def get_job_status(job_id: str):
+    '''
+    Reads the status written by the job_status_change lambda, or None if there isn't one yet.
+    '''
+    try:
+        resp = s3_client.get_object(Bucket=INPUT_BUCKET, Key=f"{STATUS_PREFIX}{job_id}.json")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return json.loads(resp["Body"].read()).get("status")
+
+
+def input_age_seconds(job_id: str):
+    '''
+    Seconds since the input for job_id was stored, or None if there is no input.
+    '''
+    try:
+        head = s3_client.head_object(Bucket=INPUT_BUCKET, Key=f"{INPUT_PREFIX}{job_id}")
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return time.time() - head["LastModified"].timestamp() if "LastModified" in head else 0
+
+
+def is_existing_job(job_id: str) -> bool:
+    '''
+    True if a job with this id has already finished or is still in flight.
+    A job whose input exists is in flight until its status says it failed. An input that still has no status
+    after IN_FLIGHT_GRACE_SECONDS was never submitted, e.g. because submitting it failed.
+    '''
+    if object_exists(f"{OUTPUT_PREFIX}{job_id}"):
+        return True
+    age = input_age_seconds(job_id)
+    if age is None:
+        return False
+    status = get_job_status(job_id)
+    if status is None:
+        return age < IN_FLIGHT_GRACE_SECONDS
+    return status != "FAILED"
+
+
+def json_response(body: dict, status_code: int = 200) -> dict:
+    return {
+        "statusCode": status_code,
+        "body": json.dumps(body),
+        'headers': CORS_HEADERS
+    }
+
+
+def route_job(sequences: int, residues: int, metrics: JobMetrics) -> bool:
+    '''
+    Decides whether a job runs on the CPU queue. Returns use_cpu.
+    '''
+    if not (CPU_JOB_QUEUE and CPU_JOB_DEFINITION):
+        return False
+    device, estimated_seconds = choose_device(sequences, residues, BEAM_SIZE, JOB_ROUTING)
+    metrics.set_property("device", device)
+    metrics.put_metric("estimated_job_seconds", estimated_seconds, "Seconds")
+    return device == "cpu"
+
+
+def client_id(event) -> str:
+    '''
+    Who a request is from, for per-client limits. API Gateway's source IP, since headers like X-Forwarded-For
+    are set by the client and could be changed on every request.
+    '''
+    identity = (event.get("requestContext") or {}).get("identity") or {}
+    return identity.get("sourceIp") or "unknown"
+
+
+def check_client_limit(event, metrics: JobMetrics):
+    '''
+    Turns the request away with a 429 if its client has used up its allowance of jobs.
+    '''
+    if not (CLIENT_BURST and CLIENT_JOBS_PER_HOUR):
+        return
+    retry_after = client_limiter.check(client_id(event))
+    if retry_after:
+        metrics.set_property("admission", "client_limited")
+        raise EarlyExitException("Too many jobs submitted, try again later", 429,
+                                 {**CORS_HEADERS, "Retry-After": str(max(1, round(retry_after)))})
+
+
+def admit_job(sequences: int, residues: int, use_cpu: bool, metrics: JobMetrics):
+    '''
+    Turns the job away with a 429 if the queue it would go to is full.
+    Otherwise returns the estimated seconds until it completes, or None if queue checks are off.
+    '''
+    if not MAX_QUEUE_DEPTH:
+        return None
+    job_queue = CPU_JOB_QUEUE if use_cpu else JOB_QUEUE
+    parallel_jobs = CPU_PARALLEL_JOBS if use_cpu else GPU_PARALLEL_JOBS
+    run_seconds = estimate_seconds(JOB_ROUTING["cpu" if use_cpu else "gpu"], sequences, residues, BEAM_SIZE)
+
+    with metrics.stage("queue_state"):
+        state = queue_monitor.state(job_queue)
+    metrics.put_metric("queue_depth", state["depth"], "Count")
+    # The jobs ahead are of unknown size, so they're taken to run as long as recent jobs did
+    queued_run_seconds = state["run_seconds"] or run_seconds
+
+    if state["depth"] >= MAX_QUEUE_DEPTH:
+        metrics.set_property("admission", "queue_full")
+        retry_after = retry_after_seconds(state["depth"], MAX_QUEUE_DEPTH, parallel_jobs, queued_run_seconds)
+        raise EarlyExitException("The job queue is full, try again later", 429,
+                                 {**CORS_HEADERS, "Retry-After": str(retry_after)})
+
+    queue_monitor.record_submitted(job_queue)
+    estimated_seconds = estimate_completion_seconds(state["depth"], parallel_jobs, queued_run_seconds, run_seconds)
+    metrics.put_metric("estimated_completion_seconds", estimated_seconds, "Seconds")
+    return estimated_seconds
+
+
+def accepted_response(is_valid: bool, input_id: str, estimated_seconds: float = None) -> dict:
+    body = {"is_valid": is_valid, "id": input_id, "reused": False}
+    if estimated_seconds is not None:
+        body["estimated_seconds"] = round(estimated_seconds)
+        body["estimated_completion"] = time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                                     time.gmtime(time.time() + estimated_seconds))
+    return json_response(body)
+
+
+def submit_prediction_job(input_id: str, species: str, use_cpu: bool = False, multi_protein: bool = False):
+    '''
+    Submits the batch job for an input that is already in INPUT_BUCKET.
+    With COALESCE_QUEUE_URL set, the job is queued to be submitted with others as one array job instead.
+    '''
+    if COALESCE_QUEUE_URL:
+        message = {"input_id": input_id, "species": species, "use_cpu": use_cpu, "multi_protein": multi_protein}
+        sqs_client.send_message(QueueUrl=COALESCE_QUEUE_URL, MessageBody=json.dumps(message))
+        return
+
+    cmd_args = prediction_command(INPUT_BUCKET, input_id, species, use_cpu, multi_protein, JOB_RUNNER_OPTIONS)
+
+    batch_client.submit_job(
+        jobDefinition=CPU_JOB_DEFINITION if use_cpu else JOB_DEFINITION,
+        jobQueue=CPU_JOB_QUEUE if use_cpu else JOB_QUEUE,
+        jobName=input_id,
+        containerOverrides={
+            "command": cmd_args
+        }
+    )
+
+
+def handle_upload_url_request(event, metrics: JobMetrics) -> dict:
+    '''
+    First step of a direct upload. Returns a new job id, and a presigned URL and form fields to POST the FASTA with.
+    The client's allowance of jobs is spent here rather than on submit, so nobody can mint uploads without limit.
+    '''
+    check_client_limit(event, metrics)
+    input_id = uuid.uuid4().hex
+    metrics.set_property("job_id", input_id)
+    # A presigned POST rather than PUT, since only a POST policy can limit the size S3 accepts
+    upload = s3_client.generate_presigned_post(
+        Bucket=INPUT_BUCKET,
+        Key=f"{INPUT_PREFIX}{input_id}",
+        Conditions=[["content-length-range", 1, MAX_DIRECT_UPLOAD_BYTES]],
+        ExpiresIn=UPLOAD_URL_EXPIRY_SECONDS,
+    )
+    return json_response({"id": input_id, "upload_url": upload["url"], "upload_fields": upload["fields"],
+                          "expires_in": UPLOAD_URL_EXPIRY_SECONDS})
+
+
+def parse_json_body(event) -> dict:
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body)
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise EarlyExitException("Malformed request, body must be JSON", 400)
+    if not isinstance(data, dict):
+        raise EarlyExitException("Malformed request, body must be a JSON object", 400)
+    return data
+
+
+def handle_submit_request(event, metrics: JobMetrics) -> dict:
+    '''
+    Second step of a direct upload. Checks the reCAPTCHA token and the uploaded object, then submits the job.
+    The upload is streamed through the same validation as a form upload's, and deleted if it fails, since it
+    could never be submitted. The client limit was already applied when the upload was requested.
+    '''
+    data = parse_json_body(event)
+    for field in ("id", "token", "species"):
+        if not isinstance(data.get(field), str):
+            raise EarlyExitException(f"Malformed request, missing expected field '{field}'", 400)
+
+    input_id = data["id"]
+    # Ids come from handle_upload_url_request. Checking the format stops ids from escaping the input prefix.
+    if len(input_id) != 32 or any(c not in "0123456789abcdef" for c in input_id):
+        raise EarlyExitException("Malformed request, bad job id", 400)
+    metrics.set_property("job_id", input_id)
+    check_species(data["species"])
+    multi_protein = parse_multi_protein(data.get("multi_protein"))
+
+    with metrics.stage("recaptcha"):
+        is_valid = verify_recaptcha(recaptcha_secret.get(), data["token"])
+
+    if get_job_status(input_id) is not None:
+        raise EarlyExitException("Job was already submitted", 409)
+    input_key = f"{INPUT_PREFIX}{input_id}"
+    try:
+        upload = s3_client.get_object(Bucket=INPUT_BUCKET, Key=input_key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            raise EarlyExitException("No upload found for this job id", 400)
+        raise
+    # S3 enforces the limit on the upload itself. This catches uploads made under a larger limit.
+    if upload["ContentLength"] > MAX_DIRECT_UPLOAD_BYTES:
+        s3_client.delete_object(Bucket=INPUT_BUCKET, Key=input_key)
+        raise EarlyExitException(f"Upload is larger than the {MAX_DIRECT_UPLOAD_BYTES} byte limit", 413)
+    metrics.put_metric("input_bytes", upload["ContentLength"], "Bytes")
+    metrics.set_property("multi_protein", multi_protein)
+
+    validator = new_validator()
+    with metrics.stage("fasta_validate"):
+        try:
+            # The upload is kept as it is, so it's only counted. Reading stops at the first problem.
+            check_fasta(upload["Body"], validator)
+        except EarlyExitException:
+            s3_client.delete_object(Bucket=INPUT_BUCKET, Key=input_key)
+            raise
+
+    sequences, residues = validator.stats(multi_protein)
+    use_cpu = route_job(sequences, residues, metrics)
+    # A job turned away here keeps its upload, so the client can submit it again after Retry-After
+    estimated_seconds = admit_job(sequences, residues, use_cpu, metrics)
+
+    with metrics.stage("submit_job"):
+        submit_prediction_job(input_id, data["species"], use_cpu, multi_protein)
+
+    return accepted_response(is_valid, input_id, estimated_seconds)
+
+
+def handle_form_request(event, metrics: JobMetrics) -> dict:
+    '''
+    Single step submission, with the FASTA uploaded as part of a multipart form.
+    '''
+    normalize_event_headers(event)
+    check_client_limit(event, metrics)
+
+    with metrics.stage("multipart_decode"):
+        form_data = decode_form_data(event["body"], event["isBase64Encoded"], event["headers"]["content-type"])
+    metrics.put_metric("input_bytes", len(form_data["fasta"]), "Bytes")
+
+    # Checked before anything slower, so bad input is turned away in milliseconds and only clean input is stored
+    check_species(form_data["species"])
+    multi_protein = parse_multi_protein(form_data.get("multi_protein"))
+    metrics.set_property("multi_protein", multi_protein)
+    validator = new_validator()
+    with metrics.stage("fasta_validate"):
+        canonical = validate_fasta(form_data["fasta"], validator)
+
+    with metrics.stage("recaptcha"):
+        is_valid = verify_recaptcha(recaptcha_secret.get(), form_data["token"])
+
+    if CONTENT_ADDRESSED_JOBS:
+        input_id = canonical_job_id(canonical, form_data["species"], multi_protein=multi_protein,
+                                    model_version=MODEL_VERSION, options=JOB_RUNNER_OPTIONS)
+        if is_existing_job(input_id):
+            print(f"Reusing existing job {input_id}")
+            metrics.set_property("job_id", input_id)
+            metrics.set_property("reused", True)
+            return json_response({"is_valid": is_valid, "id": input_id, "reused": True})
+    else:
+        input_id = uuid.uuid4().hex
+    metrics.set_property("job_id", input_id)
+
+    # Routed and admitted before storing anything, so a job that's turned away leaves nothing behind
+    sequences, residues = validator.stats(multi_protein)
+    use_cpu = route_job(sequences, residues, metrics)
+    estimated_seconds = admit_job(sequences, residues, use_cpu, metrics)
+
+    # The canonical FASTA is stored, compressed again if the upload was. job_runner decompresses it.
+    _, encoding = open_fasta(form_data["fasta"])
+    metrics.set_property("input_encoding", encoding)
+    body = canonical
+    if encoding != IDENTITY:
+        with metrics.stage("compress"):
+            body = compress(canonical, encoding)
+
+    # TODO(auberon): Inspect response?
+    with metrics.stage("s3_put_object"):
+        s3_client.put_object(
+            Body=body,
+            Bucket=INPUT_BUCKET,
+            Key=f"{INPUT_PREFIX}{input_id}",
+            **object_headers(encoding, FASTA_CONTENT_TYPE)
+        )
+
+    with metrics.stage("submit_job"):
+        try:
+            submit_prediction_job(input_id, form_data["species"], use_cpu, multi_protein)
+        except Exception:
+            # Otherwise a content addressed job would look in flight until IN_FLIGHT_GRACE_SECONDS passed
+            s3_client.delete_object(Bucket=INPUT_BUCKET, Key=f"{INPUT_PREFIX}{input_id}")
+            raise
+
+    return accepted_response(is_valid, input_id, estimated_seconds)
+
+
 def normalize_event_headers(event):
     """
     HTTP headers are case-insensitive. This normalizes them all to lower case.
@@ -153,62 +639,35 @@ def lambda_handler(event, context):
 
         Return doc: https://docs.aws.amazon.com/apigateway/latest/developerguide/set-up-lambda-proxy-integrations.html
     """
+    metrics = None
     try:
         if event['httpMethod'] == 'OPTIONS':
             return {
                 'statusCode': 200,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Methods': 'DELETE,GET,HEAD,OPTIONS,PATCH,POST,PUT',
-                    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
-                },
+                'headers': CORS_HEADERS,
                 'body': ''
             }
 
-        normalize_event_headers(event)
-
-        form_data = decode_form_data(event["body"], event["isBase64Encoded"], event["headers"]["content-type"])
-
-        is_valid = verify_recaptcha(RECAPTCHA_SECRET, form_data["token"])
-
-        input_id = uuid.uuid4().hex
-
-        # TODO(auberon): Inspect response?
-        s3_client.put_object(
-            Body=form_data["fasta"],
-            Bucket=INPUT_BUCKET,
-            Key=f"{INPUT_PREFIX}{input_id}"
-        )
-
-        model_path = MODEL_PATTERN.format(species=form_data["species"])
-
-        cmd_args = [INPUT_BUCKET, input_id, INPUT_PREFIX, OUTPUT_PREFIX, MODEL_ARG, model_path]
-
-        batch_client.submit_job(
-            jobDefinition=JOB_DEFINITION,
-            jobQueue=JOB_QUEUE,
-            jobName=input_id,
-            containerOverrides={
-                "command": cmd_args
-            }
-        )
-
-        return {
-            "statusCode": 200,
-            "body": json.dumps({"is_valid": is_valid, "id": input_id}),
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'DELETE,GET,HEAD,OPTIONS,PATCH,POST,PUT',
-                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
-            }
-        }
+        metrics = JobMetrics("request_job")
+        route = event.get("resource") or event.get("path") or ""
+        if route.endswith(UPLOAD_ROUTE):
+            ret = handle_upload_url_request(event, metrics)
+        elif route.endswith(SUBMIT_ROUTE):
+            ret = handle_submit_request(event, metrics)
+        else:
+            ret = handle_form_request(event, metrics)
     except EarlyExitException as e:
-        return e.to_return
+        ret = e.to_return
     except Exception as e:
         print(repr(e))
-        return {
+        ret = {
             "statusCode": 500,
             "body": json.dumps({
                 "msg": "Internal error."
             })
         }
+
+    if metrics is not None:
+        metrics.set_property("status_code", ret["statusCode"])
+        metrics.emit()
+    return ret
@@ -0,0 +1,93 @@
+"""
+Lazily created AWS clients and cached secrets.
+
+Nothing here talks to AWS (or even imports boto3) until it's first used, so requests
+that don't need AWS, like CORS preflights, don't pay for it during a cold start.
+"""
+import threading
+import time
+
+
+class LazyClient:
+    """
+    Stands in for a boto3 client and creates the real client on first use.
+    """
+
+    def __init__(self, service_name: str, region_name: str = None):
+        self._service_name = service_name
+        self._region_name = region_name
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import boto3
+                    self._client = boto3.client(service_name=self._service_name, region_name=self._region_name)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class CachedSecret:
+    """
+    Caches a secret fetched with fetch().
+
+    Once the value is older than refresh_after seconds it is refreshed on a background
+    thread while callers keep using the cached value. Only once it is older than ttl seconds
+    do callers wait for a fresh one. This picks up rotated secrets without a redeploy.
+    """
+
+    def __init__(self, fetch, ttl: float, refresh_after: float):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self._value = None
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def get(self) -> str:
+        age = self._age()
+        if age is None or age >= self.ttl:
+            with self._lock:
+                # Another thread may have fetched while we waited for the lock
+                age = self._age()
+                if age is None or age >= self.ttl:
+                    self._store(self._fetch())
+        elif age >= self.refresh_after:
+            value = self._value
+            self._refresh_in_background()
+            return value
+        return self._value
+
+    def _age(self):
+        if self._fetched_at is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    def _store(self, value: str):
+        self._value = value
+        self._fetched_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                value = self._fetch()
+                with self._lock:
+                    self._store(value)
+            except Exception as e:
+                # Keep serving the cached value. get() fetches synchronously once it expires.
+                print(f"Background secret refresh failed: {e!r}")
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
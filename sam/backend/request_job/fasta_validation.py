@@ -0,0 +1,126 @@
+"""
+Streaming validation of uploaded FASTA, so that input job_runner can't predict is turned away here
+in milliseconds rather than failing on a GPU instance after the container has started and loaded
+the model.
+
+FastaValidator reads a FASTA a line at a time and yields it in canonical form: surrounding
+whitespace and blank lines dropped, and each sequence upper cased onto one line with any trailing
+'*' stop removed. As it goes it checks that
+
+- every sequence line follows a '>' header with a name, which is valid UTF-8 and not too long,
+- every record has a sequence, made only of the 20 standard amino acids,
+- no record, and not all records together, have more residues than the limits,
+- no record looks like DNA, a common mistake when uploading a gene instead of its protein.
+
+The first problem found raises FastaError, with a message that names the line or record at fault.
+"""
+
+AMINO_ACIDS = b"ACDEFGHIKLMNPQRSTVWY"
+NUCLEOTIDES = b"ACGTN"
+# A protein this long made only of nucleotide letters is almost certainly DNA
+MIN_NUCLEOTIDE_LENGTH = 30
+MAX_HEADER_BYTES = 1024
+STOP = b"*"
+
+
+class FastaError(ValueError):
+    pass
+
+
+def _describe(byte: int) -> str:
+    return f"'{chr(byte)}'" if 0x20 < byte < 0x7f else f"byte 0x{byte:02x}"
+
+
+class FastaValidator:
+    """
+    Validates and canonicalizes one FASTA, see the module docstring.
+    Once canonical has been read through, sequences and residues count what it held.
+    """
+
+    def __init__(self, max_record_residues: int, max_total_residues: int):
+        self.max_record_residues = max_record_residues
+        self.max_total_residues = max_total_residues
+        self.sequences = 0
+        self.residues = 0
+        self.first_residues = 0
+        self._record = None
+        self._record_line = 0
+        self._record_residues = 0
+        self._record_nucleotides = True
+        self._stopped = False
+
+    def stats(self, multi_protein: bool = False) -> tuple:
+        """
+        (sequences, residues) that job_runner will predict: every protein with multi_protein, otherwise the first.
+        """
+        if multi_protein:
+            return self.sequences, self.residues
+        return min(self.sequences, 1), self.first_residues
+
+    def canonical(self, lines):
+        """
+        Yields the canonical FASTA in pieces for lines of bytes. Raises FastaError at the first problem.
+        """
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(b">"):
+                yield from self._end_record()
+                self._start_record(line, number)
+                yield line + b"\n"
+            else:
+                yield self._sequence(line, number)
+        yield from self._end_record()
+        if not self.sequences:
+            raise FastaError("no sequences found")
+
+    def _start_record(self, header: bytes, number: int):
+        name = header[1:].strip()
+        if not name:
+            raise FastaError(f"line {number}: header has no name")
+        if len(header) > MAX_HEADER_BYTES:
+            raise FastaError(f"line {number}: header is longer than {MAX_HEADER_BYTES} bytes")
+        try:
+            self._record = name.decode("utf-8")
+        except UnicodeDecodeError:
+            raise FastaError(f"line {number}: header is not valid UTF-8")
+        self._record_line = number
+        self._record_residues = 0
+        self._record_nucleotides = True
+        self._stopped = False
+        self.sequences += 1
+
+    def _sequence(self, line: bytes, number: int) -> bytes:
+        if self._record is None:
+            raise FastaError(f"line {number}: sequence before the first '>' header")
+        if self._stopped:
+            raise FastaError(f"line {number}: sequence continues after a '*' stop in record '{self._record}'")
+        sequence = b"".join(line.upper().split())
+        if sequence.endswith(STOP):
+            sequence = sequence[:-1]
+            self._stopped = True
+        invalid = sequence.translate(None, AMINO_ACIDS)
+        if invalid:
+            raise FastaError(f"line {number}: {_describe(invalid[0])} in record '{self._record}' is not an amino acid")
+
+        self._record_residues += len(sequence)
+        self.residues += len(sequence)
+        if self.sequences == 1:
+            self.first_residues += len(sequence)
+        if self._record_residues > self.max_record_residues:
+            raise FastaError(f"record '{self._record}' is longer than the limit of {self.max_record_residues} residues")
+        if self.residues > self.max_total_residues:
+            raise FastaError(f"the FASTA has more than the limit of {self.max_total_residues} residues in total")
+        self._record_nucleotides = self._record_nucleotides and not sequence.translate(None, NUCLEOTIDES)
+        return sequence
+
+    def _end_record(self):
+        if self._record is None:
+            return
+        if not self._record_residues:
+            raise FastaError(f"record '{self._record}' on line {self._record_line} has no sequence")
+        if self._record_nucleotides and self._record_residues >= MIN_NUCLEOTIDE_LENGTH:
+            raise FastaError(f"record '{self._record}' looks like DNA, protein sequences are expected")
+        self._record = None
+        yield b"\n"
@@ -0,0 +1,167 @@
+"""
+Low-copy multipart/form-data parser for API Gateway request bodies.
+
+The request body is decoded into a single buffer. Parts are memoryview slices of that
+buffer, so uploaded files can be handed to S3 without being copied again.
+"""
+import base64
+import io
+import re
+
+# Must be a multiple of 4 so every chunk is valid base64 on its own
+BASE64_CHUNK_CHARS = 4 * 2**18
+
+_HEADER_PARAM_RE = re.compile(r';\s*([\w-]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^;\s]*))')
+
+
+class FormDataError(Exception):
+    """
+    Raised when a request body can't be parsed or is too large.
+    """
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class MemoryviewReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over a memoryview. Reading copies only what is asked for.
+    """
+
+    def __init__(self, data: memoryview):
+        self._data = data
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._data) - self._pos)
+        b[:n] = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._data) + offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+class FormPart:
+    def __init__(self, headers: dict, data: memoryview):
+        self.headers = headers
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def text(self) -> str:
+        return bytes(self.data).decode("utf-8")
+
+    def open(self) -> io.BufferedReader:
+        """
+        A new file object over the part's content, e.g. to use as an S3 upload body.
+        """
+        return io.BufferedReader(MemoryviewReader(self.data))
+
+
+def parse_header_params(value: str) -> tuple:
+    """
+    Splits a header like 'form-data; name="fasta"; filename="a.fasta"' into ('form-data', {'name': ..., ...}).
+    """
+    main, _, rest = value.partition(";")
+    params = {}
+    for match in _HEADER_PARAM_RE.finditer(";" + rest):
+        key, quoted, plain = match.groups()
+        params[key.lower()] = quoted.replace('\\"', '"') if quoted is not None else plain
+    return main.strip().lower(), params
+
+
+def decode_base64_chunked(body: str, max_bytes: int) -> bytearray:
+    """
+    Decodes base64 a chunk at a time, so the only full size copy is the output buffer.
+    """
+    if len(body) // 4 * 3 > max_bytes:
+        raise FormDataError(f"Request body is larger than the {max_bytes} byte limit", 413)
+    decoded = bytearray()
+    for start in range(0, len(body), BASE64_CHUNK_CHARS):
+        decoded += base64.b64decode(body[start:start + BASE64_CHUNK_CHARS])
+    return decoded
+
+
+def _parse_part_headers(raw: memoryview) -> dict:
+    headers = {}
+    for line in bytes(raw).decode("utf-8", errors="replace").split("\r\n"):
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise FormDataError("Malformed request, bad form part header")
+        headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def parse_form_data(body, is_base64: bool, content_type: str, part_limits: dict, max_body_bytes: int) -> dict:
+    """
+    Parses a multipart/form-data body into a dict of form field name to FormPart.
+
+    part_limits maps each allowed field name to its maximum size in bytes.
+    Unexpected fields are rejected as soon as their headers are read, and oversized fields
+    as soon as their end is found, before anything is copied out of the body.
+    """
+    mime_type, params = parse_header_params(content_type or "")
+    if mime_type != "multipart/form-data" or not params.get("boundary"):
+        raise FormDataError("Malformed request, expected multipart/form-data with a boundary")
+    delimiter = b"--" + params["boundary"].encode()
+
+    if is_base64:
+        buf = decode_base64_chunked(body, max_body_bytes)
+    else:
+        buf = body.encode("utf-8") if isinstance(body, str) else body
+        if len(buf) > max_body_bytes:
+            raise FormDataError(f"Request body is larger than the {max_body_bytes} byte limit", 413)
+    view = memoryview(buf)
+
+    pos = buf.find(delimiter)
+    if pos == -1:
+        raise FormDataError("Malformed request, missing form boundary")
+
+    parts = {}
+    while True:
+        pos += len(delimiter)
+        if buf[pos:pos + 2] == b"--":
+            return parts
+        if buf[pos:pos + 2] != b"\r\n":
+            raise FormDataError("Malformed request, bad form boundary")
+        headers_start = pos + 2
+        headers_end = buf.find(b"\r\n\r\n", headers_start)
+        if headers_end == -1:
+            raise FormDataError("Malformed request, unterminated form part headers")
+        headers = _parse_part_headers(view[headers_start:headers_end])
+
+        disposition, disposition_params = parse_header_params(headers.get("content-disposition", ""))
+        if disposition != "form-data":
+            raise FormDataError("Malformed request, missing Content-Disposition on form part")
+        name = disposition_params.get("name")
+        if name not in part_limits:
+            raise FormDataError(f"Malformed request, go unexpected form part '{name}'")
+
+        data_start = headers_end + 4
+        data_end = buf.find(b"\r\n" + delimiter, data_start)
+        if data_end == -1:
+            raise FormDataError("Malformed request, missing closing form boundary")
+        if data_end - data_start > part_limits[name]:
+            raise FormDataError(f"Form part '{name}' is larger than the {part_limits[name]} byte limit", 413)
+
+        parts[name] = FormPart(headers, view[data_start:data_end])
+        pos = data_end + 2
@@ -0,0 +1,147 @@
+"""
+Chooses between the CPU and GPU job queues from an estimate of how long a job will take.
+
+Prediction time on each device is modelled as
+    seconds = per_job + per_sequence * sequences + per_residue_beam * residues * beam_size
+with coefficients fitted to the metrics job_runner logs for past jobs. A job goes to the CPU
+queue when it would finish there sooner than on a GPU that first has to start an instance,
+as long as that takes no more than cpu_max_seconds.
+
+To calibrate, export job_runner's metrics log lines (one JSON object per line) and run
+    python job_routing.py metrics.jsonl > routing.json
+then set the JOB_ROUTING environment variable to the contents of routing.json.
+"""
+import argparse
+import json
+import sys
+
+# Placeholders until calibrated against real runs
+DEFAULT_ROUTING = {
+    "cpu": {"per_job": 20.0, "per_sequence": 1.0, "per_residue_beam": 2e-3},
+    "gpu": {"per_job": 30.0, "per_sequence": 0.5, "per_residue_beam": 1e-4},
+    # Time for the GPU compute environment to start an instance when it has scaled to zero
+    "gpu_startup_seconds": 300,
+    "cpu_max_seconds": 600,
+}
+COEFFICIENTS = ("per_job", "per_sequence", "per_residue_beam")
+# Stages of a job_runner metrics line that depend on the device
+COMPUTE_STAGES = ("model_init_seconds", "beam_search_seconds", "serialize_seconds")
+# Fewer runs than this leave a device's coefficients as they were
+MIN_CALIBRATION_RUNS = 5
+
+
+def load_routing(config: str = None) -> dict:
+    """
+    Routing settings from a JSON string, falling back to DEFAULT_ROUTING for anything it leaves out.
+    """
+    routing = json.loads(json.dumps(DEFAULT_ROUTING))
+    for key, value in json.loads(config or "{}").items():
+        if isinstance(value, dict):
+            routing[key].update(value)
+        else:
+            routing[key] = value
+    return routing
+
+
+def estimate_seconds(coefficients: dict, sequences: int, residues: int, beam_size: int) -> float:
+    return (coefficients["per_job"] + coefficients["per_sequence"] * sequences
+            + coefficients["per_residue_beam"] * residues * beam_size)
+
+
+def choose_device(sequences: int, residues: int, beam_size: int, routing: dict) -> tuple:
+    """
+    Returns ("cpu" or "gpu", estimated seconds on that device).
+    """
+    cpu_seconds = estimate_seconds(routing["cpu"], sequences, residues, beam_size)
+    gpu_seconds = estimate_seconds(routing["gpu"], sequences, residues, beam_size)
+    if cpu_seconds <= routing["cpu_max_seconds"] and cpu_seconds <= gpu_seconds + routing["gpu_startup_seconds"]:
+        return "cpu", cpu_seconds
+    return "gpu", gpu_seconds
+
+
+def least_squares(rows: list, targets: list) -> list:
+    """
+    Solves the normal equations for rows @ x ~= targets with Gaussian elimination.
+    A tiny ridge term keeps it solvable when the runs don't vary in every feature.
+    """
+    n = len(rows[0])
+    a = [[sum(r[i] * r[j] for r in rows) for j in range(n)] for i in range(n)]
+    b = [sum(r[i] * t for r, t in zip(rows, targets)) for i in range(n)]
+    for i in range(n):
+        a[i][i] += 1e-9 * (a[i][i] or 1)
+
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        b[col], b[pivot] = b[pivot], b[col]
+        for r in range(col + 1, n):
+            factor = a[r][col] / a[col][col]
+            for c in range(col, n):
+                a[r][c] -= factor * a[col][c]
+            b[r] -= factor * b[col]
+
+    x = [0.0] * n
+    for i in reversed(range(n)):
+        x[i] = (b[i] - sum(a[i][j] * x[j] for j in range(i + 1, n))) / a[i][i]
+    return x
+
+
+def parse_metrics_lines(lines) -> list:
+    """
+    job_runner metrics records from log lines. Anything before the JSON on a line, like a
+    timestamp added by the log export, is skipped, as are lines that aren't job_runner metrics.
+    """
+    records = []
+    for line in lines:
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            continue
+        if record.get("service") == "job_runner" and record.get("succeeded") and "predicted_residues" in record:
+            records.append(record)
+    return records
+
+
+def calibrate(records: list, routing: dict) -> dict:
+    """
+    Refits each device's coefficients to its runs in records. Returns new routing settings.
+    """
+    routing = json.loads(json.dumps(routing))
+    for device in ("cpu", "gpu"):
+        runs = [r for r in records if r.get("device") == device]
+        if len(runs) < MIN_CALIBRATION_RUNS:
+            print(f"Only {len(runs)} {device} runs, keeping its coefficients", file=sys.stderr)
+            continue
+        rows = [[1.0, r["predicted_sequences"], r["predicted_residues"] * r["beam_size"]] for r in runs]
+        targets = [sum(r.get(stage, 0) for stage in COMPUTE_STAGES) for r in runs]
+        fitted = least_squares(rows, targets)
+        # A negative cost would just be noise, and would make large jobs look free
+        routing[device] = {name: max(0.0, value) for name, value in zip(COEFFICIENTS, fitted)}
+    return routing
+
+
+def main(argv: list):
+    parser = argparse.ArgumentParser(description="Fits CPU/GPU routing coefficients to job_runner metrics logs")
+    parser.add_argument("metrics", type=str, help="File of job_runner metrics log lines")
+    parser.add_argument("--base", type=str, default=None, help="Routing JSON file to start from")
+    parser.add_argument("--gpu_startup_seconds", type=float, default=None)
+    parser.add_argument("--cpu_max_seconds", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    base = None
+    if args.base:
+        with open(args.base) as f:
+            base = f.read()
+    with open(args.metrics) as f:
+        routing = calibrate(parse_metrics_lines(f), load_routing(base))
+    for key in ("gpu_startup_seconds", "cpu_max_seconds"):
+        if getattr(args, key) is not None:
+            routing[key] = getattr(args, key)
+    print(json.dumps(routing, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
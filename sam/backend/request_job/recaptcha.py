@@ -0,0 +1,131 @@
+"""
+Client for Google's reCAPTCHA verification API.
+
+Keeps a pooled HTTP session so warm invocations reuse the connection, uses strict timeouts,
+retries 429s and 5xxs with jittered backoff, and caches verdicts briefly so a client that
+retries its request doesn't trigger a second verification of the same token.
+"""
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT_SECONDS = 0.5
+READ_TIMEOUT_SECONDS = 1.5
+# Total time budget for all attempts, kept well under the lambda timeout
+DEADLINE_SECONDS = 2.0
+MAX_ATTEMPTS = 3
+BACKOFF_BASE_SECONDS = 0.1
+BACKOFF_MAX_SECONDS = 0.5
+VERDICT_CACHE_SECONDS = 120
+VERDICT_CACHE_SIZE = 1024
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RecaptchaError(Exception):
+    """
+    Raised when a verdict couldn't be obtained from the verification API.
+    """
+
+
+class RecaptchaVerifier:
+    def __init__(self, url: str, connect_timeout: float = CONNECT_TIMEOUT_SECONDS,
+                 read_timeout: float = READ_TIMEOUT_SECONDS, deadline: float = DEADLINE_SECONDS,
+                 max_attempts: int = MAX_ATTEMPTS, backoff_base: float = BACKOFF_BASE_SECONDS,
+                 backoff_max: float = BACKOFF_MAX_SECONDS, cache_seconds: float = VERDICT_CACHE_SECONDS,
+                 cache_size: int = VERDICT_CACHE_SIZE):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cache_seconds = cache_seconds
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+        self.session = requests.Session()
+        # Retries are handled in verify so that they can respect the deadline
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def verify(self, secret_key: str, token: str, ip: str = None) -> dict:
+        """
+        Returns the parsed verification response, e.g. {"success": true, "score": 0.9, ...}.
+        Raises RecaptchaError if no response could be obtained.
+        """
+        cache_key = hashlib.sha256(f"{token}\n{ip}".encode()).hexdigest()
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+        params = {
+            "secret": secret_key,
+            "response": token
+        }
+        if ip:
+            params["remoteip"] = ip
+
+        result = self._post_with_retries(params)
+        self._cache_put(cache_key, result)
+        return result
+
+    def _post_with_retries(self, params: dict) -> dict:
+        start = time.monotonic()
+        for attempt in range(self.max_attempts):
+            retry_after = None
+            try:
+                response = self.session.post(self.url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                print(f"reCAPTCHA request failed: {e!r}")
+            else:
+                if response.status_code == 200:
+                    try:
+                        return response.json()
+                    except ValueError:
+                        raise RecaptchaError("reCAPTCHA response was not JSON")
+                if response.status_code not in RETRY_STATUS_CODES:
+                    raise RecaptchaError(f"reCAPTCHA returned status {response.status_code}")
+                print(f"reCAPTCHA returned status {response.status_code}")
+                retry_after = response.headers.get("Retry-After")
+
+            delay = self._backoff(attempt, retry_after)
+            if attempt + 1 == self.max_attempts or time.monotonic() - start + delay > self.deadline:
+                break
+            time.sleep(delay)
+        raise RecaptchaError("reCAPTCHA unavailable after retries")
+
+    def _backoff(self, attempt: int, retry_after) -> float:
+        try:
+            # Honor the server's Retry-After, as long as it fits in our own backoff cap
+            return min(float(retry_after), self.backoff_max)
+        except (TypeError, ValueError):
+            pass
+        cap = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        # "Equal jitter": at least half the cap, so retries from concurrent lambdas spread out
+        return cap / 2 + random.uniform(0, cap / 2)
+
+    def _cache_get(self, key: str):
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires_at, result = entry
+            if time.monotonic() >= expires_at:
+                del self._cache[key]
+                return None
+            return result
+
+    def _cache_put(self, key: str, result: dict):
+        with self._cache_lock:
+            self._cache[key] = (time.monotonic() + self.cache_seconds, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
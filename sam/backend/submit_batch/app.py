@@ -0,0 +1,124 @@
+import json
+import os
+import uuid
+
+import boto3
+
+from batch_jobs import array_size, build_manifest, load_job_options, manifest_key, prediction_command
+
+INPUT_BUCKET = os.environ.get("INPUT_BUCKET")
+JOB_DEFINITION = os.environ.get("JOB_DEFINITION")
+JOB_QUEUE = os.environ.get("JOB_QUEUE")
+CPU_JOB_DEFINITION = os.environ.get("CPU_JOB_DEFINITION")
+CPU_JOB_QUEUE = os.environ.get("CPU_JOB_QUEUE")
+# More than one lets each array child load its model once for several inputs, at the cost of less parallelism
+INPUTS_PER_CHILD = int(os.environ.get("INPUTS_PER_CHILD", 1))
+# Options passed to job_runner for every job, see shared/batch_jobs.py. Should match request_job's.
+JOB_RUNNER_OPTIONS = load_job_options(os.environ.get("JOB_RUNNER_OPTIONS"))
+
+s3 = boto3.client('s3')
+batch = boto3.client('batch')
+
+
+def job_target(use_cpu: bool) -> dict:
+    '''
+    The job definition and queue for jobs that request_job routed to the CPU or the GPU.
+    '''
+    if use_cpu:
+        return {"jobDefinition": CPU_JOB_DEFINITION, "jobQueue": CPU_JOB_QUEUE}
+    return {"jobDefinition": JOB_DEFINITION, "jobQueue": JOB_QUEUE}
+
+
+def submit_single_job(input_id: str, species: str, use_cpu: bool = False, multi_protein: bool = False):
+    batch.submit_job(
+        **job_target(use_cpu),
+        jobName=input_id,
+        containerOverrides={
+            "command": prediction_command(INPUT_BUCKET, input_id, species, use_cpu, multi_protein, JOB_RUNNER_OPTIONS)
+        }
+    )
+
+
+def submit_array_job(inputs: list, use_cpu: bool = False) -> str:
+    '''
+    Writes a manifest for inputs and submits one array job that runs them all.
+    Returns the array job's name, which is also the manifest's name.
+    '''
+    job_name = f"array-{uuid.uuid4().hex}"
+    manifest = build_manifest(INPUT_BUCKET, inputs, INPUTS_PER_CHILD, JOB_RUNNER_OPTIONS)
+    key = manifest_key(job_name)
+    s3.put_object(Body=json.dumps(manifest).encode(), Bucket=INPUT_BUCKET, Key=key)
+
+    batch.submit_job(
+        **job_target(use_cpu),
+        jobName=job_name,
+        arrayProperties={"size": array_size(manifest)},
+        containerOverrides={
+            "command": ["--manifest", f"s3://{INPUT_BUCKET}/{key}"]
+        }
+    )
+    return job_name
+
+
+def parse_record(record: dict) -> dict:
+    '''
+    The queued job in an SQS record. Raises ValueError if it isn't one request_job would have queued.
+    '''
+    body = json.loads(record["body"])
+    if not isinstance(body, dict) or not all(isinstance(body.get(field), str) for field in ("input_id", "species")):
+        raise ValueError("expected a JSON object with string input_id and species")
+    return body
+
+
+def lambda_handler(event, context):
+    """
+    Submits the jobs queued by request_job as one Batch array job.
+
+    SQS delivers the queued jobs in batches, collected over the event source's batching window,
+    so a burst of requests costs Batch one scheduling decision instead of one per request.
+    A batch of one is submitted as a plain job, since array jobs need at least two children.
+    Jobs routed to the CPU and the GPU go to their own queues, so a burst can become two submissions.
+
+    Parameters
+    ----------
+    event: dict, required
+        SQS event whose records' bodies are {"input_id": ..., "species": ..., "use_cpu": ..., "multi_protein": ...}
+
+        Event doc: https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html
+
+    context: object, required
+        Lambda Context runtime methods and attributes
+
+        Context doc: https://docs.aws.amazon.com/lambda/latest/dg/python-context-object.html
+
+    Returns
+    ------
+    Partial batch response: dict
+        Records that weren't submitted or couldn't be parsed, so SQS delivers them again
+    """
+    groups = {}
+    failures = []
+    for record in event["Records"]:
+        try:
+            body = parse_record(record)
+        except ValueError as e:
+            # Reported as failed, so after a few deliveries SQS moves it to the dead-letter queue
+            print(f"Malformed record {record['messageId']}: {e}")
+            failures.append({"itemIdentifier": record["messageId"]})
+            continue
+        groups.setdefault(body.get("use_cpu", False), []).append((record["messageId"], body))
+
+    for use_cpu, group in groups.items():
+        inputs = [body for _, body in group]
+        print(f"Submitting {len(inputs)} queued {'CPU' if use_cpu else 'GPU'} jobs")
+        try:
+            if len(inputs) == 1:
+                submit_single_job(inputs[0]["input_id"], inputs[0]["species"], use_cpu,
+                                  inputs[0].get("multi_protein", False))
+            else:
+                job_name = submit_array_job(inputs, use_cpu)
+                print(f"Submitted array job {job_name}")
+        except Exception as e:
+            print(f"Submission failed: {e!r}")
+            failures.extend({"itemIdentifier": message_id} for message_id, _ in group)
+    return {"batchItemFailures": failures}
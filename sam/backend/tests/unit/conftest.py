@@ -4,6 +4,9 @@ from unittest.mock import Mock, patch
 
 import pytest
 
+# A valid FASTA, already in the canonical form request_job stores
+MOCK_FASTA = b">mock-protein\nMKTVLAGHWY\n"
+
 
 def mock_boto3_client(config):
     '''
@@ -101,7 +104,7 @@ def api_gateway_event():
         "species": "human"
     }
     files = {
-        "fasta": ("sample.fasta", b"mock-fasta-data", "application/octet-stream")
+        "fasta": ("sample.fasta", MOCK_FASTA, "application/octet-stream")
     }
     body, headers = create_multipart(fields, files)
 
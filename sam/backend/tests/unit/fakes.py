@@ -0,0 +1,199 @@
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from botocore.exceptions import ClientError
+
+
+def not_found(operation: str):
+    return ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, operation)
+
+
+class FakeS3:
+    '''
+    In-memory stand-in for the parts of the boto3 S3 client the lambdas use.
+    Objects are stored as bytes in self.objects, keyed by (bucket, key), and when they were written in self.modified.
+    '''
+
+    def __init__(self):
+        self.objects = {}
+        self.metadata = {}
+        self.modified = {}
+        self.get_requests = 0
+
+    def put_object(self, Body, Bucket, Key, IfMatch=None, IfNoneMatch=None, **kwargs):
+        exists = (Bucket, Key) in self.objects
+        if (IfMatch and (not exists or IfMatch != self._etag(Bucket, Key))) or (IfNoneMatch == "*" and exists):
+            raise ClientError({"Error": {"Code": "PreconditionFailed", "Message": "Precondition Failed"}}, "PutObject")
+        data = Body.read() if hasattr(Body, "read") else Body
+        if isinstance(data, str):
+            data = data.encode()
+        self.objects[(Bucket, Key)] = bytes(data)
+        self.metadata[(Bucket, Key)] = kwargs
+        self.modified[(Bucket, Key)] = datetime.now(timezone.utc)
+        return {"ETag": self._etag(Bucket, Key)}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        self.get_requests += 1
+        if (Bucket, Key) not in self.objects:
+            raise not_found("GetObject")
+        if IfNoneMatch == self._etag(Bucket, Key):
+            raise ClientError({"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject")
+        data = self.objects[(Bucket, Key)]
+        return {"Body": io.BytesIO(data), "ContentLength": len(data), "ETag": self._etag(Bucket, Key),
+                "LastModified": self.modified[(Bucket, Key)], **self.metadata[(Bucket, Key)]}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        if (Bucket, Key) not in self.objects:
+            raise not_found("HeadObject")
+        return {"ContentLength": len(self.objects[(Bucket, Key)]), "ETag": self._etag(Bucket, Key),
+                "LastModified": self.modified[(Bucket, Key)], **self.metadata[(Bucket, Key)]}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop((Bucket, Key), None)
+        self.metadata.pop((Bucket, Key), None)
+        self.modified.pop((Bucket, Key), None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", **kwargs):
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        return {"KeyCount": len(keys), "Contents": [{"Key": key, "Size": len(self.objects[(Bucket, key)])} for key in keys]}
+
+    def generate_presigned_post(self, Bucket, Key, Fields=None, Conditions=None, ExpiresIn=3600):
+        policy = json.dumps({"expires": ExpiresIn, "conditions": Conditions or []})
+        return {"url": f"https://{Bucket}.s3.local/", "fields": {**(Fields or {}), "key": Key, "policy": policy}}
+
+    def upload_to_presigned_post(self, url: str, fields: dict, body: bytes):
+        '''
+        Does what a client would do with a URL and fields from generate_presigned_post, including S3's
+        check of the policy's content-length-range. Returns the HTTP status S3 would answer with.
+        '''
+        for condition in json.loads(fields["policy"])["conditions"]:
+            if isinstance(condition, list) and condition[0] == "content-length-range":
+                if not condition[1] <= len(body) <= condition[2]:
+                    return 400
+        self.put_object(Body=body, Bucket=urlparse(url).hostname.split(".")[0], Key=fields["key"])
+        return 204
+
+    def _etag(self, bucket, key):
+        return '"' + hashlib.md5(self.objects[(bucket, key)]).hexdigest() + '"'
+
+
+class FakeBatch:
+    '''
+    In-memory stand-in for the boto3 Batch client. Submitted jobs are kept in self.jobs.
+    An array job's children are jobs with its jobId as their arrayJobId.
+    '''
+
+    def __init__(self):
+        self.jobs = []
+        self._lock = threading.Lock()
+
+    def submit_job(self, jobName, jobQueue, jobDefinition, **kwargs):
+        job = {"jobId": uuid.uuid4().hex, "jobName": jobName, "jobQueue": jobQueue,
+               "jobDefinition": jobDefinition, "status": "SUBMITTED", **kwargs}
+        with self._lock:
+            self.jobs.append(job)
+        return {"jobId": job["jobId"], "jobName": jobName}
+
+    def list_jobs(self, jobQueue=None, jobStatus=None, maxResults=100, nextToken=None, arrayJobId=None, **kwargs):
+        with self._lock:
+            # Like Batch, a queue's listing has array jobs but not their children
+            jobs = [job for job in self.jobs
+                    if (job.get("arrayJobId") == arrayJobId if arrayJobId else job.get("jobQueue") == jobQueue
+                        and "arrayJobId" not in job)
+                    and jobStatus in (None, job["status"])]
+        start = int(nextToken or 0)
+        response = {"jobSummaryList": jobs[start:start + maxResults]}
+        if start + maxResults < len(jobs):
+            response["nextToken"] = str(start + maxResults)
+        return response
+
+
+class FakeSecretsManager:
+    def __init__(self, secrets: dict):
+        self.secrets = secrets
+
+    def get_secret_value(self, SecretId, **kwargs):
+        return {"SecretString": self.secrets[SecretId]}
+
+
+class FaultInjector:
+    '''
+    Wraps a client so every method call first sleeps latency_seconds and then,
+    with probability error_rate, raises a retryable AWS error instead of calling through.
+    '''
+
+    def __init__(self, client, latency_seconds: float = 0, error_rate: float = 0, seed: int = 0):
+        self._client = client
+        self._latency_seconds = latency_seconds
+        self._error_rate = error_rate
+        self._rng = random.Random(seed)
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if self._latency_seconds:
+                time.sleep(self._latency_seconds)
+            if self._error_rate and self._rng.random() < self._error_rate:
+                raise ClientError({"Error": {"Code": "ServiceUnavailable", "Message": "Injected error"}}, name)
+            return attr(*args, **kwargs)
+        return call
+
+
+class StubRecaptchaServer:
+    '''
+    Local HTTP stand-in for the reCAPTCHA API.
+    Replies with the queued (status, body, headers) responses in order, then keeps repeating the last one.
+    Every reply is delayed by latency_seconds, and with probability error_rate is replaced by a 503.
+    Records the client address of every request so connection reuse can be checked.
+    '''
+
+    def __init__(self, responses=((200, {"success": True, "score": 0.9}, {}),), latency_seconds: float = 0,
+                 error_rate: float = 0, seed: int = 0):
+        self.responses = list(responses)
+        self.client_addresses = []
+        rng = random.Random(seed)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Otherwise the body waits on the client's delayed ACK, adding ~40 ms to every reply
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                stub.client_addresses.append(self.client_address)
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                status, body, headers = stub.responses.pop(0) if len(stub.responses) > 1 else stub.responses[0]
+                if latency_seconds:
+                    time.sleep(latency_seconds)
+                if error_rate and rng.random() < error_rate:
+                    status, body, headers = 503, {}, {}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/siteverify"
+        threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
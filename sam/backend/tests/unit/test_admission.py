@@ -0,0 +1,111 @@
+from unittest.mock import Mock, patch
+
+from request_job.admission import (MAX_ARRAY_LOOKUPS, RUN_SECONDS_TTL_SECONDS, ClientLimiter, QueueMonitor, count_jobs,
+                                   estimate_completion_seconds, recent_run_seconds, retry_after_seconds)
+from tests.unit.fakes import FakeBatch
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def add_jobs(batch, count, status, queue="gpu-queue", **fields):
+    for i in range(count):
+        batch.jobs.append({"jobName": f"{status}{i}", "jobQueue": queue, "status": status, **fields})
+
+
+def test_client_limiter_allows_a_burst_then_refills():
+    clock = FakeClock()
+    limiter = ClientLimiter(burst=2, jobs_per_hour=60, clock=clock)
+
+    assert limiter.check("1.2.3.4") == 0
+    assert limiter.check("1.2.3.4") == 0
+    assert limiter.check("1.2.3.4") == 60
+    # Other clients have their own allowance
+    assert limiter.check("5.6.7.8") == 0
+
+    clock.now = 60
+    assert limiter.check("1.2.3.4") == 0
+    assert limiter.check("1.2.3.4") > 0
+
+
+def test_client_limiter_forgets_least_recent_clients():
+    limiter = ClientLimiter(burst=1, jobs_per_hour=1, max_clients=2, clock=FakeClock())
+    limiter.check("a")
+    limiter.check("b")
+    limiter.check("c")
+
+    # "a" was dropped, so it starts with a full bucket again
+    assert limiter.check("a") == 0
+    assert limiter.check("c") > 0
+
+
+def test_count_jobs_pages_and_counts_array_children():
+    batch = FakeBatch()
+    add_jobs(batch, 150, "RUNNABLE")
+    add_jobs(batch, 1, "PENDING", arrayProperties={"size": 30})
+    add_jobs(batch, 5, "RUNNABLE", queue="cpu-queue")
+    add_jobs(batch, 7, "SUCCEEDED")
+
+    assert count_jobs(batch, "gpu-queue") == 180
+    assert count_jobs(batch, "gpu-queue", limit=10) == 10
+
+
+def test_recent_run_seconds_times_array_children_rather_than_the_array():
+    batch = FakeBatch()
+    add_jobs(batch, 1, "SUCCEEDED", jobId="array", arrayProperties={"size": 3}, startedAt=0, stoppedAt=900_000)
+    add_jobs(batch, 3, "SUCCEEDED", queue=None, arrayJobId="array", arrayProperties={"index": 0},
+             startedAt=1000, stoppedAt=121_000)
+    add_jobs(batch, 1, "FAILED", queue=None, arrayJobId="array", startedAt=0, stoppedAt=5000)
+    add_jobs(batch, 1, "SUCCEEDED", startedAt=1000, stoppedAt=61_000)
+
+    assert recent_run_seconds(batch, "gpu-queue") == [120, 120, 120, 60]
+    assert recent_run_seconds(batch, "gpu-queue", count=2) == [120, 120]
+
+
+def test_recent_run_seconds_lists_children_of_few_arrays():
+    batch = FakeBatch()
+    for array in range(5):
+        add_jobs(batch, 1, "SUCCEEDED", jobId=f"array{array}", arrayProperties={"size": 1})
+        add_jobs(batch, 1, "SUCCEEDED", queue=None, arrayJobId=f"array{array}", startedAt=0, stoppedAt=60_000)
+    add_jobs(batch, 1, "SUCCEEDED", startedAt=0, stoppedAt=30_000)
+    list_jobs = Mock(side_effect=batch.list_jobs)
+
+    with patch.object(batch, "list_jobs", list_jobs):
+        assert recent_run_seconds(batch, "gpu-queue") == [60] * MAX_ARRAY_LOOKUPS + [30]
+    assert list_jobs.call_count == 1 + MAX_ARRAY_LOOKUPS
+
+
+def test_queue_monitor_caches_and_counts_new_submissions():
+    batch = FakeBatch()
+    clock = FakeClock()
+    add_jobs(batch, 3, "RUNNABLE")
+    add_jobs(batch, 3, "SUCCEEDED", startedAt=1000, stoppedAt=61000)
+    monitor = QueueMonitor(batch, max_depth=10, ttl_seconds=15, clock=clock)
+
+    assert monitor.state("gpu-queue")["depth"] == 3
+    assert monitor.state("gpu-queue")["run_seconds"] == 60
+
+    add_jobs(batch, 4, "RUNNABLE")
+    monitor.record_submitted("gpu-queue")
+    assert monitor.state("gpu-queue")["depth"] == 4
+
+    clock.now = 15
+    add_jobs(batch, 3, "SUCCEEDED", startedAt=1000, stoppedAt=121000)
+    assert monitor.state("gpu-queue")["depth"] == 7
+    # Run times are kept for longer
+    assert monitor.state("gpu-queue")["run_seconds"] == 60
+    clock.now = RUN_SECONDS_TTL_SECONDS
+    assert monitor.state("gpu-queue")["run_seconds"] == 90
+
+
+def test_estimates():
+    # Four jobs ahead and two at a time: two rounds of 60 seconds, then this job's own 30
+    assert estimate_completion_seconds(4, 2, 60, 30) == 150
+    assert estimate_completion_seconds(0, 1, 60, 30) == 30
+    assert retry_after_seconds(11, 10, 1, 60) == 120
+    assert retry_after_seconds(10, 10, 4, 0.2) == 1
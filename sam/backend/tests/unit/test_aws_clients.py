@@ -0,0 +1,65 @@
+import time
+from unittest.mock import Mock, patch
+
+from aws_clients import CachedSecret, LazyClient
+from request_job import app
+
+
+@patch('boto3.client')
+def test_lazy_client_is_created_on_first_use_only(mock_client):
+    client = LazyClient("s3", "mock-region")
+    mock_client.assert_not_called()
+
+    client.put_object(Key="a")
+    client.put_object(Key="b")
+
+    mock_client.assert_called_once_with(service_name="s3", region_name="mock-region")
+    assert mock_client.return_value.put_object.call_count == 2
+
+
+def test_cached_secret_fetches_once_within_refresh_window():
+    fetch = Mock(return_value="secret")
+    secret = CachedSecret(fetch, ttl=60, refresh_after=30)
+
+    assert secret.get() == "secret"
+    assert secret.get() == "secret"
+
+    fetch.assert_called_once()
+
+
+def test_cached_secret_refreshes_in_background_then_expires():
+    values = iter(["old", "new", "newest"])
+    fetch = Mock(side_effect=lambda: next(values))
+
+    now = [0]
+    with patch('aws_clients.time.monotonic', side_effect=lambda: now[0]):
+        secret = CachedSecret(fetch, ttl=60, refresh_after=30)
+        assert secret.get() == "old"
+
+        # Stale but not expired: the cached value is returned right away and refreshed behind the scenes
+        now[0] = 40
+        assert secret.get() == "old"
+        deadline = time.time() + 1
+        while secret.get() != "new" and time.time() < deadline:
+            time.sleep(0.01)
+        assert secret.get() == "new"
+        assert fetch.call_count == 2
+
+        # Expired: fetched synchronously
+        now[0] = 200
+        assert secret.get() == "newest"
+
+
+def test_options_request_does_not_set_up_aws():
+    clients = {name: LazyClient(name) for name in ("secretsmanager", "s3", "batch")}
+    fetch = Mock()
+
+    with patch.object(app, 'secrets_client', clients["secretsmanager"]), \
+            patch.object(app, 's3_client', clients["s3"]), \
+            patch.object(app, 'batch_client', clients["batch"]), \
+            patch.object(app, 'recaptcha_secret', CachedSecret(fetch, 60, 30)):
+        ret = app.lambda_handler({"httpMethod": "OPTIONS"}, "")
+
+    assert ret["statusCode"] == 200
+    assert all(client._client is None for client in clients.values())
+    fetch.assert_not_called()
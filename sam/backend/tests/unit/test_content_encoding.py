@@ -0,0 +1,39 @@
+import gzip
+import io
+
+import pytest
+from content_encoding import (CompressionError, DecompressedTooLarge, compress, detect_encoding, object_headers,
+                              open_decompressed)
+
+
+def test_detect_encoding_by_magic_bytes():
+    assert detect_encoding(gzip.compress(b">prot\nMKT\n")) == "gzip"
+    assert detect_encoding(b"\x28\xb5\x2f\xfd\x00") == "zstd"
+    assert detect_encoding(b">prot\nMKT\n") == "identity"
+
+
+@pytest.mark.parametrize("encoding", ["identity", "gzip", "zstd"])
+def test_round_trip(encoding):
+    if encoding == "zstd":
+        pytest.importorskip("zstandard")
+    fasta = b">prot\n" + b"MKTVL" * 1000 + b"\n"
+
+    reader, detected = open_decompressed(io.BytesIO(compress(fasta, encoding)))
+
+    assert detected == encoding
+    assert reader.read() == fasta
+
+
+def test_decompression_limit_and_corrupt_data():
+    reader, _ = open_decompressed(io.BytesIO(gzip.compress(b"M" * 10000)), max_bytes=1000)
+    with pytest.raises(DecompressedTooLarge):
+        reader.read()
+
+    reader, _ = open_decompressed(io.BytesIO(gzip.compress(b"M" * 10000)[:20]))
+    with pytest.raises(CompressionError):
+        reader.read()
+
+
+def test_object_headers():
+    assert object_headers("gzip", "text/plain") == {"ContentType": "text/plain", "ContentEncoding": "gzip"}
+    assert object_headers("identity", "text/plain") == {"ContentType": "text/plain"}
@@ -0,0 +1,41 @@
+import pytest
+
+from fasta_validation import FastaError, FastaValidator
+
+
+def canonical(fasta: bytes, max_record_residues: int = 1000, max_total_residues: int = 10000) -> bytes:
+    return b"".join(FastaValidator(max_record_residues, max_total_residues).canonical(fasta.splitlines()))
+
+
+def test_canonical_form_and_stats():
+    validator = FastaValidator(1000, 10000)
+    fasta = b"\n>prot1 some description\r\nmkt vl\r\nAG*\n\n>prot2\nMKV\n"
+
+    assert b"".join(validator.canonical(fasta.splitlines())) == b">prot1 some description\nMKTVLAG\n>prot2\nMKV\n"
+    assert validator.stats() == (1, 7)
+    assert validator.stats(multi_protein=True) == (2, 10)
+
+
+@pytest.mark.parametrize("fasta, message", [
+    (b"", "no sequences found"),
+    (b"MKT\n>prot1\nMKT\n", "line 1: sequence before the first '>' header"),
+    (b">\nMKT\n", "line 1: header has no name"),
+    (b">prot1\n>prot2\nMKT\n", "record 'prot1' on line 1 has no sequence"),
+    (b">prot1\nMKT\nMKJT\n", "line 3: 'J' in record 'prot1' is not an amino acid"),
+    (b">prot1\nMK-T\n", "line 2: '-' in record 'prot1' is not an amino acid"),
+    (b">prot1\nMK\xe9T\n", "line 2: byte 0xe9 in record 'prot1' is not an amino acid"),
+    (b">prot1\nMKT*\nVL\n", "line 3: sequence continues after a '*' stop in record 'prot1'"),
+    (b">\xff\xfe\nMKT\n", "line 1: header is not valid UTF-8"),
+    (b">gene\n" + b"ATGC" * 10 + b"\n", "record 'gene' looks like DNA, protein sequences are expected"),
+])
+def test_invalid_fasta_is_described(fasta, message):
+    with pytest.raises(FastaError) as e:
+        canonical(fasta)
+    assert str(e.value) == message
+
+
+def test_residue_limits():
+    with pytest.raises(FastaError, match="record 'prot2' is longer than the limit of 5 residues"):
+        canonical(b">prot1\nMKT\n>prot2\nMKT\nVLA\n", max_record_residues=5)
+    with pytest.raises(FastaError, match="more than the limit of 8 residues in total"):
+        canonical(b">prot1\nMKTVL\n>prot2\nMKTVL\n", max_total_residues=8)
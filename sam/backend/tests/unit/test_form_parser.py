@@ -0,0 +1,64 @@
+import base64
+
+import pytest
+from form_parser import FormDataError, parse_form_data
+from tests.unit.conftest import create_multipart
+
+LIMITS = {"fasta": 64, "token": 16, "species": 16}
+
+
+def make_body(fasta=b">prot\nMKT\n", **fields):
+    fields = fields or {"token": "sample_token", "species": "human"}
+    return create_multipart(fields, {"fasta": ("sample.fasta", fasta, "application/octet-stream")})
+
+
+def test_parse_form_data_base64_body():
+    body, headers = make_body()
+    encoded = base64.b64encode(body).decode()
+
+    parts = parse_form_data(encoded, True, headers["Content-Type"], LIMITS, 1024)
+
+    assert parts["token"].text == "sample_token"
+    assert parts["species"].text == "human"
+    assert parts["fasta"].open().read() == b">prot\nMKT\n"
+
+
+def test_parse_form_data_does_not_copy_file_parts():
+    body, headers = make_body()
+
+    fasta = parse_form_data(body, False, headers["Content-Type"], LIMITS, 1024)["fasta"]
+
+    assert fasta.data.obj is body
+
+
+def test_form_part_reader_can_be_reread():
+    body, headers = make_body()
+    reader = parse_form_data(body, False, headers["Content-Type"], LIMITS, 1024)["fasta"].open()
+
+    assert reader.read(5) == b">prot"
+    reader.seek(0)
+    assert reader.read() == b">prot\nMKT\n"
+
+
+def test_parse_form_data_rejects_oversized_part():
+    body, headers = make_body(fasta=b"A" * 65)
+
+    with pytest.raises(FormDataError) as e:
+        parse_form_data(body, False, headers["Content-Type"], LIMITS, 1024)
+    assert e.value.status_code == 413
+
+
+def test_parse_form_data_rejects_oversized_body_before_decoding():
+    body, headers = make_body()
+
+    with pytest.raises(FormDataError) as e:
+        parse_form_data("not base64 but long enough" * 100, True, headers["Content-Type"], LIMITS, 1024)
+    assert e.value.status_code == 413
+
+
+def test_parse_form_data_rejects_unexpected_part():
+    body, headers = make_body(token="sample_token", species="human", extra="surprise")
+
+    with pytest.raises(FormDataError) as e:
+        parse_form_data(body, False, headers["Content-Type"], LIMITS, 1024)
+    assert e.value.status_code == 400
@@ -0,0 +1,77 @@
+import io
+import json
+import sys
+from unittest.mock import Mock, patch
+
+from instrumentation import JobMetrics, hold_peak_gpu_bytes, percentile
+from request_job import app
+
+
+def test_job_metrics_emits_one_emf_line():
+    stream = io.StringIO()
+    metrics = JobMetrics("job_runner", job_id="abc", stream=stream)
+
+    with metrics.stage("s3_get"):
+        pass
+    with metrics.stage("s3_get"):
+        pass
+    metrics.put_metric("input_bytes", 123, "Bytes")
+    metrics.record_sequence_lengths([3, 5])
+    metrics.emit()
+
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 1
+    record = json.loads(lines[0])
+    assert record["service"] == "job_runner"
+    assert record["job_id"] == "abc"
+    assert record["input_bytes"] == 123
+    assert record["total_residues"] == 8
+    assert record["s3_get_seconds"] >= 0
+    assert record["peak_rss_bytes"] > 0
+
+    emf = record["_aws"]["CloudWatchMetrics"][0]
+    assert emf["Dimensions"] == [["service"]]
+    names = {metric["Name"]: metric["Unit"] for metric in emf["Metrics"]}
+    assert names["s3_get_seconds"] == "Seconds"
+    assert names["input_bytes"] == "Bytes"
+    # Properties are not metrics
+    assert "job_id" not in names
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_request_job_emits_stage_timings(recaptcha, api_gateway_event, capsys):
+    app.lambda_handler(api_gateway_event, "")
+
+    record = json.loads(capsys.readouterr().out.strip().splitlines()[-1])
+    assert record["service"] == "request_job"
+    assert record["status_code"] == 200
+    for stage in ("multipart_decode", "recaptcha", "s3_put_object", "submit_job"):
+        assert f"{stage}_seconds" in record
+
+
+def test_percentile_picks_the_nearest_rank():
+    values = [5, 1, 4, 2, 3]
+
+    assert percentile(values, 0) == 1
+    assert percentile(values, 50) == 3
+    assert percentile(values, 95) == 5
+    assert percentile([7], 99) == 7
+
+
+def test_peak_memory_is_per_block():
+    cuda = Mock()
+    cuda.is_available.return_value = True
+    cuda.max_memory_allocated.return_value = 500
+    stream = io.StringIO()
+    metrics = JobMetrics("job_runner", stream=stream)
+
+    with patch.dict(sys.modules, {"torch": Mock(cuda=cuda)}):
+        with metrics.peak_memory():
+            cuda.reset_peak_memory_stats.assert_called_once()
+            # A measurement inside the job resets torch's peak, which mustn't hide the job's own
+            hold_peak_gpu_bytes(800)
+        metrics.emit()
+
+    record = json.loads(stream.getvalue())
+    assert record["peak_gpu_bytes"] == 800
+    assert record["peak_rss_growth_bytes"] >= 0
@@ -0,0 +1,40 @@
+import json
+import random
+
+from job_routing import calibrate, choose_device, load_routing, parse_metrics_lines
+
+
+def test_small_jobs_go_to_cpu_and_large_jobs_to_gpu():
+    routing = load_routing(json.dumps({"cpu_max_seconds": 100}))
+
+    assert choose_device(1, 100, 100, routing)[0] == "cpu"
+    assert choose_device(1, 5000, 100, routing)[0] == "gpu"
+
+
+def test_load_routing_overrides_single_coefficients():
+    routing = load_routing(json.dumps({"cpu": {"per_job": 1.0}, "gpu_startup_seconds": 60}))
+
+    assert routing["cpu"]["per_job"] == 1.0
+    assert routing["cpu"]["per_residue_beam"] == load_routing()["cpu"]["per_residue_beam"]
+    assert routing["gpu_startup_seconds"] == 60
+
+
+def test_calibrate_recovers_coefficients_from_metrics_lines():
+    rng = random.Random(0)
+    lines = []
+    for _ in range(50):
+        sequences, residues, beam = rng.randint(1, 5), rng.randint(50, 2000), rng.choice([10, 100])
+        seconds = 5 + 2 * sequences + 1e-3 * residues * beam
+        record = {"service": "job_runner", "succeeded": True, "device": "cpu", "beam_size": beam,
+                  "predicted_sequences": sequences, "predicted_residues": residues,
+                  "model_init_seconds": 1, "beam_search_seconds": seconds - 1}
+        lines.append("2024-01-01T00:00:00Z " + json.dumps(record))
+    lines.append("not a metrics line")
+
+    routing = calibrate(parse_metrics_lines(lines), load_routing())
+
+    assert abs(routing["cpu"]["per_job"] - 5) < 1e-3
+    assert abs(routing["cpu"]["per_sequence"] - 2) < 1e-3
+    assert abs(routing["cpu"]["per_residue_beam"] - 1e-3) < 1e-6
+    # Too few gpu runs to refit
+    assert routing["gpu"] == load_routing()["gpu"]
@@ -0,0 +1,148 @@
+import json
+import threading
+from unittest.mock import patch
+
+import pytest
+from botocore.exceptions import ClientError
+
+from batch_jobs import progress_key
+from job_status import app
+from status_index import RETENTION_SECONDS, read_shard, shard_key, update_index
+from tests.unit.fakes import FakeS3
+
+
+@pytest.fixture
+def s3():
+    s3 = FakeS3()
+    with patch.object(app, "s3", s3), patch.object(app, "_objects", {}), \
+            patch.object(app, "SHARD_CACHE_SECONDS", 0), patch.object(app, "POLL_INTERVAL_SECONDS", 0.05):
+        yield s3
+
+
+def status_event(ids, wait=None, etag=None):
+    params = {"ids": ",".join(ids)}
+    if wait is not None:
+        params["wait"] = str(wait)
+    return {"httpMethod": "GET", "resource": "/status", "queryStringParameters": params,
+            "headers": {"If-None-Match": etag} if etag else {}}
+
+
+def test_looks_up_many_jobs_in_one_call(s3):
+    update_index(s3, "mock-bucket", {f"job{i}": {"status": "RUNNABLE"} for i in range(50)}, now=1000)
+    s3.get_requests = 0
+
+    ret = app.lambda_handler(status_event([f"job{i}" for i in range(50)] + ["unknown"]), "")
+
+    jobs = json.loads(ret["body"])["jobs"]
+    assert ret["statusCode"] == 200
+    assert jobs["job7"] == {"status": "RUNNABLE", "statusReason": None, "updatedAt": 1000}
+    assert jobs["unknown"] is None
+    # One GET per shard holding the jobs, not one per job
+    assert s3.get_requests <= len({shard_key(f"job{i}") for i in range(50)} | {shard_key("unknown")})
+
+
+def test_unchanged_status_is_a_304(s3):
+    update_index(s3, "mock-bucket", {"job1": {"status": "RUNNABLE"}})
+    first = app.lambda_handler(status_event(["job1"]), "")
+
+    unchanged = app.lambda_handler(status_event(["job1"], etag=first["headers"]["ETag"]), "")
+    update_index(s3, "mock-bucket", {"job1": {"status": "RUNNING"}})
+    changed = app.lambda_handler(status_event(["job1"], etag=first["headers"]["ETag"]), "")
+
+    assert unchanged["statusCode"] == 304
+    assert unchanged["body"] == ""
+    assert changed["statusCode"] == 200
+    assert json.loads(changed["body"])["jobs"]["job1"]["status"] == "RUNNING"
+
+
+def test_long_poll_waits_for_a_transition(s3):
+    update_index(s3, "mock-bucket", {"job1": {"status": "RUNNING"}})
+    etag = app.lambda_handler(status_event(["job1"]), "")["headers"]["ETag"]
+
+    timer = threading.Timer(0.2, update_index, (s3, "mock-bucket", {"job1": {"status": "SUCCEEDED"}}))
+    timer.start()
+    ret = app.lambda_handler(status_event(["job1"], wait=5, etag=etag), "")
+    timer.join()
+
+    assert ret["statusCode"] == 200
+    assert json.loads(ret["body"])["jobs"]["job1"]["status"] == "SUCCEEDED"
+
+
+def test_long_poll_times_out_with_a_304(s3):
+    update_index(s3, "mock-bucket", {"job1": {"status": "RUNNING"}})
+    etag = app.lambda_handler(status_event(["job1"]), "")["headers"]["ETag"]
+
+    ret = app.lambda_handler(status_event(["job1"], wait=0.2, etag=etag), "")
+
+    assert ret["statusCode"] == 304
+
+
+def test_running_jobs_have_progress(s3):
+    update_index(s3, "mock-bucket", {"job1": {"status": "RUNNING"}, "job2": {"status": "RUNNING"},
+                                     "job3": {"status": "SUCCEEDED"}})
+    progress = {"proteinsDone": 3, "proteinsTotal": 10, "stage": "beam_search"}
+    for job_id in ("job1", "job3"):
+        s3.put_object(Body=json.dumps(progress).encode(), Bucket="mock-bucket", Key=progress_key(job_id))
+
+    jobs = json.loads(app.lambda_handler(status_event(["job1", "job2", "job3"]), "")["body"])["jobs"]
+
+    assert jobs["job1"]["progress"] == progress
+    # Not written yet
+    assert jobs["job2"]["progress"] is None
+    # Finished jobs are described by their status alone
+    assert "progress" not in jobs["job3"]
+
+
+def test_progress_change_changes_the_etag(s3):
+    update_index(s3, "mock-bucket", {"job1": {"status": "RUNNING"}})
+    first = app.lambda_handler(status_event(["job1"]), "")
+
+    s3.put_object(Body=json.dumps({"proteinsDone": 1}).encode(), Bucket="mock-bucket", Key=progress_key("job1"))
+    second = app.lambda_handler(status_event(["job1"], etag=first["headers"]["ETag"]), "")
+
+    assert second["statusCode"] == 200
+    assert json.loads(second["body"])["jobs"]["job1"]["progress"] == {"proteinsDone": 1}
+
+
+def test_long_poll_isnt_ended_by_progress_alone(s3):
+    update_index(s3, "mock-bucket", {"job1": {"status": "RUNNING"}})
+    etag = app.lambda_handler(status_event(["job1"]), "")["headers"]["ETag"]
+
+    s3.put_object(Body=json.dumps({"proteinsDone": 1}).encode(), Bucket="mock-bucket", Key=progress_key("job1"))
+    with patch.object(app, "lookup", wraps=app.lookup) as lookup:
+        ret = app.lambda_handler(status_event(["job1"], wait=0.3, etag=etag), "")
+
+    # Held for the whole wait, then answered with the new progress
+    assert lookup.call_count > 1
+    assert ret["statusCode"] == 200
+    assert json.loads(ret["body"])["jobs"]["job1"]["progress"] == {"proteinsDone": 1}
+    assert app.status_part(ret["headers"]["ETag"]) == app.status_part(etag)
+
+
+@pytest.mark.parametrize("ids", [[], ["../etc"], [f"job{i}" for i in range(app.MAX_IDS + 1)]])
+def test_bad_queries_are_rejected(s3, ids):
+    assert app.lambda_handler(status_event(ids), "")["statusCode"] == 400
+
+
+def test_s3_errors_are_a_503_with_cors_headers(s3):
+    def throttled(**kwargs):
+        raise ClientError({"Error": {"Code": "SlowDown", "Message": "Please reduce your request rate."}}, "GetObject")
+
+    with patch.object(s3, "get_object", side_effect=throttled):
+        ret = app.lambda_handler(status_event(["job1"]), "")
+
+    assert ret["statusCode"] == 503
+    assert ret["headers"]["Access-Control-Allow-Origin"] == "*"
+    assert ret["headers"]["Retry-After"] == "1"
+
+
+def test_index_drops_old_entries():
+    s3 = FakeS3()
+    update_index(s3, "mock-bucket", {"old": {"status": "SUCCEEDED"}}, now=0)
+    # Forces both jobs into the same shard
+    with patch("status_index.STATUS_SHARDS", 1):
+        update_index(s3, "mock-bucket", {"old": {"status": "SUCCEEDED"}}, now=0)
+        update_index(s3, "mock-bucket", {"new": {"status": "RUNNING"}}, now=RETENTION_SECONDS)
+        entries, _ = read_shard(s3, "mock-bucket", shard_key("new"))
+
+    assert list(entries) == ["new"]
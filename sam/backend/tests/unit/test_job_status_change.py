@@ -1,6 +1,9 @@
-import boto3
 import json
+from unittest.mock import patch
+from batch_jobs import build_manifest
 from job_status_change.app import lambda_handler
+from status_index import read_shard, shard_key, update_index
+from tests.unit.fakes import FakeS3
 
 
 def test_handler_extracts_details_without_reason():
@@ -11,13 +14,11 @@ def test_handler_extracts_details_without_reason():
         }
     }
 
-    lambda_handler(event, "")
+    s3 = FakeS3()
+    with patch("job_status_change.app.s3", s3):
+        lambda_handler(event, "")
 
-    s3_call = boto3.client('s3').put_object.call_args.kwargs
-    assert s3_call["Bucket"] == 'mock-bucket'
-    assert s3_call["Key"] == ('status/event-test-1.json')
-
-    assert json.loads(s3_call["Body"]) == {
+    assert json.loads(s3.objects[("mock-bucket", "status/event-test-1.json")]) == {
         "jobName": "event-test-1",
         "status": "RUNNABLE",
         "statusReason": None
@@ -33,14 +34,114 @@ def test_handler_extracts_details_with_reason():
         }
     }
 
-    lambda_handler(event, "")
-
-    s3_call = boto3.client('s3').put_object.call_args.kwargs
-    assert s3_call["Bucket"] == 'mock-bucket'
-    assert s3_call["Key"] == ('status/event-test.json')
+    s3 = FakeS3()
+    with patch("job_status_change.app.s3", s3):
+        lambda_handler(event, "")
 
-    assert json.loads(s3_call["Body"]) == {
+    assert json.loads(s3.objects[("mock-bucket", "status/event-test.json")]) == {
         "jobName": "event-test",
         "status": "FAILED",
         "statusReason": "OOM mate :("
     }
+
+
+def test_array_job_events_fan_out_to_each_input():
+    s3 = FakeS3()
+    inputs = [{"input_id": f"id{i}", "species": "human"} for i in range(4)]
+    s3.put_object(Body=json.dumps(build_manifest("mock-bucket", inputs, 2)), Bucket="mock-bucket",
+                  Key="manifests/array-1.json")
+
+    def statuses():
+        return {key: json.loads(s3.objects[("mock-bucket", key)])["status"]
+                for bucket, key in s3.objects if key.startswith("status/")}
+
+    with patch("job_status_change.app.s3", s3):
+        lambda_handler({"detail": {"jobName": "array-1", "status": "SUBMITTED", "arrayProperties": {"size": 2}}}, "")
+        assert statuses() == {f"status/id{i}.json": "SUBMITTED" for i in range(4)}
+
+        lambda_handler({"detail": {"jobName": "array-1", "status": "SUCCEEDED", "arrayProperties": {"index": 1}}}, "")
+        # The parent finishing doesn't overwrite what the children reported
+        lambda_handler({"detail": {"jobName": "array-1", "status": "FAILED", "arrayProperties": {"size": 2}}}, "")
+
+    assert statuses() == {"status/id0.json": "SUBMITTED", "status/id1.json": "SUBMITTED",
+                          "status/id2.json": "SUCCEEDED", "status/id3.json": "SUCCEEDED"}
+    assert json.loads(s3.objects[("mock-bucket", "status/id2.json")])["jobName"] == "id2"
+
+
+def test_statuses_are_recorded_in_the_index():
+    s3 = FakeS3()
+    inputs = [{"input_id": f"id{i}", "species": "human"} for i in range(4)]
+    s3.put_object(Body=json.dumps(build_manifest("mock-bucket", inputs, 2)), Bucket="mock-bucket",
+                  Key="manifests/array-1.json")
+
+    with patch("job_status_change.app.s3", s3):
+        lambda_handler({"detail": {"jobName": "single", "status": "RUNNING"}}, "")
+        lambda_handler({"detail": {"jobName": "array-1", "status": "FAILED", "statusReason": "OOM",
+                                   "arrayProperties": {"index": 0}}}, "")
+
+    def indexed(job_id):
+        entries, _ = read_shard(s3, "mock-bucket", shard_key(job_id))
+        return {k: v for k, v in entries[job_id].items() if k != "updatedAt"}
+
+    assert indexed("single") == {"status": "RUNNING", "statusReason": None}
+    assert indexed("id0") == indexed("id1") == {"status": "FAILED", "statusReason": "OOM"}
+    assert "id2" not in read_shard(s3, "mock-bucket", shard_key("id2"))[0]
+
+
+def test_index_updates_racing_on_a_shard_both_land():
+    s3 = FakeS3()
+    update_index(s3, "mock-bucket", {"first": {"status": "RUNNING"}}, now=0)
+    key = shard_key("first")
+    other = next(job_id for job_id in (f"job{i}" for i in range(1000)) if shard_key(job_id) == key)
+    put_object = s3.put_object
+
+    def put_after_another_writer(**kwargs):
+        # Another lambda writes the shard between this one's read and its write, once
+        s3.put_object = put_object
+        update_index(s3, "mock-bucket", {other: {"status": "SUCCEEDED"}}, now=0)
+        return put_object(**kwargs)
+
+    s3.put_object = put_after_another_writer
+    update_index(s3, "mock-bucket", {"first": {"status": "SUCCEEDED"}}, now=0)
+
+    entries, _ = read_shard(s3, "mock-bucket", key)
+    assert entries["first"]["status"] == entries[other]["status"] == "SUCCEEDED"
+
+
+def test_late_events_dont_replace_newer_statuses():
+    s3 = FakeS3()
+    with patch("job_status_change.app.s3", s3):
+        lambda_handler({"time": "2024-01-01T00:01:00Z", "detail": {"jobName": "single", "status": "SUCCEEDED"}}, "")
+        lambda_handler({"time": "2024-01-01T00:00:00Z", "detail": {"jobName": "single", "status": "RUNNING"}}, "")
+        # Batch event times are to the second, so a job's last events can share one
+        lambda_handler({"time": "2024-01-01T00:01:00Z", "detail": {"jobName": "single", "status": "RUNNING"}}, "")
+
+    entries, _ = read_shard(s3, "mock-bucket", shard_key("single"))
+    assert entries["single"] == {"status": "SUCCEEDED", "statusReason": None, "updatedAt": 1704067260}
+
+
+def test_resubmitting_a_failed_job_replaces_its_status():
+    s3 = FakeS3()
+    update_index(s3, "mock-bucket", {"job1": {"status": "FAILED"}}, now=100)
+    update_index(s3, "mock-bucket", {"job1": {"status": "RUNNABLE"}}, now=200)
+    assert read_shard(s3, "mock-bucket", shard_key("job1"))[0]["job1"]["status"] == "FAILED"
+
+    update_index(s3, "mock-bucket", {"job1": {"status": "SUBMITTED"}}, now=200)
+    update_index(s3, "mock-bucket", {"job1": {"status": "RUNNABLE"}}, now=201)
+    assert read_shard(s3, "mock-bucket", shard_key("job1"))[0]["job1"]["status"] == "RUNNABLE"
+
+
+def test_array_parent_events_update_each_shard_once():
+    s3 = FakeS3()
+    inputs = [{"input_id": f"id{i}", "species": "human"} for i in range(200)]
+    s3.put_object(Body=json.dumps(build_manifest("mock-bucket", inputs, 2)), Bucket="mock-bucket",
+                  Key="manifests/array-1.json")
+    s3.get_requests = 0
+
+    with patch("job_status_change.app.s3", s3):
+        lambda_handler({"detail": {"jobName": "array-1", "status": "SUBMITTED", "arrayProperties": {"size": 100}}}, "")
+
+    # The manifest, then one read per shard
+    assert s3.get_requests == 1 + len({shard_key(f"id{i}") for i in range(200)})
+    assert all(json.loads(s3.objects[("mock-bucket", f"status/id{i}.json")])["status"] == "SUBMITTED"
+               for i in range(200))
@@ -0,0 +1,73 @@
+import pytest
+from recaptcha import RecaptchaError, RecaptchaVerifier
+from tests.unit.fakes import StubRecaptchaServer
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(*responses):
+        server = StubRecaptchaServer(responses)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_verifier_reuses_connection_between_calls(stub_server):
+    server = stub_server((200, {"success": True, "score": 0.9}, {}))
+    verifier = RecaptchaVerifier(server.url)
+
+    assert verifier.verify("secret", "token-1")["success"] is True
+    assert verifier.verify("secret", "token-2")["success"] is True
+
+    assert len(server.client_addresses) == 2
+    assert server.client_addresses[0] == server.client_addresses[1]
+
+
+def test_verifier_retries_429_and_5xx(stub_server):
+    server = stub_server(
+        (429, {}, {"Retry-After": "0"}),
+        (503, {}, {}),
+        (200, {"success": True, "score": 0.9}, {}),
+    )
+    verifier = RecaptchaVerifier(server.url, backoff_base=0.01)
+
+    assert verifier.verify("secret", "token")["score"] == 0.9
+    assert len(server.client_addresses) == 3
+
+
+def test_verifier_gives_up_after_max_attempts(stub_server):
+    server = stub_server((503, {}, {}))
+    verifier = RecaptchaVerifier(server.url, backoff_base=0.01, max_attempts=2)
+
+    with pytest.raises(RecaptchaError):
+        verifier.verify("secret", "token")
+    assert len(server.client_addresses) == 2
+
+
+def test_verifier_does_not_retry_client_errors(stub_server):
+    server = stub_server((400, {}, {}))
+    verifier = RecaptchaVerifier(server.url, backoff_base=0.01)
+
+    with pytest.raises(RecaptchaError):
+        verifier.verify("secret", "token")
+    assert len(server.client_addresses) == 1
+
+
+def test_verifier_times_out_on_slow_server():
+    # A listening socket that never answers
+    import socket
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen()
+    try:
+        verifier = RecaptchaVerifier(f"http://127.0.0.1:{sock.getsockname()[1]}/", read_timeout=0.05,
+                                     max_attempts=2, backoff_base=0.01)
+        with pytest.raises(RecaptchaError):
+            verifier.verify("secret", "token")
+    finally:
+        sock.close()
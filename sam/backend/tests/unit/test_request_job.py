@@ -1,5 +1,14 @@
+import gzip
+import io
+import json
+from datetime import timedelta
+
 import boto3
+import pytest
+from botocore.exceptions import ClientError
 from request_job import app
+from tests.unit.conftest import MOCK_FASTA, create_multipart
+from tests.unit.fakes import FakeBatch, FakeS3
 from unittest.mock import Mock, patch
 
 
@@ -9,7 +18,7 @@ def test_request_job_returns_200_and_stores_input_data_in_s3(recaptcha, api_gate
     assert ret["statusCode"] == 200
 
     s3_call = boto3.client('s3').put_object.call_args.kwargs
-    assert s3_call["Body"] == b'mock-fasta-data'
+    assert s3_call["Body"] == MOCK_FASTA
     assert s3_call["Bucket"] == 'mock-bucket'
     assert s3_call["Key"].startswith('input/')
 
@@ -23,3 +32,396 @@ def test_request_job_returns_200_and_stores_input_data_in_s3(recaptcha, api_gate
     assert batch_call["containerOverrides"] == {
         "command": ["mock-bucket", object_id, "input/", "output/", "--model_path", "/models/human.pt"]
     }
+
+
+def not_found(*args, **kwargs):
+    raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+
+
+def content_job_id(fasta: bytes, species: str) -> str:
+    return app.canonical_job_id(app.validate_fasta(fasta, app.new_validator()), species)
+
+
+def test_job_ids_ignore_whitespace_and_case():
+    messy = b"  >prot1\r\nmkt\r\nvl\r\n\r\n>prot2\nMKV \n"
+    assert app.validate_fasta(messy, app.new_validator()) == b">prot1\nMKTVL\n>prot2\nMKV\n"
+    assert content_job_id(messy, "human") == content_job_id(b">prot1\nMKTVL\n>prot2\nMKV\n", "human")
+    assert content_job_id(messy, "human") != content_job_id(messy, "Ecoli")
+
+
+@patch('request_job.app.CONTENT_ADDRESSED_JOBS', True)
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_request_job_reuses_finished_job(recaptcha, api_gateway_event):
+    s3_client = boto3.client('s3')
+    s3_client.reset_mock()
+    batch_client = boto3.client('batch')
+    batch_client.reset_mock()
+
+    with patch.object(s3_client, 'head_object', return_value={}):
+        ret = app.lambda_handler(api_gateway_event, "")
+
+    body = json.loads(ret["body"])
+    assert ret["statusCode"] == 200
+    assert body["id"] == content_job_id(MOCK_FASTA, "human")
+    assert body["reused"] is True
+    s3_client.put_object.assert_not_called()
+    batch_client.submit_job.assert_not_called()
+
+
+@patch('request_job.app.CONTENT_ADDRESSED_JOBS', True)
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_request_job_submits_new_content_under_digest(recaptcha, api_gateway_event):
+    s3_client = boto3.client('s3')
+
+    with patch.object(s3_client, 'head_object', side_effect=not_found):
+        ret = app.lambda_handler(api_gateway_event, "")
+
+    job_id = content_job_id(MOCK_FASTA, "human")
+    assert json.loads(ret["body"]) == {"is_valid": True, "id": job_id, "reused": False}
+    assert s3_client.put_object.call_args.kwargs["Key"] == f"input/{job_id}"
+    assert boto3.client("batch").submit_job.call_args.kwargs["jobName"] == job_id
+
+
+@patch('request_job.app.CONTENT_ADDRESSED_JOBS', True)
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_request_job_resubmits_failed_job(recaptcha, api_gateway_event):
+    s3_client = boto3.client('s3')
+    batch_client = boto3.client('batch')
+    batch_client.reset_mock()
+
+    def head_object(Bucket, Key):
+        if Key.startswith("output/"):
+            not_found()
+        return {}
+
+    status = {"Body": io.BytesIO(json.dumps({"status": "FAILED"}).encode())}
+    with patch.object(s3_client, 'head_object', side_effect=head_object), \
+            patch.object(s3_client, 'get_object', return_value=status):
+        ret = app.lambda_handler(api_gateway_event, "")
+
+    assert json.loads(ret["body"])["reused"] is False
+    batch_client.submit_job.assert_called_once()
+
+
+@patch('request_job.app.CONTENT_ADDRESSED_JOBS', True)
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_input_that_was_never_submitted_is_resubmitted(recaptcha, api_gateway_event):
+    fake_s3 = FakeS3()
+    batch_client = Mock()
+    job_id = content_job_id(MOCK_FASTA, "human")
+    fake_s3.put_object(Body=MOCK_FASTA, Bucket="mock-bucket", Key=f"input/{job_id}")
+
+    with patch.object(app, "s3_client", fake_s3), patch.object(app, "batch_client", batch_client):
+        # Its status may just not be written yet
+        assert json.loads(app.lambda_handler(api_gateway_event, "")["body"])["reused"] is True
+        fake_s3.modified[("mock-bucket", f"input/{job_id}")] -= timedelta(seconds=app.IN_FLIGHT_GRACE_SECONDS)
+        assert json.loads(app.lambda_handler(api_gateway_event, "")["body"])["reused"] is False
+
+    batch_client.submit_job.assert_called_once()
+
+
+@patch('request_job.app.CONTENT_ADDRESSED_JOBS', True)
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_input_is_removed_when_submitting_fails(recaptcha, api_gateway_event):
+    fake_s3 = FakeS3()
+    batch_client = Mock()
+    batch_client.submit_job.side_effect = ClientError({"Error": {"Code": "ServerException"}}, "SubmitJob")
+
+    with patch.object(app, "s3_client", fake_s3), patch.object(app, "batch_client", batch_client):
+        assert app.lambda_handler(api_gateway_event, "")["statusCode"] == 500
+        assert fake_s3.objects == {}
+        batch_client.submit_job.side_effect = None
+        ret = app.lambda_handler(api_gateway_event, "")
+
+    assert json.loads(ret["body"])["reused"] is False
+    assert ("mock-bucket", f"input/{content_job_id(MOCK_FASTA, 'human')}") in fake_s3.objects
+
+
+def test_job_ids_change_with_the_model_version_and_options():
+    canonical = app.validate_fasta(MOCK_FASTA, app.new_validator())
+    ids = {app.canonical_job_id(canonical, "human"),
+           app.canonical_job_id(canonical, "human", model_version="v2"),
+           app.canonical_job_id(canonical, "human", options={"output_encoding": "gzip"})}
+    assert len(ids) == 3
+    assert app.canonical_job_id(canonical, "human", options={}) == content_job_id(MOCK_FASTA, "human")
+
+
+def direct_upload_events(job_id, token="sample_token", species="human"):
+    submit_event = {
+        "httpMethod": "POST",
+        "resource": "/submit",
+        "isBase64Encoded": False,
+        "headers": {"Content-Type": "application/json"},
+        "body": json.dumps({"id": job_id, "token": token, "species": species}),
+    }
+    return {"httpMethod": "POST", "resource": "/upload", "headers": {}, "body": None}, submit_event
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_direct_upload_submits_job_for_uploaded_fasta(recaptcha):
+    fake_s3 = FakeS3()
+    batch_client = boto3.client('batch')
+    batch_client.reset_mock()
+
+    with patch.object(app, 's3_client', fake_s3):
+        upload_event, _ = direct_upload_events(None)
+        upload = json.loads(app.lambda_handler(upload_event, "")["body"])
+        assert fake_s3.upload_to_presigned_post(upload["upload_url"], upload["upload_fields"], b">prot\nMKT\n") == 204
+
+        _, submit_event = direct_upload_events(upload["id"])
+        ret = app.lambda_handler(submit_event, "")
+
+    assert ret["statusCode"] == 200
+    assert json.loads(ret["body"])["id"] == upload["id"]
+    assert fake_s3.objects[("mock-bucket", f"input/{upload['id']}")] == b">prot\nMKT\n"
+    batch_call = batch_client.submit_job.call_args.kwargs
+    assert batch_call["jobName"] == upload["id"]
+    assert batch_call["containerOverrides"]["command"][-1] == "/models/human.pt"
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_direct_upload_submit_without_upload_is_rejected(recaptcha):
+    batch_client = boto3.client('batch')
+    batch_client.reset_mock()
+
+    with patch.object(app, 's3_client', FakeS3()):
+        _, submit_event = direct_upload_events("0" * 32)
+        ret = app.lambda_handler(submit_event, "")
+
+    assert ret["statusCode"] == 400
+    batch_client.submit_job.assert_not_called()
+
+
+@patch('request_job.app.MAX_DIRECT_UPLOAD_BYTES', 4)
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_direct_upload_over_size_limit_is_rejected_and_deleted(recaptcha):
+    fake_s3 = FakeS3()
+    fake_s3.put_object(Body=b">prot\nMKT\n", Bucket="mock-bucket", Key=f"input/{'0' * 32}")
+
+    with patch.object(app, 's3_client', fake_s3):
+        _, submit_event = direct_upload_events("0" * 32)
+        ret = app.lambda_handler(submit_event, "")
+
+    assert ret["statusCode"] == 413
+    assert fake_s3.objects == {}
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_direct_upload_is_validated_and_deleted_if_invalid(recaptcha):
+    fake_s3 = FakeS3()
+    batch_client = boto3.client('batch')
+    batch_client.reset_mock()
+    fake_s3.put_object(Body=b">gene\n" + b"ATGC" * 20 + b"\n", Bucket="mock-bucket", Key=f"input/{'0' * 32}")
+
+    with patch.object(app, 's3_client', fake_s3):
+        _, submit_event = direct_upload_events("0" * 32)
+        ret = app.lambda_handler(submit_event, "")
+
+    assert ret["statusCode"] == 400
+    assert "looks like DNA" in json.loads(ret["body"])["msg"]
+    assert fake_s3.objects == {}
+    batch_client.submit_job.assert_not_called()
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_direct_upload_is_routed_on_what_it_holds(recaptcha):
+    fake_s3 = FakeS3()
+    fake_s3.put_object(Body=gzip.compress(b">prot1\nMKTVL\n>prot2\nMKTVLAGHWY\n"), Bucket="mock-bucket",
+                       Key=f"input/{'0' * 32}")
+
+    with patch.object(app, 's3_client', fake_s3), patch.object(app, "batch_client", Mock()), \
+            patch.object(app, "route_job", return_value=False) as route_job:
+        _, submit_event = direct_upload_events("0" * 32)
+        submit_event["body"] = json.dumps(dict(json.loads(submit_event["body"]), multi_protein=True))
+        ret = app.lambda_handler(submit_event, "")
+
+    assert ret["statusCode"] == 200
+    assert route_job.call_args.args[:2] == (2, 15)
+
+
+@patch('request_job.app.MAX_DIRECT_UPLOAD_BYTES', 4)
+def test_direct_upload_url_limits_size_and_counts_against_the_client():
+    fake_s3 = FakeS3()
+    limiter = app.ClientLimiter(burst=1, jobs_per_hour=1)
+    upload_event, _ = direct_upload_events(None)
+    upload_event["requestContext"] = {"identity": {"sourceIp": "203.0.113.7"}}
+
+    with patch.object(app, 's3_client', fake_s3), patch.object(app, "CLIENT_BURST", 1), \
+            patch.object(app, "CLIENT_JOBS_PER_HOUR", 1), patch.object(app, "client_limiter", limiter):
+        first = app.lambda_handler(dict(upload_event), "")
+        second = app.lambda_handler(dict(upload_event), "")
+
+    upload = json.loads(first["body"])
+    assert fake_s3.upload_to_presigned_post(upload["upload_url"], upload["upload_fields"], b">prot\nMKT\n") == 400
+    assert fake_s3.objects == {}
+    assert second["statusCode"] == 429
+
+
+def test_direct_upload_rejects_malformed_job_id():
+    _, submit_event = direct_upload_events("../output/someone-elses-job")
+
+    ret = app.lambda_handler(submit_event, "")
+
+    assert ret["statusCode"] == 400
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_request_job_queues_job_for_coalescing_when_configured(recaptcha, api_gateway_event):
+    sqs_client = Mock()
+    batch_client = Mock()
+
+    with patch.object(app, "COALESCE_QUEUE_URL", "https://sqs.mock/queue"), \
+            patch.object(app, "sqs_client", sqs_client), patch.object(app, "batch_client", batch_client):
+        ret = app.lambda_handler(api_gateway_event, "")
+
+    assert ret["statusCode"] == 200
+    batch_client.submit_job.assert_not_called()
+    send_call = sqs_client.send_message.call_args.kwargs
+    assert send_call["QueueUrl"] == "https://sqs.mock/queue"
+    assert json.loads(send_call["MessageBody"]) == {"input_id": json.loads(ret["body"])["id"], "species": "human",
+                                                       "use_cpu": False, "multi_protein": False}
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_small_job_is_routed_to_cpu_queue(recaptcha, api_gateway_event):
+    batch_client = Mock()
+
+    with patch.object(app, "CPU_JOB_QUEUE", "mock-cpu-queue"), \
+            patch.object(app, "CPU_JOB_DEFINITION", "mock-cpu-job-definition"), \
+            patch.object(app, "batch_client", batch_client):
+        ret = app.lambda_handler(api_gateway_event, "")
+
+    assert ret["statusCode"] == 200
+    batch_call = batch_client.submit_job.call_args.kwargs
+    assert batch_call["jobQueue"] == "mock-cpu-queue"
+    assert batch_call["jobDefinition"] == "mock-cpu-job-definition"
+    assert batch_call["containerOverrides"]["command"][-1] == "--use_cpu"
+
+
+@patch('request_job.app.CONTENT_ADDRESSED_JOBS', True)
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_multi_protein_request_predicts_and_routes_on_every_protein(recaptcha):
+    fasta = b">prot1\nMKTVL\n>prot2\nMKTVLAGHWY\n"
+    body, headers = create_multipart({"token": "sample_token", "species": "human", "multi_protein": "true"},
+                                      {"fasta": ("sample.fasta", fasta, "application/octet-stream")})
+    batch_client = Mock()
+
+    with patch.object(app, "s3_client", FakeS3()), patch.object(app, "batch_client", batch_client), \
+            patch.object(app, "route_job", return_value=False) as route_job:
+        ret = app.lambda_handler({"httpMethod": "POST", "isBase64Encoded": False, "headers": headers, "body": body}, "")
+
+    assert ret["statusCode"] == 200
+    assert json.loads(ret["body"])["id"] == app.canonical_job_id(fasta, "human", multi_protein=True)
+    assert json.loads(ret["body"])["id"] != app.canonical_job_id(fasta, "human")
+    assert route_job.call_args.args[:2] == (2, 15)
+    assert batch_client.submit_job.call_args.kwargs["containerOverrides"]["command"][-1] == "--multi_protein"
+
+
+def form_event(fasta: bytes):
+    body, headers = create_multipart({"token": "sample_token", "species": "human"},
+                                      {"fasta": ("sample.fasta.gz", fasta, "application/octet-stream")})
+    return {"httpMethod": "POST", "isBase64Encoded": False, "headers": headers, "body": body}
+
+
+@patch('request_job.app.CONTENT_ADDRESSED_JOBS', True)
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_gzip_upload_is_stored_compressed_under_the_plain_fasta_id(recaptcha):
+    fasta = b">prot1\nMKTVL\n"
+    s3_client = FakeS3()
+
+    with patch.object(app, "s3_client", s3_client), patch.object(app, "batch_client", Mock()):
+        ret = app.lambda_handler(form_event(gzip.compress(fasta)), "")
+
+    job_id = json.loads(ret["body"])["id"]
+    assert job_id == content_job_id(fasta, "human")
+    stored = s3_client.get_object(Bucket="mock-bucket", Key=f"input/{job_id}")
+    assert stored["ContentEncoding"] == "gzip"
+    assert gzip.decompress(stored["Body"].read()) == fasta
+
+
+@patch('request_job.app.CONTENT_ADDRESSED_JOBS', True)
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_bad_compressed_uploads_are_rejected(recaptcha):
+    with patch.object(app, "s3_client", FakeS3()), patch.object(app, "batch_client", Mock()):
+        corrupt = app.lambda_handler(form_event(gzip.compress(b">prot\nMKT\n")[:-6] + b"garbage"), "")
+        with patch.object(app, "MAX_DECOMPRESSED_FASTA_BYTES", 1000):
+            bomb = app.lambda_handler(form_event(gzip.compress(b">prot\n" + b"M" * 100000)), "")
+
+    assert corrupt["statusCode"] == 400
+    assert bomb["statusCode"] == 413
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_client_over_its_allowance_gets_429(recaptcha, api_gateway_event):
+    event = dict(api_gateway_event, requestContext={"identity": {"sourceIp": "203.0.113.7"}})
+    limiter = app.ClientLimiter(burst=1, jobs_per_hour=1)
+
+    with patch.object(app, "CLIENT_BURST", 1), patch.object(app, "CLIENT_JOBS_PER_HOUR", 1), \
+            patch.object(app, "client_limiter", limiter), patch.object(app, "batch_client", Mock()):
+        first = app.lambda_handler(dict(event), "")
+        second = app.lambda_handler(dict(event), "")
+
+    assert first["statusCode"] == 200
+    assert second["statusCode"] == 429
+    assert int(second["headers"]["Retry-After"]) > 3000
+    assert second["headers"]["Access-Control-Allow-Origin"] == "*"
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_full_queue_turns_jobs_away_and_accepted_jobs_get_an_estimate(recaptcha, api_gateway_event):
+    batch_client = FakeBatch()
+    for i in range(2):
+        batch_client.jobs.append({"jobName": f"done{i}", "jobQueue": "mock-job-queue", "status": "SUCCEEDED",
+                                  "startedAt": 0, "stoppedAt": 600_000})
+    s3_client = FakeS3()
+    monitor = app.QueueMonitor(batch_client, max_depth=1, ttl_seconds=60)
+
+    with patch.object(app, "MAX_QUEUE_DEPTH", 1), patch.object(app, "queue_monitor", monitor), \
+            patch.object(app, "batch_client", batch_client), patch.object(app, "s3_client", s3_client):
+        accepted = app.lambda_handler(dict(api_gateway_event), "")
+        rejected = app.lambda_handler(dict(api_gateway_event), "")
+
+    body = json.loads(accepted["body"])
+    assert accepted["statusCode"] == 200
+    # Nothing ahead of it, so only its own estimated run time
+    assert 0 < body["estimated_seconds"] < 600
+    assert body["estimated_completion"].endswith("Z")
+
+    assert rejected["statusCode"] == 429
+    assert rejected["headers"]["Retry-After"] == "600"
+    # The turned away job stored nothing and submitted nothing
+    assert len(s3_client.objects) == 1
+    assert len([job for job in batch_client.jobs if job["status"] == "SUBMITTED"]) == 1
+
+
+@pytest.mark.parametrize("fasta, species, message", [
+    (b">prot1\nMKTJ\n", "human", "Invalid FASTA, line 2: 'J' in record 'prot1' is not an amino acid"),
+    (b"not a fasta", "human", "Invalid FASTA, line 1: sequence before the first '>' header"),
+    (gzip.compress(b">gene\n" + b"ATGC" * 20 + b"\n"), "human",
+     "Invalid FASTA, record 'gene' looks like DNA, protein sequences are expected"),
+    (b">prot1\nMKT\n", "../../etc/passwd", "Malformed request, bad species"),
+])
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_bad_input_is_rejected_before_anything_is_stored(recaptcha, fasta, species, message):
+    body, headers = create_multipart({"token": "sample_token", "species": species},
+                                      {"fasta": ("sample.fasta", fasta, "application/octet-stream")})
+    s3_client, batch_client = FakeS3(), Mock()
+
+    with patch.object(app, "s3_client", s3_client), patch.object(app, "batch_client", batch_client):
+        ret = app.lambda_handler({"httpMethod": "POST", "isBase64Encoded": False, "headers": headers, "body": body}, "")
+
+    assert ret["statusCode"] == 400
+    assert json.loads(ret["body"])["msg"] == message
+    assert not s3_client.objects
+    batch_client.submit_job.assert_not_called()
+    # Turned away before the reCAPTCHA check, the slowest step
+    recaptcha.assert_not_called()
+
+
+@patch('request_job.app.verify_recaptcha', return_value=True)
+def test_species_must_be_allowed_when_configured(recaptcha, api_gateway_event):
+    with patch.object(app, "ALLOWED_SPECIES", ["Ecoli"]), patch.object(app, "batch_client", Mock()):
+        ret = app.lambda_handler(api_gateway_event, "")
+
+    assert ret["statusCode"] == 400
+    assert json.loads(ret["body"])["msg"] == "Unknown species, expected one of Ecoli"
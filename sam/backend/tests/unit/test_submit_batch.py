@@ -0,0 +1,109 @@
+import json
+from unittest.mock import Mock, patch
+
+import pytest
+from batch_jobs import load_job_options
+
+from submit_batch import app
+from tests.unit.fakes import FakeBatch, FakeS3
+
+
+def sqs_event(*inputs):
+    return {"Records": [{"messageId": f"m{i}", "body": json.dumps({"input_id": input_id, "species": species})}
+                        for i, (input_id, species) in enumerate(inputs)]}
+
+
+def test_burst_is_submitted_as_one_array_job():
+    s3, batch = FakeS3(), FakeBatch()
+
+    with patch.object(app, "s3", s3), patch.object(app, "batch", batch):
+        ret = app.lambda_handler(sqs_event(("id0", "human"), ("id1", "Ecoli"), ("id2", "human")), None)
+
+    assert ret == {"batchItemFailures": []}
+    [job] = batch.jobs
+    assert job["arrayProperties"] == {"size": 3}
+    assert job["containerOverrides"]["command"] == ["--manifest", f"s3://mock-bucket/manifests/{job['jobName']}.json"]
+    manifest = json.loads(s3.objects[("mock-bucket", f"manifests/{job['jobName']}.json")])
+    assert sorted(entry["input_id"] for entry in manifest["jobs"]) == ["id0", "id1", "id2"]
+
+
+def test_single_job_is_submitted_without_an_array():
+    batch = FakeBatch()
+
+    with patch.object(app, "batch", batch):
+        app.lambda_handler(sqs_event(("id0", "human")), None)
+
+    [job] = batch.jobs
+    assert job["jobName"] == "id0"
+    assert "arrayProperties" not in job
+    assert job["containerOverrides"]["command"] == ["mock-bucket", "id0", "input/", "output/",
+                                                    "--model_path", "/models/human.pt"]
+
+
+def test_multi_protein_jobs_predict_every_protein():
+    s3, batch = FakeS3(), FakeBatch()
+    event = sqs_event(("id0", "human"), ("id1", "human"))
+    event["Records"][0]["body"] = json.dumps(dict(json.loads(event["Records"][0]["body"]), multi_protein=True))
+
+    with patch.object(app, "s3", s3), patch.object(app, "batch", batch):
+        app.lambda_handler(event, None)
+
+    [job] = batch.jobs
+    manifest = json.loads(s3.objects[("mock-bucket", f"manifests/{job['jobName']}.json")])
+    commands = {entry["input_id"]: entry["command"] for entry in manifest["jobs"]}
+    assert commands["id0"][-1] == "--multi_protein"
+    assert "--multi_protein" not in commands["id1"]
+
+
+def test_job_runner_options_are_passed_to_every_job():
+    batch = FakeBatch()
+
+    with patch.object(app, "batch", batch), \
+            patch.object(app, "JOB_RUNNER_OPTIONS", load_job_options('{"output_encoding": "gzip"}')):
+        app.lambda_handler(sqs_event(("id0", "human")), None)
+
+    [job] = batch.jobs
+    assert job["containerOverrides"]["command"][-2:] == ["--output_encoding", "gzip"]
+    with pytest.raises(ValueError):
+        load_job_options('{"bucket": "someone-elses"}')
+
+
+def test_failed_submission_returns_every_record_for_retry():
+    batch = Mock()
+    batch.submit_job.side_effect = RuntimeError("throttled")
+
+    with patch.object(app, "s3", FakeS3()), patch.object(app, "batch", batch):
+        ret = app.lambda_handler(sqs_event(("id0", "human"), ("id1", "human")), None)
+
+    assert ret == {"batchItemFailures": [{"itemIdentifier": "m0"}, {"itemIdentifier": "m1"}]}
+
+
+@pytest.mark.parametrize("body", ["not json", "[]", json.dumps({"species": "human"})])
+def test_malformed_records_fail_alone(body):
+    s3, batch = FakeS3(), FakeBatch()
+    event = sqs_event(("id0", "human"), ("id1", "human"))
+    event["Records"].insert(1, {"messageId": "bad", "body": body})
+
+    with patch.object(app, "s3", s3), patch.object(app, "batch", batch):
+        ret = app.lambda_handler(event, None)
+
+    assert ret == {"batchItemFailures": [{"itemIdentifier": "bad"}]}
+    [job] = batch.jobs
+    assert job["arrayProperties"] == {"size": 2}
+
+
+def test_cpu_and_gpu_jobs_are_submitted_to_their_own_queues():
+    s3, batch = FakeS3(), FakeBatch()
+    event = sqs_event(("id0", "human"), ("id1", "human"), ("id2", "human"))
+    json_body = json.loads(event["Records"][2]["body"])
+    event["Records"][2]["body"] = json.dumps(dict(json_body, use_cpu=True))
+
+    with patch.object(app, "s3", s3), patch.object(app, "batch", batch), \
+            patch.object(app, "CPU_JOB_QUEUE", "mock-cpu-queue"), \
+            patch.object(app, "CPU_JOB_DEFINITION", "mock-cpu-job-definition"):
+        app.lambda_handler(event, None)
+
+    gpu_job, cpu_job = sorted(batch.jobs, key=lambda job: job["jobQueue"] == "mock-cpu-queue")
+    assert gpu_job["jobQueue"] == "mock-job-queue" and gpu_job["arrayProperties"] == {"size": 2}
+    assert cpu_job["jobName"] == "id2"
+    assert cpu_job["containerOverrides"]["command"][-1] == "--use_cpu"
@@ -1,9 +1,20 @@
 import pytest
 from unittest.mock import Mock, patch
+from recaptcha import RecaptchaVerifier
 from request_job.app import verify_recaptcha, EarlyExitException, RECAPTCHA_URL, SCORE_THRESH
 
 
-@patch('requests.post')
+@pytest.fixture
+def mock_post():
+    '''
+    Patches in a fresh verifier, so verdicts cached by other tests don't leak in, and mocks its session.
+    '''
+    verifier = RecaptchaVerifier(RECAPTCHA_URL, backoff_base=0, backoff_max=0)
+    with patch('request_job.app.recaptcha_verifier', verifier), \
+            patch.object(verifier.session, 'post') as post:
+        yield post
+
+
 def test_verify_recaptcha_success(mock_post):
     # Arrange
     mock_response = Mock()
@@ -25,11 +36,10 @@ def test_verify_recaptcha_success(mock_post):
         "secret": secret_key,
         "response": token,
         "remoteip": ip,
-    })
+    }, timeout=(0.5, 1.5))
     assert result is True
 
 
-@patch('requests.post')
 def test_verify_recaptcha_fail_invalid_score(mock_post):
     # Arrange
     mock_response = Mock()
@@ -49,11 +59,10 @@ def test_verify_recaptcha_fail_invalid_score(mock_post):
     mock_post.assert_called_once_with(RECAPTCHA_URL, params={
         "secret": secret_key,
         "response": token,
-    })
+    }, timeout=(0.5, 1.5))
     assert result is False
 
 
-@patch('requests.post')
 def test_verify_recaptcha_fail_no_success(mock_post):
     # Arrange
     mock_response = Mock()
@@ -72,15 +81,15 @@ def test_verify_recaptcha_fail_no_success(mock_post):
     mock_post.assert_called_once_with(RECAPTCHA_URL, params={
         "secret": secret_key,
         "response": token,
-    })
+    }, timeout=(0.5, 1.5))
     assert result is False
 
 
-@patch('requests.post')
 def test_verify_recaptcha_fail_status_code(mock_post):
     # Arrange
     mock_response = Mock()
     mock_response.status_code = 500
+    mock_response.headers = {}
     mock_response.json.return_value = {}  # Doesn't matter what's in here for this test
     mock_post.return_value = mock_response
     secret_key = "my_secret_key"
@@ -89,9 +98,10 @@ def test_verify_recaptcha_fail_status_code(mock_post):
     # Act and Assert
     with pytest.raises(EarlyExitException):
         verify_recaptcha(secret_key, token)
+    # 5XX responses are retried before giving up
+    assert mock_post.call_count == 3
 
 
-@patch('requests.post')
 def test_verify_recaptcha_fail_no_json(mock_post):
     # Arrange
     mock_response = Mock()
@@ -104,3 +114,22 @@ def test_verify_recaptcha_fail_no_json(mock_post):
     # Act and Assert
     with pytest.raises(EarlyExitException):
         verify_recaptcha(secret_key, token)
+
+
+def test_verify_recaptcha_caches_verdict_for_token(mock_post):
+    # Arrange
+    mock_response = Mock()
+    mock_response.status_code = 200
+    mock_response.json.return_value = {
+        "success": True,
+        "score": SCORE_THRESH + 0.1
+    }
+    mock_post.return_value = mock_response
+
+    # Act
+    first = verify_recaptcha("my_secret_key", "my_token")
+    second = verify_recaptcha("my_secret_key", "my_token")
+
+    # Assert
+    assert first is True and second is True
+    mock_post.assert_called_once()
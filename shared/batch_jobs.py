@@ -0,0 +1,97 @@
+"""
+How prediction jobs are described to the batch container, shared by the lambdas that submit
+jobs, the lambda that records their status and the container that runs them.
+
+A single job gets its input on the command line. An array job gets a manifest instead: a JSON
+object in S3 listing every input, from which each child takes the slice for its
+AWS_BATCH_JOB_ARRAY_INDEX.
+
+Array jobs docs: https://docs.aws.amazon.com/batch/latest/userguide/array_jobs.html
+"""
+import json
+import math
+
+INPUT_PREFIX = "input/"
+OUTPUT_PREFIX = "output/"
+MANIFEST_PREFIX = "manifests/"
+# job_runner's live progress for each running input, merged into statuses by the job_status lambda
+PROGRESS_PREFIX = "progress/"
+MODEL_ARG = "--model_path"
+MODEL_PATTERN = "/models/{species}.pt"
+CPU_ARG = "--use_cpu"
+MULTI_PROTEIN_ARG = "--multi_protein"
+MANIFEST_ARG = "--manifest"
+ARRAY_INDEX_ENV = "AWS_BATCH_JOB_ARRAY_INDEX"
+# Batch rejects array jobs with fewer children than this
+MIN_ARRAY_SIZE = 2
+# job_runner options that the lambdas may pass to every job they submit, see load_job_options. Anything
+# left out keeps job_runner's default, so changing how output is written is always an explicit choice.
+JOB_RUNNER_OPTIONS = ("output_encoding", "scores_format", "memory_mode", "prediction_store")
+
+
+def load_job_options(config: str = None) -> dict:
+    """
+    job_runner options from a JSON object, e.g. '{"output_encoding": "gzip"}' for --output_encoding gzip.
+    Raises ValueError for options not in JOB_RUNNER_OPTIONS.
+    """
+    options = json.loads(config or "{}")
+    unknown = sorted(set(options) - set(JOB_RUNNER_OPTIONS))
+    if unknown:
+        raise ValueError(f"Unknown job_runner options {unknown}, expected some of {list(JOB_RUNNER_OPTIONS)}")
+    return options
+
+
+def prediction_command(bucket: str, input_id: str, species: str, use_cpu: bool = False,
+                       multi_protein: bool = False, options: dict = None) -> list:
+    """
+    job_runner arguments for predicting input_id with the model for species.
+    With multi_protein every protein in the input is predicted, otherwise only the first.
+    options are other job_runner options, see load_job_options.
+    """
+    command = [bucket, input_id, INPUT_PREFIX, OUTPUT_PREFIX, MODEL_ARG, MODEL_PATTERN.format(species=species)]
+    if use_cpu:
+        command.append(CPU_ARG)
+    if multi_protein:
+        command.append(MULTI_PROTEIN_ARG)
+    for name, value in sorted((options or {}).items()):
+        command.extend([f"--{name}", str(value)])
+    return command
+
+
+def manifest_key(job_name: str) -> str:
+    return f"{MANIFEST_PREFIX}{job_name}.json"
+
+
+def progress_key(input_id: str) -> str:
+    return f"{PROGRESS_PREFIX}{input_id}.json"
+
+
+def build_manifest(bucket: str, inputs: list, inputs_per_child: int = 1, options: dict = None) -> dict:
+    """
+    Manifest for an array job over inputs, a list of
+    {"input_id": ..., "species": ..., "use_cpu": ..., "multi_protein": ...} where use_cpu and multi_protein are optional.
+    Inputs for the same species are kept next to each other, so a child that gets several
+    inputs can load each model once. inputs_per_child is lowered if needed so the array
+    has at least MIN_ARRAY_SIZE children. options are passed to every job, see prediction_command.
+    """
+    inputs = sorted(inputs, key=lambda i: i["species"])
+    inputs_per_child = max(1, min(inputs_per_child, math.ceil(len(inputs) / MIN_ARRAY_SIZE)))
+    return {
+        "inputs_per_child": inputs_per_child,
+        "jobs": [{"input_id": i["input_id"],
+                  "command": prediction_command(bucket, i["input_id"], i["species"], i.get("use_cpu", False),
+                                                i.get("multi_protein", False), options)}
+                 for i in inputs],
+    }
+
+
+def array_size(manifest: dict) -> int:
+    return math.ceil(len(manifest["jobs"]) / manifest["inputs_per_child"])
+
+
+def child_jobs(manifest: dict, index: int) -> list:
+    """
+    The manifest entries run by the child with the given AWS_BATCH_JOB_ARRAY_INDEX.
+    """
+    per_child = manifest["inputs_per_child"]
+    return manifest["jobs"][index * per_child:(index + 1) * per_child]
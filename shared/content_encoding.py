@@ -0,0 +1,122 @@
+"""
+Transparent gzip and zstd handling for FASTA inputs and outputs.
+
+Compressed inputs are recognized by their magic bytes rather than by name or headers, so
+clients can upload either form through any path. zstd needs the optional zstandard package;
+without it zstd inputs are rejected and only gzip can be written.
+"""
+import gzip
+import io
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+IDENTITY = "identity"
+ENCODINGS = (IDENTITY, GZIP, ZSTD)
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+MAGIC_BYTES = max(len(GZIP_MAGIC), len(ZSTD_MAGIC))
+
+# Fast levels: FASTA compresses well even at these, and compression sits on the upload path
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+class CompressionError(ValueError):
+    """
+    Raised for data that can't be decompressed.
+    """
+
+
+class DecompressedTooLarge(CompressionError):
+    """
+    Raised when data decompresses to more than allowed.
+    """
+
+
+# What the decompressors raise for corrupt or truncated data
+DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+def detect_encoding(head: bytes) -> str:
+    """
+    The encoding of data starting with head: GZIP, ZSTD or IDENTITY.
+    """
+    if head.startswith(GZIP_MAGIC):
+        return GZIP
+    if head.startswith(ZSTD_MAGIC):
+        return ZSTD
+    return IDENTITY
+
+
+class _CheckedReader(io.RawIOBase):
+    """
+    Passes reads through to a decompressing stream. Turns its errors into CompressionError,
+    and raises DecompressedTooLarge once more than max_bytes have been read.
+    """
+
+    def __init__(self, stream, max_bytes: int = None):
+        self._stream = stream
+        self._remaining = max_bytes
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        try:
+            data = self._stream.read(len(buffer))
+        except DECOMPRESSION_ERRORS as e:
+            raise CompressionError(f"Could not decompress: {e}")
+        if self._remaining is not None:
+            self._remaining -= len(data)
+            if self._remaining < 0:
+                raise DecompressedTooLarge("Decompressed data is larger than allowed")
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_decompressed(stream, max_bytes: int = None):
+    """
+    Wraps a binary stream so that reads return decompressed data, decompressing as it is read.
+    Uncompressed data is passed through. Returns (reader, encoding).
+    Reading corrupt data raises CompressionError, and with max_bytes, reading more than that many
+    decompressed bytes raises DecompressedTooLarge.
+    """
+    stream = stream if hasattr(stream, "peek") else io.BufferedReader(stream)
+    encoding = detect_encoding(stream.peek(MAGIC_BYTES)[:MAGIC_BYTES])
+    if encoding == GZIP:
+        reader = gzip.GzipFile(fileobj=stream, mode="rb")
+    elif encoding == ZSTD:
+        if zstandard is None:
+            raise CompressionError("zstd input is not supported, the zstandard package is not installed")
+        reader = zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+    else:
+        return stream, encoding
+    return io.BufferedReader(_CheckedReader(reader, max_bytes)), encoding
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == GZIP:
+        # mtime=0 keeps the output the same for the same input
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise CompressionError("zstd output is not supported, the zstandard package is not installed")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return data
+
+
+def object_headers(encoding: str, content_type: str) -> dict:
+    """
+    put_object arguments describing data in this encoding, so that HTTP clients decompress it on download.
+    """
+    headers = {"ContentType": content_type}
+    if encoding != IDENTITY:
+        headers["ContentEncoding"] = encoding
+    return headers
@@ -0,0 +1,193 @@
+"""
+Per-job timing and resource metrics, shared by the batch container and the lambdas.
+
+Each job collects wall time per named stage plus a few sizes and counts, then emits them
+as one JSON line in CloudWatch embedded metric format (EMF). In Lambda, CloudWatch turns
+that line into metrics automatically. Anywhere else it's still one queryable log line per job.
+
+EMF spec: https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+"""
+import json
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+NAMESPACE = "CoLLAGE"
+# Highest GPU peak seen since the last reset_peak_gpu_bytes, across resets made by hold_peak_gpu_bytes' callers
+_held_gpu_peak = 0
+
+
+def percentile(values: list, pct: float) -> float:
+    """
+    The nearest-rank pct percentile of values, e.g. 95 for the p95 the benchmarks report.
+    """
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_bytes() -> int:
+    """
+    The peak RSS of the whole process since it started, so it covers every job the process has run.
+    Unlike the GPU peak it can't be reset.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _cuda():
+    # Only check if torch is already loaded, importing it just for this would be slow
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return None
+    return torch.cuda
+
+
+def peak_gpu_bytes():
+    """
+    Peak GPU memory allocated by torch since reset_peak_gpu_bytes, or None if torch isn't loaded or there's no GPU.
+    """
+    cuda = _cuda()
+    if cuda is None:
+        return None
+    return max(_held_gpu_peak, cuda.max_memory_allocated())
+
+
+def reset_peak_gpu_bytes():
+    """
+    Starts peak_gpu_bytes over, e.g. at the start of a job in a process that runs several.
+    """
+    global _held_gpu_peak
+    _held_gpu_peak = 0
+    cuda = _cuda()
+    if cuda is not None:
+        cuda.reset_peak_memory_stats()
+
+
+def hold_peak_gpu_bytes(peak: int):
+    """
+    Keeps peak counting towards peak_gpu_bytes. Called before resetting torch's peak to measure something
+    smaller than a job, e.g. one beam search in memory_model.py.
+    """
+    global _held_gpu_peak
+    _held_gpu_peak = max(_held_gpu_peak, peak)
+
+
+class JobMetrics:
+    """
+    Collects metrics for one job. Safe to use from several threads at once.
+
+    Usage:
+        metrics = JobMetrics("job_runner", job_id="abc")
+        with metrics.stage("s3_get"):
+            ...
+        metrics.put_metric("input_bytes", 1234, "Bytes")
+        metrics.emit()
+    """
+
+    def __init__(self, service: str, job_id: str = None, namespace: str = NAMESPACE, stream=None, on_stage=None):
+        """
+        on_stage, if given, is called as on_stage(name, None) when a stage starts
+        and as on_stage(name, seconds) when it ends, e.g. to report progress.
+        """
+        self.service = service
+        self.namespace = namespace
+        self.stream = stream
+        self.on_stage = on_stage
+        self._metrics = {}
+        self._units = {}
+        self._properties = {}
+        self._lock = threading.Lock()
+        if job_id is not None:
+            self.set_property("job_id", job_id)
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times the wrapped block as {name}_seconds. Time for a stage that runs more than once is summed.
+        """
+        start = time.perf_counter()
+        if self.on_stage:
+            self.on_stage(name, None)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                key = f"{name}_seconds"
+                self._metrics[key] = self._metrics.get(key, 0) + elapsed
+                self._units[key] = "Seconds"
+            if self.on_stage:
+                self.on_stage(name, elapsed)
+
+    def put_metric(self, name: str, value, unit: str = "None"):
+        with self._lock:
+            self._metrics[name] = value
+            self._units[name] = unit
+
+    def set_property(self, name: str, value):
+        """
+        Adds a field to the log line that is not a metric, e.g. an id to search by.
+        """
+        with self._lock:
+            self._properties[name] = value
+
+    def record_sequence_lengths(self, lengths: list):
+        lengths = list(lengths)
+        self.put_metric("sequence_count", len(lengths), "Count")
+        self.put_metric("total_residues", sum(lengths), "Count")
+        if lengths:
+            self.put_metric("max_sequence_length", max(lengths), "Count")
+
+    def record_peak_memory(self):
+        self.put_metric("peak_rss_bytes", peak_rss_bytes(), "Bytes")
+        gpu_bytes = peak_gpu_bytes()
+        if gpu_bytes is not None:
+            self.put_metric("peak_gpu_bytes", gpu_bytes, "Bytes")
+
+    @contextmanager
+    def peak_memory(self):
+        """
+        Records the peak GPU memory of the wrapped block alone, for a job that shares its process with others.
+        peak_rss_bytes is still the process's, so peak_rss_growth_bytes records how much the block raised it.
+        """
+        reset_peak_gpu_bytes()
+        rss_before = peak_rss_bytes()
+        try:
+            yield
+        finally:
+            self.record_peak_memory()
+            self.put_metric("peak_rss_growth_bytes", peak_rss_bytes() - rss_before, "Bytes")
+
+    @property
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self._metrics)
+
+    def to_emf(self) -> dict:
+        with self._lock:
+            return {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": self.namespace,
+                        "Dimensions": [["service"]],
+                        "Metrics": [{"Name": name, "Unit": self._units[name]} for name in self._metrics],
+                    }],
+                },
+                "service": self.service,
+                **self._properties,
+                **self._metrics,
+            }
+
+    def emit(self) -> dict:
+        """
+        Records peak memory, unless peak_memory already did, and writes the job's metrics as a single JSON line.
+        """
+        if "peak_rss_bytes" not in self.metrics:
+            self.record_peak_memory()
+        record = self.to_emf()
+        print(json.dumps(record), file=self.stream or sys.stdout, flush=True)
+        return record
@@ -0,0 +1,108 @@
+"""
+A compact index of job statuses, so that status reads don't need one S3 GET per job.
+
+Statuses are kept in STATUS_SHARDS JSON objects under INDEX_PREFIX, each holding
+{job id: {"status", "statusReason", "updatedAt"}} for the jobs whose id hashes to it.
+The job_status_change lambda updates the index on every Batch event, and the job_status
+lambda reads it to answer status queries for many jobs at once. Entries that haven't been
+updated for RETENTION_SECONDS are dropped so shards stay small.
+
+Each shard is rewritten whole, so concurrent writers use S3 conditional writes: a shard is only
+replaced if its ETag is still the one that was read (or created if it still doesn't exist), and a
+writer that loses the race reads the shard again and retries its update on top of the winner's.
+Batch events can arrive out of order, so entries are stamped with the time of the event that reported
+them and an entry never replaces a newer one, nor a finished job's final status.
+"""
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+INDEX_PREFIX = "status-index/"
+STATUS_SHARDS = 256
+RETENTION_SECONDS = 14 * 24 * 60 * 60
+STATUS_FIELDS = ("status", "statusReason")
+# Tries at a shard's read and conditional write before giving up. Each lost race means another writer succeeded.
+MAX_WRITE_ATTEMPTS = 10
+TERMINAL_STATUSES = {"SUCCEEDED", "FAILED"}
+# Shards updated at once. An array job's events touch many shards, each a read and a write.
+UPDATE_THREADS = 16
+
+
+def shard_key(job_id: str) -> str:
+    shard = int(hashlib.sha256(job_id.encode()).hexdigest()[:8], 16) % STATUS_SHARDS
+    return f"{INDEX_PREFIX}{shard:03d}.json"
+
+
+def _is_code(error: ClientError, *codes) -> bool:
+    return error.response["Error"]["Code"] in codes
+
+
+def read_shard(s3_client, bucket: str, key: str, etag: str = None) -> tuple:
+    """
+    Returns (entries, etag) for a shard, with no entries for a shard that doesn't exist yet.
+    With the etag of an earlier read, returns (None, etag) if the shard hasn't changed since, without downloading it.
+    """
+    kwargs = {"IfNoneMatch": etag} if etag else {}
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=key, **kwargs)
+    except ClientError as e:
+        if _is_code(e, "304", "NotModified"):
+            return None, etag
+        if _is_code(e, "404", "NoSuchKey", "NotFound"):
+            return {}, None
+        raise
+    return json.loads(response["Body"].read()), response.get("ETag")
+
+
+def status_entry(job_info: dict, now: float = None) -> dict:
+    entry = {field: job_info.get(field) for field in STATUS_FIELDS}
+    entry["updatedAt"] = int(now if now is not None else time.time())
+    return entry
+
+
+def _supersedes(entry: dict, current: dict) -> bool:
+    if current is None:
+        return True
+    if entry["updatedAt"] < current["updatedAt"]:
+        return False
+    if current["status"] in TERMINAL_STATUSES and entry["status"] not in TERMINAL_STATUSES:
+        # Only a later submission, which reuses the id of a failed job, starts the job over
+        return entry["status"] == "SUBMITTED" and entry["updatedAt"] > current["updatedAt"]
+    return True
+
+
+def _update_shard(s3_client, bucket: str, key: str, updates: dict, now: float):
+    for attempt in range(1, MAX_WRITE_ATTEMPTS + 1):
+        entries, etag = read_shard(s3_client, bucket, key)
+        entries = {job_id: entry for job_id, entry in entries.items()
+                   if now - entry["updatedAt"] < RETENTION_SECONDS}
+        entries.update({job_id: entry for job_id, entry in updates.items()
+                        if _supersedes(entry, entries.get(job_id))})
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        try:
+            s3_client.put_object(Body=json.dumps(entries, separators=(",", ":")).encode(), Bucket=bucket, Key=key,
+                                 ContentType="application/json", **condition)
+            return
+        except ClientError as e:
+            # 409 is S3's answer when a conflicting write to the same key is still in progress
+            if not _is_code(e, "412", "PreconditionFailed", "409", "ConditionalRequestConflict") \
+                    or attempt == MAX_WRITE_ATTEMPTS:
+                raise
+
+
+def update_index(s3_client, bucket: str, statuses: dict, now: float = None):
+    """
+    Records {job id: job info}, as reported at time now, in the index. Each shard touched takes one read and
+    one conditional write, and more if another writer changed it in between. Shards are updated concurrently.
+    """
+    now = now if now is not None else time.time()
+    by_shard = {}
+    for job_id, job_info in statuses.items():
+        by_shard.setdefault(shard_key(job_id), {})[job_id] = status_entry(job_info, now)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(UPDATE_THREADS, len(by_shard)))) as pool:
+        # list() so that a failed shard's exception is raised here
+        list(pool.map(lambda item: _update_shard(s3_client, bucket, item[0], item[1], now), by_shard.items()))